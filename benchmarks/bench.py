@@ -0,0 +1,298 @@
+"""
+This module benchmarks the hot paths of both games.
+It runs headless: pygame uses the dummy SDL video driver and matplotlib
+the Agg backend. Every case is seeded and swept over a few board sizes,
+the setup of a case is not timed.
+
+Results are written to JSON, and compared to a saved baseline when one is
+given: a case regresses when its best time grows by more than the
+threshold, and the exit status is 1 if any case regressed. Usage:
+
+    python benchmarks/bench.py --out bench.json
+    python benchmarks/bench.py --baseline bench.json --threshold 1.2
+    python benchmarks/bench.py --filter cross --quick
+"""
+
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import argparse
+import asyncio
+import copy
+import json
+import platform
+import statistics
+import sys
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CROSS_DIR = os.path.join(ROOT, "cross")
+MINES_DIR = os.path.join(ROOT, "mines")
+sys.path[:0] = [CROSS_DIR, MINES_DIR]
+
+SEED = 1234
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 1.2
+# fast cases are looped so a sample lasts at least this long
+MIN_SAMPLE_TIME = 0.01
+MINE_DENSITY = 0.15
+# the reveal cascade is recursive, one frame per revealed cell
+sys.setrecursionlimit(100000)
+
+MINES_SIZES = [(16, 30), (32, 64), (64, 64)]
+CROSS_SIZES = [(64, 64), (256, 256), (1024, 1024)]
+QUICK_MINES_SIZES = MINES_SIZES[:1]
+QUICK_CROSS_SIZES = CROSS_SIZES[:2]
+
+CASES = {}
+
+
+def case(name, group):
+    """
+    Register a benchmark case of a group ("mines" or "cross").
+    The case is called with a board size and returns the function to
+    time and, optionally, a setup function called before each run
+    """
+    def register(func):
+        CASES[name] = (group, func)
+        return func
+
+    return register
+
+
+def load_mines():
+    """
+    Import the Minesweeper module, its assets are loaded relative to its
+    directory
+    """
+    cwd = os.getcwd()
+    os.chdir(MINES_DIR)
+    try:
+        import main
+        game = main.Minesweeper()
+    finally:
+        os.chdir(cwd)
+    return main, game
+
+
+def mines_board(main, game, size):
+    """
+    Generate a seeded Minesweeper grid of the given size
+    """
+    np.random.seed(SEED)
+    return game.init_grid(size, int(size[0] * size[1] * MINE_DENSITY))
+
+
+def partial_board(main, grid):
+    """
+    Reveal about half of the safe cells and flag a few mines, and encode
+    the grid like Minesweeper.next_day
+    """
+    rng = np.random.default_rng(SEED)
+    board = []
+    for row in grid:
+        line = []
+        for cell in row:
+            if cell.is_mine():
+                line.append(main.FLAG_MINE if rng.random() < 0.3 else "_")
+            else:
+                line.append(str(cell.value) if rng.random() < 0.5 else "_")
+        board.append(line)
+    return board
+
+
+@case("mines.generate", "mines")
+def bench_generate(size):
+    main, game = load_mines()
+    return lambda: mines_board(main, game, size), None
+
+
+@case("mines.reveal_cascade", "mines")
+def bench_reveal(size):
+    main, game = load_mines()
+    template = mines_board(main, game, size)
+    # the first empty cell starts a cascade
+    start = next(
+        (i, j) for i, row in enumerate(template)
+        for j, cell in enumerate(row) if cell.is_empty()
+    )
+
+    def setup():
+        game.grid = copy.deepcopy(template)
+
+    return lambda: game.reveal_cell(*start), setup
+
+
+@case("mines.transition", "mines")
+def bench_transition(size):
+    main, game = load_mines()
+    board = partial_board(main, mines_board(main, game, size))
+    return lambda: main.MinesweeperRules(board).transition(), None
+
+
+@case("mines.undo_snapshot", "mines")
+def bench_undo(size):
+    main, game = load_mines()
+    game.grid = mines_board(main, game, size)
+    return game.update_last_visible_grid, None
+
+
+@case("mines.render", "mines")
+def bench_mines_render(size):
+    main, game = load_mines()
+    game.grid = mines_board(main, game, size)
+    for row in game.grid[::2]:
+        for cell in row:
+            cell.hidden = cell.is_mine()
+    loop = asyncio.new_event_loop()
+    return lambda: loop.run_until_complete(game.draw_grid()), None
+
+
+def cross_engine(mode, size):
+    from engine import StepEngine
+    from board import random_grid
+    engine = StepEngine(random_grid(size, SEED), mode)
+    # evaluate all cells in every run, the worst case
+    return engine.step, lambda: engine.set_mode(mode)
+
+
+@case("cross.step_cross", "cross")
+def bench_cross_step(size):
+    return cross_engine("cross", size)
+
+
+@case("cross.step_conway", "cross")
+def bench_conway_step(size):
+    return cross_engine("conway", size)
+
+
+@case("cross.create_grid", "cross")
+def bench_create_grid(size):
+    from board import random_grid
+    return lambda: random_grid(size, SEED), None
+
+
+@case("cross.render", "cross")
+def bench_cross_render(size):
+    import crossfinder
+    game = crossfinder.GameOfLife(size, seed=SEED)
+    game.fig.canvas.draw()
+    return game.update_grid, game.apply_rules
+
+
+def calibrate(run):
+    """
+    Get the number of calls of a sample, so a sample lasts at least
+    MIN_SAMPLE_TIME
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        if time.perf_counter() - start >= MIN_SAMPLE_TIME:
+            return number
+        number *= 2
+
+
+def measure(run, setup, repeat, number=1):
+    """
+    Time a function repeat times, returns the time of a call in seconds
+    for every sample
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        times.append((time.perf_counter() - start) / number)
+    return times
+
+
+def run_cases(pattern="", repeat=DEFAULT_REPEAT, quick=False):
+    """
+    Run the cases whose name contains pattern over their size sweeps
+    """
+    sizes = {
+        "mines": QUICK_MINES_SIZES if quick else MINES_SIZES,
+        "cross": QUICK_CROSS_SIZES if quick else CROSS_SIZES,
+    }
+    results = {}
+    for name, (group, func) in CASES.items():
+        if pattern not in name:
+            continue
+        for size in sizes[group]:
+            run, setup = func(size)
+            # warm up caches and lazily compiled kernels
+            measure(run, setup, 1)
+            # a setup must run before every call
+            number = 1 if setup is not None else calibrate(run)
+            times = measure(run, setup, repeat, number)
+            key = f"{name}[{size[0]}x{size[1]}]"
+            results[key] = {
+                "min": min(times),
+                "median": statistics.median(times),
+                "repeat": repeat,
+                "number": number,
+            }
+            print(f"{key:40} {results[key]['median'] * 1000:10.3f} ms")
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare the best times to a baseline, the least noisy measure.
+    Returns the regressed cases as a dict of name to ratio
+    """
+    regressions = {}
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        ratio = result["min"] / baseline[key]["min"]
+        if ratio > threshold:
+            regressions[key] = ratio
+        print(f"{key:40} {ratio:6.2f}x {'REGRESSED' if ratio > threshold else ''}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the game engines")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare to the results in this JSON file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="slowdown ratio counted as a regression")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--filter", default="", help="only run matching cases")
+    parser.add_argument("--quick", action="store_true", help="only the small sizes")
+    args = parser.parse_args(argv)
+
+    results = run_cases(args.filter, args.repeat, args.quick)
+    report = {
+        "meta": {
+            "seed": SEED,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""
+This module benchmarks the capacity of the Minesweeper game server
+(mines/server.py) from the same machine. Every connection plays its own
+share of the sessions: it picks one of them at random and sends a move,
+mostly reveals of hidden cells, some flags and undos, waits for the
+answer and applies the state diff to its copy of the board. Finished
+games are closed and replaced by new ones.
+
+The latency of every request is measured by the client. The report gives
+the throughput, the percentiles per op, and the stats of the server.
+With --spawn the server is started on a free port for the run, with the
+given eviction settings, and stopped at the end. Usage:
+
+    python benchmarks/loadgen.py --spawn --connections 32 --sessions 2000
+    python benchmarks/loadgen.py --port 8766 --duration 30 --out load.json
+    python benchmarks/loadgen.py --spawn --idle-seconds 2 --max-live 500
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8766
+DEFAULT_CONNECTIONS = 16
+DEFAULT_SESSIONS = 1000
+DEFAULT_DURATION = 10.0
+# the share of the moves, the rest are reveals
+FLAG_SHARE = 0.15
+UNDO_SHARE = 0.05
+# as kernels.py
+HIDDEN_CELL = -1
+
+
+class Client:
+    """
+    A class to represent a connection to the server
+
+    Attributes
+    ----------
+    latencies : dict
+        The latencies of every op, in seconds
+    boards : dict
+        The boards of the sessions of the connection, by session id
+    """
+
+    def __init__(self, reader, writer, rng):
+        self.reader = reader
+        self.writer = writer
+        self.rng = rng
+        self.latencies = {}
+        self.errors = 0
+        self.boards = {}
+        self.next_id = 0
+
+    async def request(self, op, **fields):
+        self.next_id += 1
+        message = {"id": self.next_id, "op": op, **fields}
+        start = time.perf_counter()
+        self.writer.write(json.dumps(message).encode() + b"\n")
+        response = json.loads(await self.reader.readline())
+        self.latencies.setdefault(op, []).append(time.perf_counter() - start)
+        if "error" in response:
+            self.errors += 1
+        return response
+
+    async def new_session(self, rows, cols, mines):
+        response = await self.request("new", rows=rows, cols=cols, mines=mines,
+                                      seed=int(self.rng.integers(2 ** 63)))
+        self.boards[response["session"]] = np.array(response["board"], dtype=np.int8)
+
+    async def move(self, rows, cols, mines):
+        """
+        Play a move on one of the sessions, and replace the session when
+        its game is over
+        """
+        session = list(self.boards)[self.rng.integers(len(self.boards))]
+        board = self.boards[session]
+        draw = self.rng.random()
+        if draw < UNDO_SHARE:
+            response = await self.request("undo", session=session)
+        else:
+            op = "flag" if draw < UNDO_SHARE + FLAG_SHARE else "reveal"
+            # flags are toggled on the hidden cells, flagged or not
+            cells = np.flatnonzero(board == HIDDEN_CELL if op == "reveal" else board < 0)
+            cell = int(cells[self.rng.integers(len(cells))])
+            response = await self.request(op, session=session, row=cell // cols,
+                                          col=cell % cols)
+        if "error" in response:
+            return
+        board[response["cells"]] = response["values"]
+        if response["status"] != "playing":
+            await self.request("close", session=session)
+            del self.boards[session]
+            await self.new_session(rows, cols, mines)
+
+
+async def run_client(host, port, sessions, size, mines, deadline, seed):
+    reader, writer = await asyncio.open_connection(host, port)
+    client = Client(reader, writer, np.random.default_rng(seed))
+    for _ in range(sessions):
+        await client.new_session(*size, mines)
+    while time.monotonic() < deadline:
+        await client.move(*size, mines)
+    writer.close()
+    return client
+
+
+def percentiles(latencies):
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1000
+    return {"count": len(latencies), "p50_ms": p50, "p90_ms": p90, "p99_ms": p99}
+
+
+async def server_stats(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'{"op": "stats"}\n')
+    stats = json.loads(await reader.readline())
+    writer.close()
+    return stats
+
+
+async def load(host, port, connections, sessions, size, mines, duration, seed):
+    """
+    Run the connections until the deadline, returns the report
+    """
+    start = time.monotonic()
+    deadline = start + duration
+    share = [sessions // connections + (k < sessions % connections)
+             for k in range(connections)]
+    clients = await asyncio.gather(*(
+        run_client(host, port, count, size, mines, deadline, [seed, k])
+        for k, count in enumerate(share)))
+    elapsed = time.monotonic() - start
+    latencies = {}
+    for client in clients:
+        for op, values in client.latencies.items():
+            latencies.setdefault(op, []).extend(values)
+    requests = sum(len(values) for values in latencies.values())
+    return {
+        "connections": connections,
+        "sessions": sessions,
+        "seconds": elapsed,
+        "requests": requests,
+        "throughput": requests / elapsed,
+        "errors": sum(client.errors for client in clients),
+        "latency": {op: percentiles(values) for op, values in sorted(latencies.items())},
+        "server": await server_stats(host, port),
+    }
+
+
+def free_port(host):
+    with socket.socket() as probe:
+        probe.bind((host, 0))
+        return probe.getsockname()[1]
+
+
+def spawn_server(host, port, idle_seconds, max_live):
+    """
+    Start the server in a fresh interpreter and wait until it listens
+    """
+    command = [sys.executable, "server.py", "--host", host, "--port", str(port)]
+    if idle_seconds is not None:
+        command += ["--idle-seconds", str(idle_seconds)]
+    if max_live is not None:
+        command += ["--max-live", str(max_live)]
+    process = subprocess.Popen(command, cwd=os.path.join(ROOT, "mines"),
+                               stdout=subprocess.PIPE, text=True)
+    process.stdout.readline()  # the server prints once it listens
+    return process
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Minesweeper game server")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--spawn", action="store_true",
+                        help="start a server on a free port for the run")
+    parser.add_argument("--idle-seconds", type=float, help="eviction of the spawned server")
+    parser.add_argument("--max-live", type=int, help="eviction of the spawned server")
+    parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS)
+    parser.add_argument("--sessions", type=int, default=DEFAULT_SESSIONS)
+    parser.add_argument("--size", nargs=2, type=int, default=(16, 30), metavar=("ROWS", "COLS"))
+    parser.add_argument("--mines", type=int, default=99)
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    server = None
+    port = args.port
+    if args.spawn:
+        port = free_port(args.host)
+        server = spawn_server(args.host, port, args.idle_seconds, args.max_live)
+    try:
+        report = asyncio.run(load(args.host, port, args.connections, args.sessions,
+                                  tuple(args.size), args.mines, args.duration, args.seed))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    print(f"{report['requests']} requests in {report['seconds']:.1f} s, "
+          f"{report['throughput']:.0f} req/s, {report['errors']} errors, "
+          f"{args.connections} connections, {args.sessions} sessions")
+    for op, latency in report["latency"].items():
+        print(f"  {op:8} {latency['count']:8d}  p50 {latency['p50_ms']:7.2f} ms"
+              f"  p90 {latency['p90_ms']:7.2f} ms  p99 {latency['p99_ms']:7.2f} ms")
+    stats = report["server"]
+    print(f"  server: live {stats['live']}, evicted {stats['evicted']}, "
+          f"loaded {stats['loaded']}, {stats['errors']} errors")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+This module reports the cold start of both games. Every launch is a fresh
+interpreter, like a browser or kiosk launch, run headless like bench.py.
+A launch imports the game module and builds the game object, and reports
+three times: the whole process, the import of the game module, and the
+game ready to draw (import plus construction).
+
+The import time of every module comes from python -X importtime, split
+into the import phase and the construction phase, where the lazy imports
+land. The slowest modules of each phase are listed by cumulative time:
+the imports of the game module, then the ones made while building the
+game, without their own imports.
+Usage:
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --game mines --cold-assets --top 5
+    python benchmarks/startup.py --out startup.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GAMES = {
+    # directory, module, expression building the game
+    "mines": (os.path.join(ROOT, "mines"), "main", "main.Minesweeper()"),
+    "cross": (os.path.join(ROOT, "cross"), "crossfinder", "crossfinder.GameOfLife()"),
+}
+DEFAULT_REPEAT = 3
+DEFAULT_TOP = 10
+# written to stderr between the import and the construction of the game
+MARKER = "startup: imported"
+
+LAUNCH = """
+import sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+sys.stderr.write("{marker}\\n")
+sys.stderr.flush()
+{factory}
+print(imported - start, time.perf_counter() - start)
+"""
+
+
+def parse_importtime(lines):
+    """
+    Parse the lines of python -X importtime, returns (module, self,
+    cumulative, depth) tuples in microseconds, depth 0 being imported by
+    the launch itself
+    """
+    modules = []
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        if not own.strip().isdigit():
+            continue  # the header
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), int(own), int(cumulative), depth))
+    return modules
+
+
+def launch(game, env):
+    """
+    Start a game in a fresh interpreter, returns the process, import and
+    ready times in seconds and the imports of both phases
+    """
+    directory, module, factory = GAMES[game]
+    code = LAUNCH.format(module=module, marker=MARKER, factory=factory)
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=directory, env=env, capture_output=True, text=True, check=True)
+    process = time.perf_counter() - start
+    imported, ready = map(float, result.stdout.split()[-2:])
+    lines = result.stderr.splitlines()
+    split = lines.index(MARKER)
+    return {
+        "process": process,
+        "import": imported,
+        "ready": ready,
+        "phases": {
+            "import": parse_importtime(lines[:split]),
+            "construction": parse_importtime(lines[split + 1:]),
+        },
+    }
+
+
+def slowest(modules, depth, top):
+    """
+    Get the slowest imports at a depth by cumulative time
+    """
+    direct = [entry for entry in modules if entry[3] == depth]
+    return sorted(direct, key=lambda entry: -entry[2])[:top]
+
+
+def report(game, repeat=DEFAULT_REPEAT, top=DEFAULT_TOP, cold_assets=False):
+    """
+    Launch a game repeat times and print the breakdown of the fastest
+    launch, the least noisy one
+    """
+    env = dict(os.environ)
+    env.setdefault("SDL_VIDEODRIVER", "dummy")
+    env.setdefault("SDL_AUDIODRIVER", "dummy")
+    env.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+    env.setdefault("MPLBACKEND", "Agg")
+    launches = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as cache:
+            if cold_assets:
+                # an empty asset cache, see mines/assets.py
+                env["MINESWEEPER_ASSET_CACHE"] = cache
+            launches.append(launch(game, env))
+    best = min(launches, key=lambda result: result["process"])
+    print(f"{game:8} process {best['process'] * 1000:8.1f} ms"
+          f"   import {best['import'] * 1000:8.1f} ms"
+          f"   ready {best['ready'] * 1000:8.1f} ms")
+    for phase, modules in best["phases"].items():
+        print(f"  {phase} phase, {len(modules)} modules")
+        # the game module is the only import of the launch
+        depth = 1 if phase == "import" else 0
+        for name, _, cumulative, _ in slowest(modules, depth, top):
+            print(f"    {cumulative / 1000:8.1f} ms  {name}")
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report the cold start of the games")
+    parser.add_argument("--game", choices=sorted(GAMES), action="append",
+                        help="the games to launch, all by default")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP,
+                        help="the number of modules listed per phase")
+    parser.add_argument("--cold-assets", action="store_true",
+                        help="start the Minesweeper with an empty asset cache")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = {
+        game: report(game, args.repeat, args.top, args.cold_assets)
+        for game in args.game or sorted(GAMES)
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+This module steps grids that don't fit in memory.
+The grid lives in a np.memmap and each generation is computed in bands of
+rows: a band is read with one row of context above and below into a small
+padded window, looked up with the compiled kernel and written to the next
+generation, so only the window is resident and the files are read and
+written sequentially.
+
+Like the step engine, the banded engine ping-pongs between two grids and
+keeps track of the bands that changed in the last step, so bands far from
+any change are neither read nor written.
+"""
+
+import hashlib
+import os
+import tempfile
+import numpy as np
+from engine import StepEngine
+from rulesets import get_kernel, check_states
+
+# size of the working window, bytes per cell: the padded rows, the codes,
+# the next states and the change mask
+BAND_BYTES = 64 << 20
+WINDOW_BYTES_PER_CELL = 1 + np.dtype(np.intp).itemsize + 1 + 1
+# larger change sets aren't built, changes reports a full replacement
+MAX_CHANGES = 1 << 20
+
+
+def band_rows_for(cols, band_bytes=BAND_BYTES):
+    """
+    Get the number of rows of a band that fits in band_bytes
+    """
+    return max(1, band_bytes // (cols * WINDOW_BYTES_PER_CELL))
+
+
+def scratch_grid(shape, directory=None):
+    """
+    Create a memory-mapped int8 grid in an anonymous temporary file,
+    removed when the grid is garbage collected
+    """
+    file = tempfile.TemporaryFile(dir=directory)
+    return np.memmap(file, dtype=np.int8, mode="w+", shape=shape)
+
+
+class BandedEngine(StepEngine):
+    """
+    A class to represent a step engine over memory-mapped grids
+
+    Attributes
+    ----------
+    buffers : list
+        The two memory-mapped grids, the current generation and the previous one
+    band_rows : int
+        The number of rows computed at once
+    dirty : np.ndarray
+        The bands changed in the last step, None to evaluate all bands
+    """
+
+    def __init__(self, grid, mode="cross", band_rows=None, directory=None):
+        # the temporary grids are created next to the input by default
+        if directory is None and isinstance(grid, np.memmap) and grid.filename:
+            directory = os.path.dirname(grid.filename)
+        self.directory = directory
+        self.band_rows = band_rows or band_rows_for(grid.shape[1])
+        super().__init__(grid, mode)
+
+    def allocate(self, shape):
+        """
+        Allocate the grids and the working window
+        """
+        rows, cols = shape
+        band = min(self.band_rows, rows)
+        self.buffers = [scratch_grid(shape, self.directory) for _ in range(2)]
+        self.bands = [(top, min(top + band, rows)) for top in range(0, rows, band)]
+        self.window = np.zeros((band + 2, cols + 2), dtype=np.int8)
+        self.codes = np.empty((band, cols), dtype=np.intp)
+        self.next = np.empty((band, cols), dtype=np.int8)
+        self.changed = np.empty((band, cols), dtype=bool)
+        self.shape = shape
+
+    @property
+    def grid(self):
+        """
+        The current generation, a memory-mapped grid.
+        Cells edited in place must be reported with mark_changed
+        """
+        return self.buffers[self.current]
+
+    def load(self, grid):
+        """
+        Replace the whole grid, copied band by band.
+        All bands are evaluated in the next step, which writes the whole
+        other grid, so only the current one is filled here.
+        Raises a ValueError when a cell isn't a state of the rules
+        """
+        check_states(grid)
+        if self.buffers is None or self.shape != grid.shape:
+            self.allocate(grid.shape)
+        self.current = 0
+        for top, bottom in self.bands:
+            self.buffers[0][top:bottom] = grid[top:bottom]
+        self.dirty = None
+
+    def set_mode(self, mode):
+        self.mode = mode
+        self.dirty = None
+
+    def mark_changed(self, rows, cols):
+        if self.dirty is not None:
+            self.dirty[np.asarray(rows) // self.band_rows] = True
+
+    def read_window(self, source, top, bottom):
+        """
+        Copy the rows of a band and their neighbors into the padded window
+        """
+        rows = len(source)
+        window = self.window[:bottom - top + 2]
+        first, last = max(top - 1, 0), min(bottom + 1, rows)
+        window[first - top + 1:last - top + 1, 1:-1] = source[first:last]
+        if top == 0:
+            window[0] = 0
+        if bottom == rows:
+            window[-1] = 0
+        return window
+
+    def step(self):
+        """
+        Apply the rules to the grid, band by band.
+        A band is evaluated when it or a neighboring band changed in the
+        last step, the other bands are equal in both grids.
+
+        Returns the number of changed cells
+        """
+        kernel = get_kernel(self.mode)
+        source = self.buffers[self.current]
+        target = self.buffers[1 - self.current]
+        if self.dirty is None:
+            active = np.ones(len(self.bands), dtype=bool)
+        else:
+            active = self.dirty.copy()
+            active[1:] |= self.dirty[:-1]
+            active[:-1] |= self.dirty[1:]
+        dirty = np.zeros(len(self.bands), dtype=bool)
+        count = 0
+        for b in np.flatnonzero(active):
+            top, bottom = self.bands[b]
+            height = bottom - top
+            window = self.read_window(source, top, bottom)
+            codes, next_rows = self.codes[:height], self.next[:height]
+            kernel.step_padded(window, codes, next_rows)
+            changed = np.not_equal(
+                next_rows, window[1:-1, 1:-1], out=self.changed[:height])
+            band_count = np.count_nonzero(changed)
+            count += band_count
+            dirty[b] = band_count > 0
+            # the other grid already holds these rows when the band
+            # changed neither in this step nor in the last one
+            if band_count or self.dirty is None or self.dirty[b]:
+                target[top:bottom] = next_rows
+        self.dirty = dirty
+        self.current = 1 - self.current
+        return count
+
+    def changes(self):
+        """
+        Get the change set of the last step as a tuple (values, rows, cols),
+        diffed between the two grids over the bands that changed.
+        None when the whole grid was replaced, or when more than
+        MAX_CHANGES cells changed so the change set stays small
+        """
+        if self.dirty is None:
+            return None
+        previous = self.buffers[1 - self.current]
+        parts = []
+        count = 0
+        for b in np.flatnonzero(self.dirty):
+            top, bottom = self.bands[b]
+            band = self.grid[top:bottom]
+            rows, cols = np.nonzero(band != previous[top:bottom])
+            count += len(rows)
+            if count > MAX_CHANGES:
+                return None
+            parts.append((band[rows, cols], rows + top, cols))
+        if not parts:
+            return (np.empty(0, dtype=np.int8), np.empty(0, dtype=np.intp),
+                    np.empty(0, dtype=np.intp))
+        return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+    def grid_hash(self):
+        """
+        Fingerprint of the current grid state, hashed band by band
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for top, bottom in self.bands:
+            digest.update(np.ascontiguousarray(self.grid[top:bottom]))
+        return digest.digest()
+
+    def copy_to(self, out):
+        """
+        Copy the current grid into out band by band
+        """
+        for top, bottom in self.bands:
+            out[top:bottom] = self.grid[top:bottom]
+
+
+def open_grid(path, shape=None):
+    """
+    Open a grid file without reading it: a .npy file, or a raw int8 file
+    of the given shape
+    """
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    return np.memmap(path, dtype=np.int8, mode="r", shape=shape)
+
+
+def write_generations(engine, path, generations, every=1):
+    """
+    Run the engine (a StepEngine or a BandedEngine) and write every k-th
+    generation to a .npy file of shape (generations // every + 1, rows,
+    cols), generation 0 included.
+    The file is memory-mapped and filled one generation at a time
+    """
+    saved = generations // every + 1
+    out = np.lib.format.open_memmap(
+        path, mode="w+", dtype=np.int8, shape=(saved,) + engine.grid.shape)
+    engine.copy_to(out[0])
+    # the generations after the last saved one are not computed
+    for generation in range(1, (saved - 1) * every + 1):
+        engine.step()
+        if generation % every == 0:
+            engine.copy_to(out[generation // every])
+    out.flush()
+    return out
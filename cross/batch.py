@@ -0,0 +1,189 @@
+"""
+This module runs the game headless, on many grids at once.
+Only the engine is used: nothing here imports matplotlib, so workers
+start fast and no GUI stack is built per grid.
+
+Grids are loaded from .npy files, text files (one row per line, cell
+states as digits, optionally separated by spaces or commas), RLE and
+plaintext patterns (.rle and .cells, see patterns.py), or generated
+from seeds with random_grid. Each grid is run with the rules of a mode for
+a number of steps, or until it reaches a fixed point or a short cycle, and
+the final grid is saved as <name>.npy in the output directory.
+
+The jobs are spread over a process pool. Workers receive paths and seeds
+rather than grids, and send back a short summary, so little data goes
+through the pipes. Usage:
+
+    python batch.py grids/*.npy --mode cross --until-stable --out results
+    python batch.py --seeds 0 1000 --size 64 64 --steps 200 --workers 8
+"""
+
+import argparse
+import json
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from engine import StepEngine
+from board import random_grid
+from rulesets import RULE_SETS, check_states
+from patterns import read_pattern
+
+DEFAULT_STEPS = 1000
+DEFAULT_OUTPUT = "results"
+SUMMARY_FILE = "summary.jsonl"
+
+# source is a file path or an int seed
+Job = namedtuple("Job", ["name", "source"])
+BatchResult = namedtuple(
+    "BatchResult", ["name", "generations", "status", "period", "live"])
+
+
+def load_grid(path):
+    """
+    Load a grid from a .npy file, a pattern file or a text file.
+    Raises a ValueError when a cell isn't a state of the rules
+    """
+    if path.endswith(".npy"):
+        grid = np.load(path)
+    elif path.endswith((".rle", ".cells")):
+        grid = read_pattern(path)
+    else:
+        grid = load_text_grid(path)
+    # checked before the cast, which would wrap large values
+    check_states(grid)
+    return grid.astype(np.int8, copy=False)
+
+
+def load_text_grid(path):
+    """
+    Load a grid from a text file
+    """
+    rows = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            cells = line.replace(",", " ").split()
+            if len(cells) == 1:
+                # compact rows: one digit per cell
+                cells = list(cells[0])
+            rows.append([int(cell) for cell in cells])
+    if len({len(row) for row in rows}) > 1:
+        raise ValueError(f"{path}: rows have different lengths")
+    return np.array(rows, dtype=np.int64)
+
+
+def run_grid(grid, mode="cross", steps=DEFAULT_STEPS, until_stable=False):
+    """
+    Run the rules of a mode on a grid.
+    Without until_stable exactly steps generations are applied, stopping
+    early only at a fixed point.
+
+    Returns the final grid and a StableResult
+    """
+    if mode not in RULE_SETS:
+        raise ValueError(f"unknown mode {mode!r}, expected one of {list(RULE_SETS)}")
+    engine = StepEngine(grid, mode)
+    if until_stable:
+        result = engine.run_until_stable(steps)
+    else:
+        result = None
+        for generation in range(steps):
+            if engine.step() == 0:
+                result = (generation, "fixed", 1)
+                break
+        if result is None:
+            result = (steps, "unresolved", 0)
+    return engine.grid.copy(), result
+
+
+def run_job(job, size, mode, steps, until_stable, output):
+    """
+    Load or generate the grid of a job, run it and save the final grid.
+    Runs in a worker process
+    """
+    if isinstance(job.source, str):
+        grid = load_grid(job.source)
+    else:
+        grid = random_grid(size, job.source)
+    final, (generations, status, period) = run_grid(grid, mode, steps, until_stable)
+    if output is not None:
+        np.save(os.path.join(output, job.name + ".npy"), final)
+    return BatchResult(job.name, generations, status, period, int(np.count_nonzero(final)))
+
+
+def make_jobs(paths=(), seeds=()):
+    """
+    Build the jobs of a batch, named after the files and seeds
+    """
+    jobs = [Job(os.path.splitext(os.path.basename(path))[0], path) for path in paths]
+    jobs += [Job(f"seed_{seed}", seed) for seed in seeds]
+    names = [job.name for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("jobs must have unique names")
+    return jobs
+
+
+def run_batch(jobs, size=(32, 32), mode="cross", steps=DEFAULT_STEPS,
+              until_stable=False, output=DEFAULT_OUTPUT, workers=None):
+    """
+    Run the jobs over a process pool, workers=1 runs them in this process.
+    Results are yielded in job order as they complete.
+    output is the directory of the final grids, None to skip saving
+    """
+    if output is not None:
+        os.makedirs(output, exist_ok=True)
+    args = (size, mode, steps, until_stable, output)
+    if workers == 1:
+        for job in jobs:
+            yield run_job(job, *args)
+        return
+    workers = workers or os.cpu_count()
+    # a few jobs per task to amortize the pickling of small jobs
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(workers) as pool:
+        yield from pool.map(
+            run_job, jobs, *([arg] * len(jobs) for arg in args), chunksize=chunksize)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the cross game on many grids")
+    parser.add_argument("paths", nargs="*", help="grid files, .npy, .rle, .cells or text")
+    parser.add_argument("--seeds", nargs=2, type=int, metavar=("START", "STOP"),
+                        help="also generate random grids for seeds in [START, STOP)")
+    parser.add_argument("--size", nargs=2, type=int, default=(32, 32),
+                        metavar=("ROWS", "COLS"), help="size of the generated grids")
+    parser.add_argument("--mode", default="cross", choices=list(RULE_SETS))
+    parser.add_argument("--steps", type=int, default=DEFAULT_STEPS,
+                        help="generations to run, the limit with --until-stable")
+    parser.add_argument("--until-stable", action="store_true",
+                        help="stop at a fixed point or a short cycle")
+    parser.add_argument("--out", default=DEFAULT_OUTPUT, help="output directory")
+    parser.add_argument("--no-save", action="store_true",
+                        help="only write the summary, not the final grids")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of processes, defaults to the number of CPUs")
+    args = parser.parse_args(argv)
+
+    seeds = range(*args.seeds) if args.seeds else ()
+    jobs = make_jobs(args.paths, seeds)
+    if not jobs:
+        parser.error("no grids, give paths or --seeds")
+    os.makedirs(args.out, exist_ok=True)
+    results = run_batch(
+        jobs, tuple(args.size), args.mode, args.steps, args.until_stable,
+        None if args.no_save else args.out, args.workers)
+    statuses = {}
+    with open(os.path.join(args.out, SUMMARY_FILE), "w", encoding="utf-8") as summary:
+        for result in results:
+            summary.write(json.dumps(result._asdict()) + "\n")
+            statuses[result.status] = statuses.get(result.status, 0) + 1
+    print(f"{len(jobs)} grids: " + ", ".join(f"{n} {s}" for s, n in sorted(statuses.items())))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
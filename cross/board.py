@@ -0,0 +1,47 @@
+"""
+This module generates random boards for the cross game.
+A board holds a few random cross patterns, surrounded by isolated live
+cells that don't touch the crosses or each other.
+"""
+
+import numpy as np
+from crossfinder_rules import get_active_region
+
+DEFAULT_CROSSES = 2
+
+
+def draw_random_cross(grid, rng):
+    """
+    Select a random cross pattern and place it in a random valid position.
+    Cross is equal arms, in this context a + shape
+    """
+    rows, cols = grid.shape
+    cross_size = rng.integers(3, min(rows, cols) // 2)
+    top = rng.integers(0, rows - cross_size)
+    left = rng.integers(0, cols - cross_size)
+    grid[top:top + cross_size, left + cross_size // 2] = 1
+    grid[top + cross_size // 2, left:left + cross_size] = 1
+
+
+def random_grid(size, rng=None, crosses=DEFAULT_CROSSES):
+    """
+    Create a grid with random cells and cross patterns.
+    rng is a numpy Generator or a seed, a fresh generator is used if None.
+
+    Random cells are only drawn where the 3x3 neighborhood is empty.
+    The cells are filled in four passes over the (row % 2, col % 2)
+    classes: cells of a class never touch each other, so each pass is a
+    single vectorized update and the random cells stay isolated.
+    """
+    rng = np.random.default_rng(rng)
+    grid = np.zeros(size, dtype=np.int8)
+    for _ in range(crosses):
+        draw_random_cross(grid, rng)
+
+    coins = rng.integers(0, 2, size=size, dtype=np.int8).astype(bool)
+    for row in (0, 1):
+        for col in (0, 1):
+            free = ~get_active_region(grid != 0)
+            chosen = free[row::2, col::2] & coins[row::2, col::2]
+            grid[row::2, col::2][chosen] = 1
+    return grid
@@ -5,36 +5,36 @@ The game is played on a grid of cells, where each cell can be in one of four sta
 1 - alive
 2 - red: Used to mark initial wave that destroys all non-cross shapes
 3 - blue: Used to mark wave from cross edges to the center
+
+matplotlib is imported by the first GameOfLife, and HashLife, the export
+and the detector by their first use, so importing this module is cheap
+for headless users (see benchmarks/startup.py).
 """
 
-import time
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import animation
-from matplotlib.widgets import Button
-from matplotlib.colors import ListedColormap
-from crossfinder_rules import CrossRules, ConwayRules, get_neighberhood
-from utils import generate_background
+from engine import StepEngine
+from rulesets import RULE_SETS
+from board import random_grid
+try:
+    from utils import generate_background
+except ImportError:
+    # the background is decorative, see batch.py for headless runs
+    generate_background = None
 
 DEFAULT_GRID_SIZE = (32, 32)
 FIGURE_SIZE = (16, 10)
+# hide the grid lines when cells are smaller than this many pixels
+MIN_CELL_PIXELS = 4
 
 def track_changes(func):
     """
-    A decorator to track the changes in the grid after calling a function
+    A decorator for the functions that replace the whole grid.
+    No diff is computed: the change set becomes None, which means that
+    every cell may have changed, and the engine re-evaluates all cells
     """
     def wrapper(self, *args, **kwargs):
-        # Store a copy of the grid before changes
-        grid_before = np.copy(self.grid)
-        # Call the original function
         result = func(self, *args, **kwargs)
-        # Find the indices where the grid has changed
-        changed_indices = np.where(grid_before != self.grid)
-        new_values = self.grid[changed_indices]
-        # Store the changed indices
-        self.changed_indices = list(
-            zip(new_values, changed_indices[0], changed_indices[1])
-        )
+        self.changed_indices = None
         return result
 
     return wrapper
@@ -44,25 +44,51 @@ class GameOfLife:
     """
     A class to represent the custom game of life
     """
-    def __init__(self, grid_size=DEFAULT_GRID_SIZE):
-        self.grid_size = grid_size
+    def __init__(self, grid_size=DEFAULT_GRID_SIZE, seed=None, grid=None):
+        """
+        grid is the initial grid, a random grid is created if None.
+        A np.memmap grid is stepped in bands by a BandedEngine (see bands.py)
+        """
+        self.rng = np.random.default_rng(seed)
         self.mode = "cross"
-        self.grid = np.zeros(grid_size, dtype=np.int8)
-        self.changed_indices = []
-        self.create_grid(grid_size)
+        # the last change set as (values, rows, cols), None for the whole grid
+        self.changed_indices = None
+        if grid is None:
+            self.grid_size = grid_size
+            self.engine = StepEngine(np.zeros(grid_size, dtype=np.int8), self.mode)
+            self.create_grid(grid_size)
+        else:
+            from bands import BandedEngine
+            self.grid_size = grid.shape
+            engine = BandedEngine if isinstance(grid, np.memmap) else StepEngine
+            self.engine = engine(grid, self.mode)
+        import matplotlib.pyplot as plt
+        from matplotlib.colors import ListedColormap
         self.fig, self.ax = plt.subplots()
         self.fig.set_size_inches(FIGURE_SIZE[0], FIGURE_SIZE[1])
-        generate_background(self.fig, self.grid)
+        if generate_background is not None:
+            generate_background(self.fig, self.grid)
 
         self.init_grid()
         # plt.subplots_adjust(bottom=0.2)
         self.cmap = ListedColormap(
             ["white", "black", "red", "blue", "green"], N=5)
         self.img = self.ax.imshow(
-            self.grid, cmap=self.cmap, interpolation="nearest", animated=True, aspect="equal", origin="upper")
+            self.grid, cmap=self.cmap, vmin=0, vmax=self.cmap.N - 1, interpolation="nearest", animated=True, aspect="equal", origin="upper")
         self.ax.set_title("My Cross Game of Life")
         self.ax.set_axis_off()
         self.setup_buttons()
+        # the axes without the animated artists, cached on every full draw
+        self.background = None
+        self.fig.canvas.mpl_connect("draw_event", self.on_draw)
+
+    @property
+    def grid(self):
+        return self.engine.grid
+
+    @grid.setter
+    def grid(self, grid):
+        self.engine.load(grid)
 
     # ========================================================================+
     # setup grid
@@ -72,55 +98,7 @@ class GameOfLife:
         """
         Create a grid with random cells and cross patterns
         """
-
-        # seed the random number generator
-        np.random.seed(int(time.time()))
-
-        def draw_random_cross(grid, size):
-            """
-            select a random cross pattern and place it in a random valid position
-            """
-
-            # cross is equal arms, in this context a + shape
-            cross_size = np.random.randint(3, self.grid_size[0] // 2)
-            cross_middle = np.random.randint(0, size[0] - cross_size), np.random.randint(
-                0, size[1] - cross_size
-            )
-            while (
-                cross_middle[0] + cross_size > size[0]
-                or cross_middle[1] + cross_size > size[1]
-            ):
-                cross_middle = np.random.randint(
-                    0, size[0] - cross_size
-                ), np.random.randint(0, size[1] - cross_size)
-
-            for i in range(cross_size):
-                grid[cross_middle[0] + i, cross_middle[1] + cross_size // 2] = 1
-                grid[cross_middle[0] + cross_size // 2, cross_middle[1] + i] = 1
-
-        grid = np.zeros(size, dtype=np.int8)
-        # draw some cross patterns
-        for _ in range(2):
-            draw_random_cross(grid, size)
-
-        # draw some random cells not intersecting with the cross
-        for i in range(size[0]):
-            for j in range(size[1]):
-                # avoid drawing cells on the cross
-                if grid[i, j] == 0 and get_neighberhood(i, j, grid) == [
-                    0,
-                    0,
-                    0,
-                    0,
-                    0,
-                    0,
-                    0,
-                    0,
-                    0,
-                ]:
-                    grid[i, j] = np.random.randint(0, 2)
-
-        self.grid = grid
+        self.grid = random_grid(size, self.rng)
 
     def init_grid(self):
         """
@@ -129,15 +107,17 @@ class GameOfLife:
         # avoid redrawing the grid lines if the grid is updated
         if hasattr(self, "grid_lines"):
             return
-        for i in range(self.grid.shape[0]):
-            self.ax.plot(
-                [-0.5, self.grid.shape[1] - 0.5], [i - 0.5, i - 0.5], color="black"
-            )
-        for j in range(self.grid.shape[1]):
-            self.ax.plot(
-                [j - 0.5, j - 0.5], [-0.5, self.grid.shape[0] - 0.5], color="black"
-            )
-        self.grid_lines = True
+        from matplotlib.collections import LineCollection
+        rows, cols = self.grid.shape
+        # all lines are a single artist, drawn over the image in draw_animated
+        segments = np.empty((rows + cols, 2, 2))
+        segments[:rows, :, 0] = [-0.5, cols - 0.5]
+        segments[:rows, :, 1] = np.arange(rows)[:, None] - 0.5
+        segments[rows:, :, 0] = np.arange(cols)[:, None] - 0.5
+        segments[rows:, :, 1] = [-0.5, rows - 0.5]
+        self.grid_lines = LineCollection(
+            segments, colors="black", animated=True)
+        self.ax.add_collection(self.grid_lines, autolim=False)
 
     # ========================================================================+
     # setup buttons
@@ -149,6 +129,8 @@ class GameOfLife:
         - Reset: reset the grid to the initial state
         - Mode: change the mode of the game
         """
+        import matplotlib.pyplot as plt
+        from matplotlib.widgets import Button
         # Get the window center in display coordinates
         window_center_display = self.ax.get_window_extent().get_points().mean(0)
 
@@ -179,14 +161,13 @@ class GameOfLife:
         self.buttons[3].on_clicked(self.change_mode)
     def change_mode(self, event):
         """
-        Change the mode of the game from cross to conway and vice versa
+        Change the mode of the game to the next registered rule set
+        (cross -> conway -> ... -> cross), see rulesets.py
         """
-        if self.mode == "cross":
-            self.mode = "conway"
-            self.buttons[3].label.set_text("Mode: Conway")
-        else:
-            self.mode = "cross"
-            self.buttons[3].label.set_text("Mode: Cross")
+        modes = list(RULE_SETS)
+        self.mode = modes[(modes.index(self.mode) + 1) % len(modes)]
+        self.buttons[3].label.set_text(f"Mode: {self.mode.capitalize()}")
+        self.engine.set_mode(self.mode)
 
 
 
@@ -206,7 +187,8 @@ class GameOfLife:
             return
         if 0 <= i < self.grid_size[0] and 0 <= j < self.grid_size[1]:
             self.grid[i, j] = 1 if self.grid[i, j] == 0 else 0
-            self.changed_indices.append((self.grid[i, j], i, j))
+            self.engine.mark_changed(i, j)
+            self.changed_indices = None
             self.update_grid()
         else:
             # maybe clicked on a button
@@ -225,88 +207,95 @@ class GameOfLife:
         self.update_grid()
 
     def draw_grid(self):
-        if self.changed_indices != []:
-            self.draw_changes(self.changed_indices)
-        self.changed_indices = []
-        # TODO: maybe use set_data instead of creating a new image
-
-    def draw_changes(self, changes):
-        for change in changes:
-            if change[0] == 0:
-                self.ax.add_patch(
-                    plt.Rectangle(
-                        (change[2] - 0.5, change[1] - 0.5), 1, 1, color="white"
-                    )
-                )
-            elif change[0] == 1:
-                self.ax.add_patch(
-                    plt.Rectangle(
-                        (change[2] - 0.5, change[1] - 0.5), 1, 1, color="black"
-                    )
-                )
-            elif change[0] == 2:
-                self.ax.add_patch(
-                    plt.Rectangle(
-                        (change[2] - 0.5, change[1] - 0.5), 1, 1, color="red")
-                )
-            elif change[0] == 3:
-                self.ax.add_patch(
-                    plt.Rectangle(
-                        (change[2] - 0.5, change[1] - 0.5), 1, 1, color="blue"
-                    )
-                )
+        """
+        Update the existing image in place, several steps may have passed
+        since the last draw so the whole grid is copied
+        """
+        self.img.set_data(self.grid)
+        self.changed_indices = None
+
+    def draw_animated(self):
+        """
+        Draw the artists that are excluded from the cached background
+        """
+        self.ax.draw_artist(self.img)
+        self.ax.draw_artist(self.grid_lines)
+
+    def on_draw(self, event):
+        """
+        Cache the background after a full redraw (startup, resize)
+        """
+        cell_pixels = self.ax.bbox.width / self.grid.shape[1]
+        self.grid_lines.set_visible(cell_pixels >= MIN_CELL_PIXELS)
+        self.background = self.fig.canvas.copy_from_bbox(self.ax.bbox)
+        self.draw_animated()
 
     def update_grid(self):
         # refresh canvas
         self.draw_grid()
-        self.fig.canvas.draw_idle()
+        canvas = self.fig.canvas
+        if self.background is None or not canvas.supports_blit:
+            canvas.draw_idle()
+            return
+        # blit only the axes over the cached background
+        canvas.restore_region(self.background)
+        self.draw_animated()
+        canvas.blit(self.ax.bbox)
+        canvas.flush_events()
 
     @track_changes
     def clear_board(self):
         self.grid = np.zeros(self.grid_size, dtype=np.int8)
 
-    @track_changes
     def apply_rules(self):
-        if self.mode == "cross":
-            with CrossRules(self.grid) as r:
-                for i in range(self.grid.shape[0]):
-                    for j in range(self.grid.shape[1]):
-                        self.grid[i, j] = r.transition(i, j)
-        else:
-            with ConwayRules(self.grid) as r:
-                for i in range(self.grid.shape[0]):
-                    for j in range(self.grid.shape[1]):
-                        self.grid[i, j] = r.transition(i, j)
+        self.engine.step()
+        self.changed_indices = self.engine.changes()
+
+    @track_changes
+    def jump(self, generations):
+        """
+        Advance the conway mode by many generations at once using HashLife.
+        The grid is treated as a window onto the unbounded plane, cells that
+        leave the window are dropped (see hashlife.py)
+        """
+        if self.mode != "conway":
+            raise ValueError("HashLife only supports the conway mode")
+        from hashlife import HashLife
+        universe = HashLife.from_grid(self.grid)
+        universe.advance(generations)
+        self.grid = universe.to_grid(self.grid.shape)
+
+    @track_changes
+    def detect_crosses(self):
+        """
+        Jump straight to the final state of the cross mode using the direct
+        detector (see detector.py). Only live cells (1) are considered, so
+        this is meant for a grid that wasn't stepped yet
+        """
+        from detector import find_crosses
+        self.grid = find_crosses(self.grid)
+
+    @track_changes
+    def run_until_stable(self, max_steps=1000):
+        """
+        Apply the rules until the grid reaches a fixed point or a short
+        cycle, see StepEngine.run_until_stable
+        """
+        return self.engine.run_until_stable(max_steps)
 
     def run(self):
+        import matplotlib.pyplot as plt
         self.fig.canvas.mpl_connect("button_press_event", self.on_click)
         plt.show()
 
-    def generateGif(self):
-        fig = plt.figure()
-        ax = fig.add_subplot(111)
-        ax.set_axis_off()
-        ax.set_title("My Cross Game of Life")
-        cmap = ListedColormap(["white", "black", "red", "blue", "green"], N=5)
-        img = ax.imshow(self.grid, cmap=cmap, interpolation="nearest")
-
-        def animate(i):
-            # copy first frame 4 times to make the gif slower
-            if i < 6:
-                return (img,)
-            self.apply_rules()
-            img.set_data(self.grid)
-            return (img,)
-
-        ani = animation.FuncAnimation(
-            fig,
-            animate,
-            interval=100,
-            blit=True,
-            repeat=False,
-            save_count=20,
-        )
-        ani.save("cross_game.gif", writer="pillow")
+    def generateGif(self, filename="cross_game.gif", length=20, scale=16, skip=1):
+        """
+        Save the next generations as an animation, the format follows the
+        file extension (see export.py)
+        """
+        from export import export
+        export(self, filename, length, scale, skip)
+        self.update_grid()
 
 if __name__ == "__main__":
     grid_size = (32, 32)
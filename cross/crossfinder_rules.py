@@ -4,6 +4,8 @@ The rules are implemented in the Rules class.
 The Rules class is an abstract class that should be inherited by the specific rules of the game.
 """
 
+import numpy as np
+
 # add decorator to track changes and store them in a list for further drawing
 @staticmethod
 def get_neighberhood(i, j, grid):
@@ -42,6 +44,24 @@ def get_neighberhood(i, j, grid):
     return neighbor_hood
 
 
+def get_active_region(changed, out=None, scratch=None):
+    """
+    Expand a mask of changed cells to every cell whose 3x3 neighborhood
+    touched a change. Cells outside the region see the same neighborhood as
+    in the previous generation, so the rules would leave them unchanged.
+    out and scratch are optional preallocated masks of the same shape.
+    """
+    active = np.empty_like(changed) if out is None else out
+    columns = np.empty_like(changed) if scratch is None else scratch
+    np.copyto(active, changed)
+    active[1:, :] |= changed[:-1, :]
+    active[:-1, :] |= changed[1:, :]
+    np.copyto(columns, active)
+    active[:, 1:] |= columns[:, :-1]
+    active[:, :-1] |= columns[:, 1:]
+    return active
+
+
 class Rules:
     """
     This class is an abstract class that should be inherited by the specific rules of the game.
@@ -0,0 +1,184 @@
+"""
+This module implements the step engine of the game.
+The engine owns the grid and applies the rules of the current mode one
+generation at a time. Each step produces its change set natively, as
+index arrays of the changed cells plus their new values, and keeps a
+mask of the changed cells so stable areas are skipped in the next step.
+
+The engine owns two preallocated grids, padded with a ring of zeros, and
+ping-pongs between them: each generation is written into the inactive
+grid with out= array operations, so a dense step allocates nothing.
+"""
+
+import hashlib
+from collections import deque, namedtuple
+import numpy as np
+from crossfinder_rules import get_active_region
+from rulesets import get_kernel, gather_codes, check_states
+
+# longest cycle detected by run_until_stable
+MAX_CYCLE_PERIOD = 16
+# evaluate the whole grid when more than this fraction of cells is active
+DENSE_FRACTION = 1 / 16
+
+StableResult = namedtuple("StableResult", ["generations", "status", "period"])
+
+
+class StepEngine:
+    """
+    A class to represent the step engine
+
+    Attributes
+    ----------
+    buffers : list
+        The two padded grids, the current generation and the previous one
+    current : int
+        The index of the buffer holding the current generation
+    mode : str
+        The rules applied in each step, a registered rule set
+    changed_mask : np.ndarray
+        The cells changed since the last step, None to evaluate all cells
+    """
+
+    def __init__(self, grid, mode="cross"):
+        self.mode = mode
+        self.buffers = None
+        self.load(grid)
+
+    def allocate(self, shape):
+        """
+        Allocate the buffers used by the steps
+        """
+        padded = (shape[0] + 2, shape[1] + 2)
+        self.buffers = [np.zeros(padded, dtype=np.int8) for _ in range(2)]
+        self.codes = np.empty(shape, dtype=np.intp)
+        self.next = np.empty(shape, dtype=np.int8)
+        self.changed = np.zeros(shape, dtype=bool)
+        self.active = np.empty(shape, dtype=bool)
+        self.scratch = np.empty(shape, dtype=bool)
+
+    @property
+    def grid(self):
+        """
+        The current generation, a view into the current buffer.
+        Cells edited in place must be reported with mark_changed
+        """
+        return self.buffers[self.current][1:-1, 1:-1]
+
+    def load(self, grid):
+        """
+        Replace the whole grid, all cells are evaluated in the next step.
+        Raises a ValueError when a cell isn't a state of the rules
+        """
+        check_states(grid)
+        if self.buffers is None or self.next.shape != grid.shape:
+            self.allocate(grid.shape)
+        # both buffers hold the grid, see step
+        for buffer in self.buffers:
+            buffer[1:-1, 1:-1] = grid
+        self.current = 0
+        self.changed_mask = None
+        self.last_changes = None
+
+    def set_mode(self, mode):
+        """
+        Change the rules, the previous generation was computed with the
+        other rules so all cells are evaluated in the next step
+        """
+        self.mode = mode
+        self.changed_mask = None
+
+    def mark_changed(self, rows, cols):
+        """
+        Record cells changed outside of the rules (e.g. by a click)
+        """
+        if self.changed_mask is not None:
+            self.changed_mask[rows, cols] = True
+            self.last_changes = None
+
+    def step(self):
+        """
+        Apply the rules to the grid.
+
+        The next generation is written into the other buffer, which holds
+        the previous generation. The two only differ on the cells in
+        changed_mask, so when few cells are active only those are written.
+
+        Returns the number of changed cells, see changes for the change set
+        """
+        kernel = get_kernel(self.mode)
+        source = self.buffers[self.current]
+        target = self.buffers[1 - self.current]
+        grid, next_grid = source[1:-1, 1:-1], target[1:-1, 1:-1]
+        dense = self.changed_mask is None
+        if not dense:
+            active = get_active_region(self.changed_mask, self.active, self.scratch)
+            dense = np.count_nonzero(active) > active.size * DENSE_FRACTION
+        if dense:
+            kernel.step_padded(source, self.codes, self.next)
+            np.not_equal(self.next, grid, out=self.changed)
+            np.copyto(next_grid, self.next)
+            self.last_changes = None
+            count = np.count_nonzero(self.changed)
+        else:
+            rows, cols = np.nonzero(active)
+            values = kernel.lookup(gather_codes(source, rows, cols))
+            next_grid[rows, cols] = values
+            changed = values != grid[rows, cols]
+            values, rows, cols = values[changed], rows[changed], cols[changed]
+            self.changed.fill(False)
+            self.changed[rows, cols] = True
+            self.last_changes = (values, rows, cols)
+            count = len(values)
+        self.changed_mask = self.changed
+        self.current = 1 - self.current
+        return count
+
+    def changes(self):
+        """
+        Get the change set of the last step as a tuple (values, rows, cols)
+        of arrays, or None when the whole grid was replaced
+        """
+        if self.changed_mask is None:
+            return None
+        if self.last_changes is None:
+            rows, cols = np.nonzero(self.changed_mask)
+            self.last_changes = (self.grid[rows, cols], rows, cols)
+        return self.last_changes
+
+    def grid_hash(self):
+        """
+        Fingerprint of the current grid state
+        """
+        return hashlib.blake2b(self.buffers[self.current], digest_size=16).digest()
+
+    def copy_to(self, out):
+        """
+        Copy the current grid into out
+        """
+        out[...] = self.grid
+
+    def run_until_stable(self, max_steps=1000, max_period=MAX_CYCLE_PERIOD):
+        """
+        Apply the rules until the grid reaches a fixed point or a short cycle.
+        Only the hashes of the last max_period states are kept, so cycles up
+        to that length are detected without storing copies of the grid.
+
+        Returns a StableResult with the generation at which the final state
+        was first reached, the status ("fixed", "cycle" or "unresolved")
+        and the period of the cycle (1 for a fixed point).
+        """
+        seen = {self.grid_hash(): 0}
+        history = deque(seen)
+        for generation in range(1, max_steps + 1):
+            if self.step() == 0:
+                return StableResult(generation - 1, "fixed", 1)
+            key = self.grid_hash()
+            if key in seen:
+                first = seen[key]
+                return StableResult(first, "cycle", generation - first)
+            seen[key] = generation
+            history.append(key)
+            if len(history) > max_period:
+                del seen[history.popleft()]
+        return StableResult(max_steps, "unresolved", 0)
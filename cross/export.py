@@ -0,0 +1,194 @@
+"""
+This module exports runs of the game as animations.
+Grid states are mapped straight to palette-indexed frames, one byte per
+cell scaled by integer repetition, and streamed to the output file one
+frame at a time. Memory use doesn't grow with the number of frames.
+
+Supported outputs:
+- GIF: frames are LZW-encoded by Pillow and appended to the stream
+- APNG: written directly with zlib, no extra dependency
+- raw RGB24 video: written to any binary stream, e.g. ffmpeg's stdin
+"""
+
+import io
+import shutil
+import struct
+import subprocess
+import zlib
+import numpy as np
+
+# same colors as the GameOfLife colormap: white, black, red, blue, green
+PALETTE = np.array(
+    [(255, 255, 255), (0, 0, 0), (255, 0, 0), (0, 0, 255), (0, 128, 0)],
+    dtype=np.uint8,
+)
+DEFAULT_FRAME_DURATION = 100  # milliseconds
+# fast zlib level, higher levels cost a lot of time for a few percent
+PNG_COMPRESSION = 1
+
+
+def iter_frames(game, length, scale=1, skip=1):
+    """
+    Get the palette-indexed frames of a running game, a generator.
+    The current grid is the first frame, the rules are applied skip times
+    between frames. Every cell becomes a scale x scale block of pixels.
+
+    Note that the same buffer is yielded every time, a frame must be
+    consumed before the next one is requested.
+    """
+    if length < 1:
+        raise ValueError(f"an animation needs at least one frame, got length={length}")
+    return _frames(game, length, scale, skip)
+
+
+def _frames(game, length, scale, skip):
+    rows, cols = game.grid.shape
+    frame = np.empty((rows * scale, cols * scale), dtype=np.uint8)
+    # a view of the frame with one axis per cell and per pixel in the cell
+    blocks = frame.reshape(rows, scale, cols, scale)
+    for index in range(length):
+        if index:
+            for _ in range(skip):
+                game.apply_rules()
+        blocks[...] = game.grid[:, None, :, None]
+        yield frame
+
+
+def write_gif(frames, stream, duration=DEFAULT_FRAME_DURATION, loop=0):
+    """
+    Write palette-indexed frames to a binary stream as an animated GIF.
+    Each frame is encoded on its own and its image block is appended to
+    the stream, so Pillow never holds more than one frame.
+    """
+    from PIL import Image
+
+    palette = np.zeros((8, 3), dtype=np.uint8)
+    palette[:len(PALETTE)] = PALETTE
+    header = None
+    for frame in frames:
+        height, width = frame.shape
+        image = Image.frombuffer("P", (width, height), frame, "raw", "P", 0, 1)
+        image.putpalette(palette.tobytes())
+        encoded = io.BytesIO()
+        image.save(encoded, format="GIF", optimize=False)
+        if header is None:
+            # global color table of 8 colors, then the looping extension
+            header = b"GIF89a" + struct.pack("<HHBBB", width, height, 0xF2, 0, 0)
+            stream.write(header + palette.tobytes())
+            stream.write(b"\x21\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", loop) + b"\x00")
+        # graphic control extension with the frame delay in centiseconds
+        stream.write(b"\x21\xf9\x04\x04" + struct.pack("<H", duration // 10) + b"\x00\x00")
+        stream.write(_gif_image_block(encoded.getvalue()))
+    if header is None:
+        raise ValueError("no frames to write, a GIF needs at least one")
+    stream.write(b"\x3b")
+
+
+def _gif_image_block(data):
+    """
+    Get the image descriptor and LZW data of a single frame GIF
+    """
+    position = 13
+    if data[10] & 0x80:
+        position += 3 << ((data[10] & 0x07) + 1)
+    # skip the extensions written before the image
+    while data[position] == 0x21:
+        position += 2
+        while data[position]:
+            position += data[position] + 1
+        position += 1
+    return data[position:data.rindex(b"\x3b")]
+
+
+def _png_chunk(stream, kind, data):
+    stream.write(struct.pack(">I", len(data)) + kind + data)
+    stream.write(struct.pack(">I", zlib.crc32(kind + data)))
+
+
+def write_apng(frames, stream, length, duration=DEFAULT_FRAME_DURATION, loop=0):
+    """
+    Write palette-indexed frames to a binary stream as an animated PNG.
+    The number of frames goes in the header, so it must be given up front,
+    and a ValueError is raised when frames doesn't yield that many.
+    """
+    count = 0
+    sequence = 0
+    rows = None
+    for index, frame in enumerate(frames):
+        height, width = frame.shape
+        if rows is None:
+            stream.write(b"\x89PNG\r\n\x1a\n")
+            _png_chunk(stream, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0))
+            _png_chunk(stream, b"PLTE", PALETTE.tobytes())
+            _png_chunk(stream, b"acTL", struct.pack(">II", length, loop))
+            # every row starts with its filter type byte (0: none)
+            rows = np.zeros((height, width + 1), dtype=np.uint8)
+        _png_chunk(stream, b"fcTL", struct.pack(
+            ">IIIIIHHBB", sequence, width, height, 0, 0, duration, 1000, 0, 0))
+        sequence += 1
+        rows[:, 1:] = frame
+        data = zlib.compress(rows, PNG_COMPRESSION)
+        if index == 0:
+            _png_chunk(stream, b"IDAT", data)
+        else:
+            _png_chunk(stream, b"fdAT", struct.pack(">I", sequence) + data)
+            sequence += 1
+        count += 1
+    if count != length:
+        raise ValueError(f"expected {length} frames for the APNG header, got {count}")
+    _png_chunk(stream, b"IEND", b"")
+
+
+def write_raw(frames, stream):
+    """
+    Write palette-indexed frames to a binary stream as raw RGB24 video
+    """
+    pixels = None
+    for frame in frames:
+        if pixels is None:
+            pixels = np.empty(frame.shape + (3,), dtype=np.uint8)
+        np.take(PALETTE, frame, axis=0, out=pixels)
+        stream.write(pixels.data)
+
+
+def ffmpeg_command(shape, path, fps):
+    """
+    Get the command line that encodes raw RGB24 frames from stdin
+    """
+    return [
+        "ffmpeg", "-loglevel", "error", "-y",
+        "-f", "rawvideo", "-pix_fmt", "rgb24",
+        "-s", f"{shape[1]}x{shape[0]}", "-r", str(fps), "-i", "-",
+        # yuv420p needs even sizes, odd ones get a white row or column
+        "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2:color=white",
+        "-pix_fmt", "yuv420p", path,
+    ]
+
+
+def export(game, path, length=20, scale=1, skip=1, duration=DEFAULT_FRAME_DURATION):
+    """
+    Export a run of the game to a file, the format follows the extension:
+    .gif, .png/.apng, .rgb/.raw for raw RGB24 frames, and anything else
+    is piped through ffmpeg (e.g. .mp4) when it is installed.
+    Raises a ValueError when length is less than one frame
+    """
+    frames = iter_frames(game, length, scale, skip)
+    extension = path.rsplit(".", 1)[-1].lower()
+    if extension in ("gif", "png", "apng", "rgb", "raw"):
+        with open(path, "wb") as stream:
+            if extension == "gif":
+                write_gif(frames, stream, duration)
+            elif extension in ("png", "apng"):
+                write_apng(frames, stream, length, duration)
+            else:
+                write_raw(frames, stream)
+        return
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError(f"ffmpeg is required to export {path}")
+    shape = (game.grid.shape[0] * scale, game.grid.shape[1] * scale)
+    fps = 1000 / duration
+    with subprocess.Popen(ffmpeg_command(shape, path, fps), stdin=subprocess.PIPE) as process:
+        write_raw(frames, process.stdin)
+        process.stdin.close()
+    if process.returncode:
+        raise RuntimeError(f"ffmpeg failed with exit code {process.returncode}")
@@ -0,0 +1,308 @@
+"""
+This module implements the HashLife algorithm for the Conway mode.
+The board is stored as a quadtree of canonical nodes: equal sub-patterns
+share a single node, and the future of every node is memoized. Together
+this allows jumping 2^k generations at once on huge sparse boards.
+
+Note that HashLife simulates the unbounded plane, while the rules in
+crossfinder_rules.py treat the board edges as dead cells. The board is a
+window onto the plane: patterns that stay clear of the edges evolve the
+same way, cells that leave the window are dropped when converting back.
+"""
+
+import numpy as np
+
+# garbage collect the node cache when it grows beyond this many nodes
+MAX_NODES = 1 << 20
+
+
+class Node:
+    """
+    A class to represent a canonical quadtree node
+
+    Attributes
+    ----------
+    level : int
+        The node covers a square of 2^level x 2^level cells
+    nw, ne, sw, se : Node
+        The four quadrants, None for the level 0 leaves
+    population : int
+        The number of live cells in the node
+    """
+
+    __slots__ = ("level", "nw", "ne", "sw", "se", "population")
+
+    def __init__(self, level, nw, ne, sw, se, population):
+        self.level = level
+        self.nw = nw
+        self.ne = ne
+        self.sw = sw
+        self.se = se
+        self.population = population
+
+
+# the two level 0 leaves
+OFF = Node(0, None, None, None, None, 0)
+ON = Node(0, None, None, None, None, 1)
+
+
+class HashLife:
+    """
+    A class to represent an unbounded Conway universe
+
+    Attributes
+    ----------
+    root : Node
+        The quadtree holding the pattern
+    origin : tuple
+        The (row, col) coordinates of the top left cell of the root
+    generation : int
+        The number of generations advanced so far
+    max_nodes : int
+        The size of the node cache that triggers garbage collection
+    """
+
+    def __init__(self, max_nodes=MAX_NODES):
+        self.max_nodes = max_nodes
+        self.table = {}
+        self.results = {}
+        self.empties = [OFF]
+        self.root = self.empty(3)
+        self.origin = (0, 0)
+        self.generation = 0
+
+    # ========================================================================+
+    # canonical nodes
+
+    def join(self, nw, ne, sw, se):
+        """
+        Get the canonical node made of the four given quadrants
+        """
+        key = (nw, ne, sw, se)
+        node = self.table.get(key)
+        if node is None:
+            node = Node(
+                nw.level + 1, nw, ne, sw, se,
+                nw.population + ne.population + sw.population + se.population,
+            )
+            self.table[key] = node
+        return node
+
+    def empty(self, level):
+        """
+        Get the canonical empty node of the given level
+        """
+        while len(self.empties) <= level:
+            e = self.empties[-1]
+            self.empties.append(self.join(e, e, e, e))
+        return self.empties[level]
+
+    def centre(self, node):
+        """
+        Embed a node in the centre of an empty node one level up
+        """
+        e = self.empty(node.level - 1)
+        return self.join(
+            self.join(e, e, e, node.nw),
+            self.join(e, e, node.ne, e),
+            self.join(e, node.sw, e, e),
+            self.join(node.se, e, e, e),
+        )
+
+    def collect_garbage(self):
+        """
+        Drop every cached node and result that the root doesn't reach
+        """
+        self.table = {}
+        self.results = {}
+        self.empties = [OFF]
+        stack = [self.root]
+        seen = set()
+        while stack:
+            node = stack.pop()
+            if node.level == 0 or id(node) in seen:
+                continue
+            seen.add(id(node))
+            self.table[(node.nw, node.ne, node.sw, node.se)] = node
+            stack.extend((node.nw, node.ne, node.sw, node.se))
+
+    # ========================================================================+
+    # evolution
+
+    def life_4x4(self, node):
+        """
+        Advance the centre 2x2 cells of a level 2 node by one generation
+        """
+        cells = [
+            [node.nw.nw, node.nw.ne, node.ne.nw, node.ne.ne],
+            [node.nw.sw, node.nw.se, node.ne.sw, node.ne.se],
+            [node.sw.nw, node.sw.ne, node.se.nw, node.se.ne],
+            [node.sw.sw, node.sw.se, node.se.sw, node.se.se],
+        ]
+        cells = [[cell.population for cell in row] for row in cells]
+        centre = []
+        for i in (1, 2):
+            for j in (1, 2):
+                total = sum(
+                    cells[i + x][j + y] for x in (-1, 0, 1) for y in (-1, 0, 1)
+                ) - cells[i][j]
+                alive = total == 3 or (total == 2 and cells[i][j])
+                centre.append(ON if alive else OFF)
+        return self.join(*centre)
+
+    def successor(self, node, j):
+        """
+        Get the centre of a node advanced 2^j generations, j <= level - 2.
+        The result is one level smaller than the node and is memoized.
+        """
+        if node.population == 0:
+            return self.empty(node.level - 1)
+        j = min(j, node.level - 2)
+        key = (node, j)
+        result = self.results.get(key)
+        if result is not None:
+            return result
+        if node.level == 2:
+            result = self.life_4x4(node)
+        else:
+            nw, ne, sw, se = node.nw, node.ne, node.sw, node.se
+            # nine overlapping sub-nodes, advanced up to 2^(level - 3)
+            c1 = self.successor(nw, j)
+            c2 = self.successor(self.join(nw.ne, ne.nw, nw.se, ne.sw), j)
+            c3 = self.successor(ne, j)
+            c4 = self.successor(self.join(nw.sw, nw.se, sw.nw, sw.ne), j)
+            c5 = self.successor(self.join(nw.se, ne.sw, sw.ne, se.nw), j)
+            c6 = self.successor(self.join(ne.sw, ne.se, se.nw, se.ne), j)
+            c7 = self.successor(sw, j)
+            c8 = self.successor(self.join(sw.ne, se.nw, sw.se, se.sw), j)
+            c9 = self.successor(se, j)
+            if j < node.level - 2:
+                # the sub-nodes already advanced 2^j, only crop the centre
+                result = self.join(
+                    self.join(c1.se, c2.sw, c4.ne, c5.nw),
+                    self.join(c2.se, c3.sw, c5.ne, c6.nw),
+                    self.join(c4.se, c5.sw, c7.ne, c8.nw),
+                    self.join(c5.se, c6.sw, c8.ne, c9.nw),
+                )
+            else:
+                # advance the four overlapping quadrants a second time
+                result = self.join(
+                    self.successor(self.join(c1, c2, c4, c5), j),
+                    self.successor(self.join(c2, c3, c5, c6), j),
+                    self.successor(self.join(c4, c5, c7, c8), j),
+                    self.successor(self.join(c5, c6, c8, c9), j),
+                )
+        self.results[key] = result
+        return result
+
+    def is_padded(self, node):
+        """
+        Check that all live cells lie in the innermost quarter of the node
+        """
+        return (
+            node.level >= 3
+            and node.nw.population == node.nw.se.se.population
+            and node.ne.population == node.ne.sw.sw.population
+            and node.sw.population == node.sw.ne.ne.population
+            and node.se.population == node.se.nw.nw.population
+        )
+
+    def expand(self, level=0):
+        """
+        Grow the root until it is padded and at least of the given level
+        """
+        while not self.is_padded(self.root) or self.root.level < level:
+            half = 1 << (self.root.level - 1)
+            self.origin = (self.origin[0] - half, self.origin[1] - half)
+            self.root = self.centre(self.root)
+
+    def step(self, j):
+        """
+        Advance the universe 2^j generations
+        """
+        self.expand(j + 2)
+        # pad once more so the pattern can't reach the edge of the result
+        half = 1 << (self.root.level - 1)
+        self.origin = (self.origin[0] - half, self.origin[1] - half)
+        self.root = self.centre(self.root)
+        quarter = 1 << (self.root.level - 2)
+        self.root = self.successor(self.root, j)
+        self.origin = (self.origin[0] + quarter, self.origin[1] + quarter)
+        self.generation += 1 << j
+        if len(self.table) > self.max_nodes:
+            self.collect_garbage()
+
+    def advance(self, generations):
+        """
+        Advance the universe by any number of generations, using one
+        exponential jump per set bit of the number
+        """
+        j = 0
+        while generations:
+            if generations & 1:
+                self.step(j)
+            generations >>= 1
+            j += 1
+
+    # ========================================================================+
+    # conversion from and to the GameOfLife grid
+
+    def build(self, rows, cols, level):
+        """
+        Build the node of the given level holding the live cells at the
+        given coordinates, relative to the node's top left corner
+        """
+        if len(rows) == 0:
+            return self.empty(level)
+        if level == 0:
+            return ON
+        half = 1 << (level - 1)
+        bottom = rows >= half
+        right = cols >= half
+        quadrants = []
+        for b, r in ((False, False), (False, True), (True, False), (True, True)):
+            mask = (bottom == b) & (right == r)
+            quadrants.append(self.build(
+                rows[mask] - half * b, cols[mask] - half * r, level - 1))
+        return self.join(*quadrants)
+
+    @classmethod
+    def from_grid(cls, grid, max_nodes=MAX_NODES):
+        """
+        Create a universe from a GameOfLife grid, the top left cell of the
+        grid is placed at the origin. Cells with state 1 are alive.
+        """
+        universe = cls(max_nodes)
+        level = max(3, int(np.ceil(np.log2(max(grid.shape)))))
+        rows, cols = np.nonzero(grid == 1)
+        universe.root = universe.build(rows, cols, level)
+        return universe
+
+    def to_grid(self, shape, dtype=np.int8):
+        """
+        Get the cells of the window of the given shape at the origin
+        """
+        grid = np.zeros(shape, dtype=dtype)
+        stack = [(self.root, self.origin[0], self.origin[1])]
+        while stack:
+            node, top, left = stack.pop()
+            size = 1 << node.level
+            if (
+                node.population == 0
+                or top >= shape[0] or left >= shape[1]
+                or top + size <= 0 or left + size <= 0
+            ):
+                continue
+            if node.level == 0:
+                grid[top, left] = 1
+                continue
+            half = size >> 1
+            stack.append((node.nw, top, left))
+            stack.append((node.ne, top, left + half))
+            stack.append((node.sw, top + half, left))
+            stack.append((node.se, top + half, left + half))
+        return grid
+
+    @property
+    def population(self):
+        return self.root.population
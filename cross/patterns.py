@@ -0,0 +1,442 @@
+"""
+This module reads and writes patterns as run-length encoded (Golly RLE)
+and plaintext files, streaming: files are read in chunks of CHUNK_SIZE
+bytes and grids are written in bands of BAND_CELLS cells, so patterns
+larger than memory go straight from and to np.memmap grids.
+
+A chunk is parsed with array operations only. For RLE, the run counts
+are the digits before each tag, the row and column of every run come
+from cumulative sums of the counts, and the live runs are written into
+the output grid at once (long runs as slices). For plaintext, the live
+cells are found in the bytes of the complete lines of the chunk.
+
+Grids are int8 arrays, or packed bits (np.packbits rows, one bit per
+cell) for patterns with two states. Files with more than two states use
+the multistate RLE tags: "." is 0 and "A" to "X" are 1 to 24, two state
+files use "b" and "o". Plaintext files only hold two states, "." and "O"
+("*" is read as "O" too), and lines starting with "!" are comments.
+"""
+
+import os
+import re
+import numpy as np
+
+CHUNK_SIZE = 4 << 20
+# runs longer than this are written as slices instead of cell by cell
+LONG_RUN = 64
+# the longest lines of the RLE files written, like Golly
+RLE_LINE = 70
+# cells written at once
+BAND_CELLS = 1 << 20
+
+SKIP = -1
+DOLLAR = -2
+DIGIT = -3
+INVALID = -4
+
+WHITESPACE = np.zeros(256, dtype=bool)
+WHITESPACE[[ord(" "), ord("\t"), ord("\r"), ord("\n")]] = True
+# the state of every byte of a RLE body, or SKIP, DOLLAR, DIGIT, INVALID
+RLE_TAGS = np.full(256, INVALID, dtype=np.int8)
+RLE_TAGS[WHITESPACE] = SKIP
+RLE_TAGS[ord("b")] = RLE_TAGS[ord(".")] = 0
+RLE_TAGS[ord("o")] = 1
+RLE_TAGS[ord("A"):ord("X") + 1] = np.arange(1, 25)
+RLE_TAGS[ord("$")] = DOLLAR
+RLE_TAGS[ord("0"):ord("9") + 1] = DIGIT
+# the longest run count read, 10^18 fits in int64
+MAX_DIGITS = 18
+HEADER = re.compile(rb"x\s*=\s*(\d+)\s*,\s*y\s*=\s*(\d+)(?:\s*,\s*rule\s*=\s*(\S+))?")
+
+
+def packed_width(cols):
+    """
+    Get the bytes of a row of packed bits
+    """
+    return (cols + 7) // 8
+
+
+def allocate(shape, out, packed, memmap):
+    """
+    Get a zeroed output grid: out, cleared, or a new array, stored in the
+    .npy file memmap when given
+    """
+    rows, cols = shape
+    shape = (rows, packed_width(cols)) if packed else (rows, cols)
+    dtype = np.uint8 if packed else np.int8
+    if out is not None:
+        if out.shape != shape or out.dtype != dtype:
+            raise ValueError(f"out must be a {shape} {np.dtype(dtype)} array")
+        out[...] = 0
+        return out
+    if memmap is not None:
+        return np.lib.format.open_memmap(memmap, mode="w+", dtype=dtype, shape=shape)
+    return np.zeros(shape, dtype=dtype)
+
+
+def set_bits(row, start, stop):
+    """
+    Set the bits start to stop (excluded) of a row of packed bits
+    """
+    first, last = start // 8, (stop - 1) // 8
+    head = 0xFF >> (start % 8)
+    tail = (0xFF << (7 - (stop - 1) % 8)) & 0xFF
+    if first == last:
+        row[first] |= head & tail
+        return
+    row[first] |= head
+    row[first + 1:last] = 0xFF
+    row[last] |= tail
+
+
+def write_runs(out, packed, cols, rows, starts, lengths, states):
+    """
+    Write runs of live cells, sorted in row-major order, into a grid
+    """
+    if len(rows) == 0:
+        return
+    if packed and states.max() > 1:
+        raise ValueError("packed bits only hold two states")
+    long = lengths > LONG_RUN
+    for row, start, length, state in zip(rows[long], starts[long], lengths[long], states[long]):
+        if packed:
+            set_bits(out[row], start, start + length)
+        else:
+            out[row, start:start + length] = state
+    rows, starts, lengths, states = rows[~long], starts[~long], lengths[~long], states[~long]
+    if len(rows) == 0:
+        return
+    # the index of every cell of the runs
+    width = out.shape[1] * 8 if packed else cols
+    first = rows.astype(np.int64) * width + starts
+    offsets = np.cumsum(lengths) - lengths
+    cells = np.repeat(first - offsets, lengths) + np.arange(lengths.sum())
+    flat = out.reshape(-1)
+    if not packed:
+        flat[cells] = np.repeat(states, lengths)
+        return
+    # the cells are sorted, so the bits of a byte are consecutive
+    index, groups = np.unique(cells >> 3, return_index=True)
+    bits = (0x80 >> (cells & 7)).astype(np.uint8)
+    flat[index] |= np.bitwise_or.reduceat(bits, groups)
+
+
+def rle_header(file):
+    """
+    Read the comments and the header line of a RLE file opened in binary
+    mode, returns the shape and the rule (None if not given)
+    """
+    for line in file:
+        line = line.strip()
+        if not line or line.startswith(b"#"):
+            continue
+        match = HEADER.match(line)
+        if match is None:
+            raise ValueError(f"bad RLE header {line[:80]!r}")
+        width, height, rule = match.groups()
+        return (int(height), int(width)), rule.decode() if rule else None
+    raise ValueError("no RLE header")
+
+
+def parse_rle_chunk(data, row, col, cols):
+    """
+    Parse the complete tokens of a RLE chunk (up to "!" excluded), the
+    whitespace being tokens that take no cell.
+    Returns the live runs as (rows, starts, lengths, states), and the row
+    and column after the chunk
+    """
+    kind = RLE_TAGS[data]
+    if (kind == INVALID).any():
+        bad = data[np.argmax(kind == INVALID)]
+        raise ValueError(f"unsupported RLE tag {chr(bad)!r}")
+    tags = np.flatnonzero(kind != DIGIT)
+    if len(tags) == 0:
+        return (np.zeros(0, dtype=np.int64),) * 4, row, col
+    kinds = kind[tags]
+    # the digits of a count come right before their tag, read by place
+    digits = np.diff(tags, prepend=-1) - 1
+    if digits.max() > MAX_DIGITS or (digits[kinds == SKIP] > 0).any():
+        raise ValueError("bad RLE run count")
+    counts = np.where(digits > 0, 0, 1)
+    for place in range(int(digits.max())):
+        has = np.flatnonzero(digits > place)
+        counts[has] += (data[tags[has] - place - 1] - ord("0")).astype(np.int64) * 10 ** place
+
+    dollar = kinds == DOLLAR
+    cells = np.where(dollar | (kinds == SKIP), 0, counts)
+    after = np.cumsum(cells)
+    before = after - cells
+    # the cells before the last "$" up to each token, to restart the columns
+    restart = np.maximum.accumulate(np.where(dollar, after, 0))
+    lines = np.cumsum(np.where(dollar, counts, 0))
+    starts = before - restart + np.where(lines == 0, col, 0)
+    token_rows = row + lines
+    live = kinds > 0
+    if (starts + cells > cols).any():
+        raise ValueError("a row is longer than the width of the header")
+    row = int(token_rows[-1])
+    col = int(starts[-1] + cells[-1])
+    return (token_rows[live], starts[live], counts[live], kinds[live].astype(np.int8)), row, col
+
+
+def read_rle(path, out=None, packed=False, memmap=None, chunk_size=CHUNK_SIZE):
+    """
+    Read a RLE file into a grid, see allocate for out and memmap
+    """
+    with open(path, "rb") as file:
+        shape, _ = rle_header(file)
+        grid = allocate(shape, out, packed, memmap)
+        row, col = 0, 0
+        carry = b""
+        while True:
+            chunk = file.read(chunk_size)
+            end = chunk.find(b"!")
+            done = not chunk or end >= 0
+            data = np.frombuffer(carry + (chunk[:end] if end >= 0 else chunk), dtype=np.uint8)
+            if not done:
+                # the digits at the end may belong to the next chunk
+                cut = len(data)
+                while cut and RLE_TAGS[data[cut - 1]] == DIGIT:
+                    cut -= 1
+                carry = data[cut:].tobytes()
+                data = data[:cut]
+            runs, row, col = parse_rle_chunk(data, row, col, shape[1])
+            if len(runs[0]) and runs[0][-1] >= shape[0]:
+                raise ValueError("the pattern is taller than the height of the header")
+            write_runs(grid, packed, shape[1], *runs)
+            if done:
+                return grid
+
+
+def iter_lines(file, chunk_size=CHUNK_SIZE):
+    """
+    Read the complete lines of a text file opened in binary mode chunk by
+    chunk, yields the bytes of a chunk and the starts and ends of its
+    lines, without the line breaks
+    """
+    carry = b""
+    while True:
+        chunk = file.read(chunk_size)
+        data = carry + chunk
+        if not chunk:
+            if data and not data.endswith(b"\n"):
+                data += b"\n"
+            carry = b""
+        else:
+            cut = data.rfind(b"\n") + 1
+            data, carry = data[:cut], data[cut:]
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        ends = np.flatnonzero(buffer == ord("\n"))
+        starts = np.zeros(len(ends), dtype=np.int64)
+        starts[1:] = ends[:-1] + 1
+        # CRLF line breaks
+        crlf = np.zeros(len(ends), dtype=bool)
+        crlf[ends > starts] = buffer[ends[ends > starts] - 1] == ord("\r")
+        yield buffer, starts, ends - crlf
+        if not chunk:
+            return
+
+
+def plaintext_lines(buffer, starts):
+    """
+    Get the lines of a chunk that are not comments
+    """
+    first = np.full(len(starts), ord("\n"), dtype=np.uint8)
+    first[starts < len(buffer)] = buffer[starts[starts < len(buffer)]]
+    return first != ord("!")
+
+
+def plaintext_shape(path, chunk_size=CHUNK_SIZE):
+    """
+    Get the shape of a plaintext pattern, one pass over the file
+    """
+    rows, cols = 0, 0
+    with open(path, "rb") as file:
+        for buffer, starts, ends in iter_lines(file, chunk_size):
+            keep = plaintext_lines(buffer, starts)
+            rows += int(keep.sum())
+            if keep.any():
+                cols = max(cols, int((ends - starts)[keep].max()))
+    return rows, cols
+
+
+def read_plaintext(path, out=None, packed=False, memmap=None, chunk_size=CHUNK_SIZE):
+    """
+    Read a plaintext file into a grid, see allocate for out and memmap.
+    The file is read twice, first for its shape
+    """
+    shape = plaintext_shape(path, chunk_size)
+    grid = allocate(shape, out, packed, memmap)
+    row = 0
+    with open(path, "rb") as file:
+        for buffer, starts, ends in iter_lines(file, chunk_size):
+            keep = plaintext_lines(buffer, starts)
+            cells = np.flatnonzero((buffer != ord(".")) & ~WHITESPACE[buffer])
+            line = np.searchsorted(ends, cells)
+            cells, line = cells[keep[line]], line[keep[line]]
+            alive = (buffer[cells] == ord("O")) | (buffer[cells] == ord("*"))
+            if not alive.all():
+                raise ValueError("plaintext cells must be '.' or 'O'")
+            rows = row + np.cumsum(keep)[line] - 1
+            write_runs(grid, packed, shape[1], rows, cells - starts[line],
+                       np.ones(len(cells), dtype=np.int64), np.ones(len(cells), dtype=np.int8))
+            row += int(keep.sum())
+    return grid
+
+
+def row_runs(band):
+    """
+    Get the runs of a band of rows as (rows, starts, lengths, states),
+    without the dead runs at the end of the rows
+    """
+    height, width = band.shape
+    change = np.ones(band.shape, dtype=bool)
+    change[:, 1:] = band[:, 1:] != band[:, :-1]
+    rows, starts = np.nonzero(change)
+    ends = np.append(starts[1:], width)
+    ends[np.flatnonzero(np.diff(rows))] = width
+    states = band[rows, starts]
+    last = np.append(np.diff(rows) != 0, True)
+    keep = ~(last & (states == 0))
+    return rows[keep], starts[keep], (ends - starts)[keep], states[keep]
+
+
+def rle_tags(multistate):
+    """
+    Get the tag of every state as bytes
+    """
+    if multistate:
+        return np.frombuffer(b"." + bytes(range(ord("A"), ord("X") + 1)), dtype=np.uint8)
+    return np.frombuffer(b"bo", dtype=np.uint8)
+
+
+def digit_count(values):
+    """
+    Get the number of decimal digits of positive values
+    """
+    digits = np.ones(len(values), dtype=np.int64)
+    power = 10
+    while len(values) and power <= values.max():
+        digits += values >= power
+        power *= 10
+    return digits
+
+
+def put_numbers(buffer, positions, values, digits):
+    """
+    Write values in decimal into buffer, digits characters from positions
+    """
+    for place in range(int(digits.max(initial=0))):
+        wide = digits > place
+        buffer[positions[wide] + digits[wide] - 1 - place] = \
+            ord("0") + values[wide] // 10 ** place % 10
+
+
+def write_rle(path, grid, rule=None, band_rows=None):
+    """
+    Write a grid to a RLE file band by band. The characters of a band are
+    laid out in a byte array, digit place by digit place, and wrapped into
+    lines short enough for the longest token of the band
+    """
+    rows, cols = grid.shape
+    band_rows = band_rows or max(1, BAND_CELLS // max(cols, 1))
+    top_state = max((int(grid[top:top + band_rows].max()) for top in range(0, rows, band_rows)),
+                    default=0)
+    if top_state > 24:
+        raise ValueError("RLE files hold at most 25 states")
+    tags = rle_tags(top_state > 1)
+    header = f"x = {cols}, y = {rows}" + (f", rule = {rule}" if rule else "")
+    with open(path, "wb") as file:
+        file.write(header.encode())
+        # the row of the last run written, the empty rows are skipped
+        row = 0
+        empty = True
+        for top in range(0, rows, band_rows):
+            run_rows, _, lengths, states = row_runs(np.asarray(grid[top:top + band_rows]))
+            if len(run_rows) == 0:
+                continue
+            empty = False
+            run_rows = run_rows + top
+            skip = np.diff(run_rows, prepend=row)
+            row = int(run_rows[-1])
+            # a token is [skip]$ before a run on a new row, then [length]tag
+            skip_digits = digit_count(skip) * (skip > 1)
+            count_digits = digit_count(lengths) * (lengths > 1)
+            sizes = skip_digits + (skip > 0) + count_digits + 1
+            # a line holds the tokens ending in the same span of width
+            # characters, so it is at most RLE_LINE long
+            ends = np.cumsum(sizes)
+            width = RLE_LINE - int(sizes.max()) + 1
+            newline = np.diff((ends - 1) // width, prepend=-1) > 0
+            sizes += newline
+            positions = np.cumsum(sizes) - sizes
+            buffer = np.empty(int(positions[-1] + sizes[-1]), dtype=np.uint8)
+            buffer[positions[newline]] = ord("\n")
+            positions += newline
+            put_numbers(buffer, positions, skip, skip_digits)
+            positions += skip_digits
+            buffer[positions[skip > 0]] = ord("$")
+            positions += skip > 0
+            put_numbers(buffer, positions, lengths, count_digits)
+            buffer[positions + count_digits] = tags[states]
+            file.write(buffer.tobytes())
+        file.write(b"\n!\n" if empty else b"!\n")
+
+
+def write_plaintext(path, grid, name=None, band_rows=None):
+    """
+    Write a two state grid to a plaintext file band by band
+    """
+    cells = np.frombuffer(b".O", dtype=np.uint8)
+    band_rows = band_rows or max(1, BAND_CELLS // max(grid.shape[1], 1))
+    with open(path, "wb") as file:
+        if name:
+            file.write(f"!Name: {name}\n".encode())
+        for top in range(0, grid.shape[0], band_rows):
+            band = np.asarray(grid[top:top + band_rows])
+            if band.size and (band.min() < 0 or band.max() > 1):
+                raise ValueError("plaintext files only hold two states, use RLE")
+            lines = np.empty((band.shape[0], band.shape[1] + 1), dtype=np.uint8)
+            lines[:, :-1] = cells[band]
+            lines[:, -1] = ord("\n")
+            file.write(lines.tobytes())
+
+
+def pattern_format(path):
+    """
+    Get the format of a pattern file from its extension
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".rle":
+        return "rle"
+    if extension == ".cells":
+        return "plaintext"
+    raise ValueError(f"unknown pattern extension {extension!r}, expected .rle or .cells")
+
+
+def pattern_shape(path):
+    """
+    Get the (rows, cols) of a pattern file
+    """
+    if pattern_format(path) == "rle":
+        with open(path, "rb") as file:
+            return rle_header(file)[0]
+    return plaintext_shape(path)
+
+
+def read_pattern(path, out=None, packed=False, memmap=None):
+    """
+    Read a pattern file into a grid. out is a zeroed grid of the pattern
+    shape to fill, memmap a .npy file to create for a grid larger than
+    memory, and packed reads two state patterns as packed bits
+    """
+    read = read_rle if pattern_format(path) == "rle" else read_plaintext
+    return read(path, out, packed, memmap)
+
+
+def write_pattern(path, grid, **kwargs):
+    """
+    Write a grid to a pattern file, see write_rle and write_plaintext
+    """
+    write = write_rle if pattern_format(path) == "rle" else write_plaintext
+    write(path, grid, **kwargs)
@@ -0,0 +1,386 @@
+"""
+This module analyzes a pattern style rule set like CrossRules and
+compiles it into a decision tree.
+
+The transition method is parsed with ast into a first-match table: every
+if / elif of the method is a row (condition, state), in source order, as
+every branch returns. A condition is turned into a mask over all the
+neighborhood codes of rulesets.py, so the table gives the row that
+decides every neighborhood, and the rows can be checked exactly:
+
+- duplicate: the same condition as an earlier row
+- shadowed: every neighborhood it matches is decided by earlier rows
+- unreachable: it matches no neighborhood, or it comes after a row that
+  matches them all (the final else)
+- redundant: it decides some neighborhoods, but the rows after it would
+  give them the same state
+
+Conditions may compare the neighborhood list to a list of states, a cell
+of it to a state (== or !=), test if a state is in it, and combine these
+with and, or and not. Anything else is reported as unsupported.
+
+The profile counts how often each row decides a cell on sample runs of
+random boards. The compiled matcher is a decision tree on the center
+cell, then the arms, then the corners, with the more frequent branches
+tested first and the branches with the same subtree merged: a cell takes
+at most a few comparisons instead of walking the whole chain. It is
+emitted as Python source and checked against the table on every
+neighborhood. Usage:
+
+    python rules_analysis.py
+    python rules_analysis.py --emit compiled_rules.py --verify
+"""
+
+import argparse
+import ast
+import inspect
+import sys
+import textwrap
+from collections import namedtuple
+import numpy as np
+from board import random_grid
+from engine import StepEngine
+from rulesets import NUM_STATES, NUM_CODES, code_digits, neighborhood_codes, compile_rules
+import crossfinder_rules
+
+# the center, the arms (up, left, right, down), then the corners
+SPLIT_ORDER = [4, 1, 3, 5, 7, 0, 2, 6, 8]
+DEFAULT_SAMPLES = 8
+DEFAULT_SIZE = (64, 64)
+DEFAULT_STEPS = 60
+
+Rule = namedtuple("Rule", ["line", "condition", "state", "mask"])
+
+
+class RuleSetError(ValueError):
+    """
+    Raised when a transition method is not a first-match table
+    """
+
+
+def condition_mask(node, name, digits):
+    """
+    Get the neighborhoods matching a condition, name is the neighborhood
+    variable
+    """
+    def is_name(expr):
+        return isinstance(expr, ast.Name) and expr.id == name
+
+    def constant(expr):
+        if not isinstance(expr, ast.Constant) or not isinstance(expr.value, int):
+            raise RuleSetError(f"line {expr.lineno}: expected a state")
+        return expr.value
+
+    def cell(expr):
+        if is_name(expr.value) and isinstance(expr.slice, ast.Constant):
+            return digits[:, expr.slice.value]
+        raise RuleSetError(f"line {expr.lineno}: unsupported subscript")
+
+    if isinstance(node, ast.BoolOp):
+        masks = [condition_mask(value, name, digits) for value in node.values]
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        return combine.reduce(masks)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        return ~condition_mask(node.operand, name, digits)
+    if isinstance(node, ast.Compare) and len(node.ops) == 1:
+        op, left, right = node.ops[0], node.left, node.comparators[0]
+        if isinstance(op, (ast.In, ast.NotIn)) and is_name(right):
+            found = (digits == constant(left)).any(axis=1)
+            return found if isinstance(op, ast.In) else ~found
+        if isinstance(op, (ast.Eq, ast.NotEq)):
+            if is_name(left) and isinstance(right, ast.List):
+                pattern = [constant(element) for element in right.elts]
+                if len(pattern) != 9:
+                    raise RuleSetError(f"line {node.lineno}: a pattern holds 9 states")
+                equal = (digits == pattern).all(axis=1)
+            elif isinstance(left, ast.Subscript):
+                equal = cell(left) == constant(right)
+            else:
+                raise RuleSetError(f"line {node.lineno}: unsupported comparison")
+            return equal if isinstance(op, ast.Eq) else ~equal
+    raise RuleSetError(f"line {node.lineno}: unsupported condition {ast.unparse(node)}")
+
+
+def returned_state(body):
+    """
+    Get the state returned by a branch, which must only return a state
+    """
+    if len(body) != 1 or not isinstance(body[0], ast.Return):
+        raise RuleSetError(f"line {body[0].lineno}: a branch must only return a state")
+    value = body[0].value
+    if not isinstance(value, ast.Constant) or not isinstance(value.value, int):
+        raise RuleSetError(f"line {body[0].lineno}: a branch must return a state")
+    return value.value
+
+
+def parse_rules(rules):
+    """
+    Parse the transition method of a Rules subclass into its rows
+    """
+    source = textwrap.dedent(inspect.getsource(rules.transition))
+    first_line = inspect.getsourcelines(rules.transition)[1]
+    function = ast.parse(source).body[0]
+    digits = code_digits()
+    name = None
+    table = []
+    for statement in function.body:
+        if isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Constant):
+            continue  # the docstring
+        if isinstance(statement, ast.Assign) and name is None:
+            name = statement.targets[0].id
+            continue
+        if not isinstance(statement, ast.If) or name is None:
+            raise RuleSetError(f"line {statement.lineno}: expected an if statement")
+        branch = statement
+        while True:
+            table.append(Rule(
+                branch.lineno + first_line - 1, ast.unparse(branch.test),
+                returned_state(branch.body), condition_mask(branch.test, name, digits)))
+            if len(branch.orelse) == 1 and isinstance(branch.orelse[0], ast.If):
+                branch = branch.orelse[0]
+                continue
+            if branch.orelse:
+                table.append(Rule(
+                    branch.orelse[0].lineno + first_line - 1, "else",
+                    returned_state(branch.orelse), np.ones(NUM_CODES, dtype=bool)))
+            break
+    return table
+
+
+def first_rows(table):
+    """
+    Get the index of the row deciding every neighborhood, -1 for none
+    """
+    first = np.full(NUM_CODES, -1, dtype=np.int16)
+    for index in range(len(table) - 1, -1, -1):
+        first[table[index].mask] = index
+    return first
+
+
+def table_lut(table):
+    """
+    Get the next state of every neighborhood, the lookup table of the rows
+    """
+    first = first_rows(table)
+    if (first < 0).any():
+        raise RuleSetError(f"{(first < 0).sum()} neighborhoods match no row")
+    states = np.array([rule.state for rule in table], dtype=np.int8)
+    return states[first]
+
+
+def find_issues(table):
+    """
+    Get the issues of the rows as a dict of row index to a description
+    """
+    first = first_rows(table)
+    masks = np.array([rule.mask for rule in table])
+    states = np.array([rule.state for rule in table])
+    issues = {}
+    seen = {}
+    catch_all = None
+    for index, rule in enumerate(table):
+        key = rule.mask.tobytes()
+        decided = np.flatnonzero(first == index)
+        if catch_all is not None:
+            issues[index] = f"unreachable, after the catch-all of line {catch_all}"
+        elif not rule.mask.any():
+            issues[index] = "unreachable, matches no neighborhood"
+        elif key in seen:
+            other = table[seen[key]]
+            same = "same" if other.state == rule.state else "different"
+            issues[index] = f"duplicate of line {other.line}, {same} state"
+        elif len(decided) == 0:
+            issues[index] = "shadowed by earlier rows"
+        else:
+            # the row that would decide each neighborhood without this one
+            later = masks[index + 1:, decided]
+            if later.any(axis=0).all():
+                fallback = states[index + 1 + later.argmax(axis=0)]
+                if (fallback == rule.state).all():
+                    issues[index] = "redundant, later rows give the same states"
+        seen.setdefault(key, index)
+        if rule.mask.all() and catch_all is None:
+            catch_all = rule.line
+    return issues
+
+
+def profile(table, samples=DEFAULT_SAMPLES, size=DEFAULT_SIZE, steps=DEFAULT_STEPS,
+            mode="cross", seed=0):
+    """
+    Count the neighborhoods of every cell on sample runs of random boards,
+    returns the counts per code and per row
+    """
+    counts = np.zeros(NUM_CODES, dtype=np.int64)
+    for sample in range(samples):
+        engine = StepEngine(random_grid(size, seed + sample), mode)
+        for _ in range(steps):
+            counts += np.bincount(neighborhood_codes(engine.grid).ravel(), minlength=NUM_CODES)
+            engine.step()
+    rows = np.bincount(first_rows(table), weights=counts, minlength=len(table))
+    return counts, rows.astype(np.int64)
+
+
+def build_tree(lut, weights):
+    """
+    Build the decision tree of a lookup table. A leaf is a state, a node
+    is (cell, branches), the branches being (states, subtree) pairs, the
+    heaviest first. Returns the tree and its number of nodes
+    """
+    shape = (NUM_STATES,) * 9
+    lut = lut.reshape(shape).transpose(SPLIT_ORDER)
+    weights = weights.reshape(shape).transpose(SPLIT_ORDER)
+    # canonical subtrees, to merge the branches with the same subtree
+    canonical = {}
+
+    def node(sub, weight, depth):
+        first = sub.flat[0]
+        if (sub == first).all():
+            return int(first), ("leaf", int(first))
+        groups = {}
+        for value in range(NUM_STATES):
+            tree, key = node(sub[value], weight[value], depth + 1)
+            group = groups.setdefault(key, [[], 0, tree])
+            group[0].append(value)
+            group[1] += weight[value].sum()
+        key = (SPLIT_ORDER[depth], tuple(sorted((tuple(values), key) for key, (values, _, _) in groups.items())))
+        key = ("node", canonical.setdefault(key, len(canonical)))
+        branches = sorted(groups.values(), key=lambda group: (-group[1], group[0]))
+        return (SPLIT_ORDER[depth], [(tuple(values), tree) for values, _, tree in branches]), key
+
+    tree, _ = node(lut, weights, 0)
+    return tree, len(canonical)
+
+
+def worst_comparisons(tree):
+    """
+    Get the most comparisons a neighborhood takes in the tree
+    """
+    if isinstance(tree, int):
+        return 0
+    _, branches = tree
+    return max(
+        min(position + 1, len(branches) - 1) + worst_comparisons(subtree)
+        for position, (_, subtree) in enumerate(branches)
+    )
+
+
+def emit_tree(tree, depth=1):
+    """
+    Get the source lines of a tree, a function body on the neighborhood n
+    """
+    pad = "    " * depth
+    if isinstance(tree, int):
+        return [f"{pad}return {tree}"]
+    cell, branches = tree
+    lines = []
+    for position, (values, subtree) in enumerate(branches):
+        if position == len(branches) - 1:
+            lines.append(f"{pad}else:")
+        else:
+            test = f"n[{cell}] == {values[0]}" if len(values) == 1 else f"n[{cell}] in {values}"
+            lines.append(f"{pad}{'if' if position == 0 else 'elif'} {test}:")
+        lines.extend(emit_tree(subtree, depth + 1))
+    return lines
+
+
+def emit_module(rules, tree):
+    """
+    Get the source of a module holding the compiled matcher of a rule set
+    """
+    name = rules.__name__
+    return "\n".join([
+        '"""',
+        f"The {name} transition compiled into a decision tree by",
+        "rules_analysis.py, generated, do not edit.",
+        '"""',
+        "",
+        "from crossfinder_rules import Rules, get_neighberhood",
+        "",
+        "",
+        "def match(n):",
+        '    """',
+        "    Get the next state of the center of a neighborhood list",
+        '    """',
+        *emit_tree(tree),
+        "",
+        "",
+        f"class Compiled{name}(Rules):",
+        "    def transition(self, i, j):",
+        "        return match(get_neighberhood(i, j, self.grid))",
+        "",
+    ])
+
+
+def load_matcher(source):
+    """
+    Get the match function of an emitted module
+    """
+    namespace = {}
+    exec(compile(source, "<compiled rules>", "exec"), namespace)
+    return namespace["match"]
+
+
+def check_matcher(match, lut):
+    """
+    Get the codes where a matcher differs from a lookup table
+    """
+    states = np.array([match(list(digits)) for digits in code_digits().tolist()])
+    return np.flatnonzero(states != lut)
+
+
+def report(rules, table, issues, rows, tree_nodes, tree_worst):
+    total = max(int(rows.sum()), 1)
+    print(f"{rules.__name__}: {len(table)} rows")
+    print(f"{'line':>6} {'state':>5} {'share':>8}  condition")
+    for index in np.argsort(-rows, kind="stable"):
+        rule = table[index]
+        condition = rule.condition.replace("\n", " ")
+        if len(condition) > 60:
+            condition = condition[:57] + "..."
+        note = f"  <- {issues[index]}" if index in issues else ""
+        print(f"{rule.line:6} {rule.state:5} {rows[index] / total:8.3%}  {condition}{note}")
+    print(f"{len(issues)} issues, {int((rows == 0).sum())} rows never matched on the samples")
+    print(f"worst case: {len(table)} conditions in the chain, "
+          f"{tree_worst} comparisons in the tree ({tree_nodes} nodes)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze and compile a pattern rule set")
+    parser.add_argument("--rules", default="CrossRules",
+                        help="a Rules subclass of crossfinder_rules.py")
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLES)
+    parser.add_argument("--size", type=int, nargs=2, default=DEFAULT_SIZE)
+    parser.add_argument("--steps", type=int, default=DEFAULT_STEPS)
+    parser.add_argument("--emit", help="write the compiled matcher to this file")
+    parser.add_argument("--verify", action="store_true",
+                        help="check the table against the transition on every neighborhood")
+    args = parser.parse_args(argv)
+
+    rules = getattr(crossfinder_rules, args.rules)
+    table = parse_rules(rules)
+    lut = table_lut(table)
+    issues = find_issues(table)
+    counts, rows = profile(table, args.samples, tuple(args.size), args.steps)
+    tree, nodes = build_tree(lut, counts)
+    report(rules, table, issues, rows, nodes, worst_comparisons(tree))
+
+    source = emit_module(rules, tree)
+    wrong = check_matcher(load_matcher(source), lut)
+    if len(wrong):
+        print(f"the compiled matcher differs on {len(wrong)} neighborhoods")
+        return 1
+    if args.verify:
+        reference = compile_rules(rules).lookup(np.arange(NUM_CODES))
+        wrong = np.flatnonzero(reference != lut)
+        if len(wrong):
+            print(f"the parsed table differs from the transition on {len(wrong)} neighborhoods")
+            return 1
+        print("the parsed table matches the transition on every neighborhood")
+    if args.emit:
+        with open(args.emit, "w", encoding="utf-8") as file:
+            file.write(source)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
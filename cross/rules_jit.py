@@ -0,0 +1,35 @@
+"""
+This module holds the Numba versions of the rule kernels.
+It requires numba and is only imported when the JIT is enabled, see
+jit_backend in rulesets.py, so the default startup doesn't pay for it.
+
+The kernels are compiled on first use and cached next to this file, and
+the rows are split between threads with prange.
+"""
+
+import numba
+from numba import prange
+from rulesets import NUM_STATES
+
+
+@numba.njit(cache=True, parallel=True)
+def lut_step(padded, lut, out):
+    """
+    Compute the neighborhood code of every interior cell of a padded grid
+    and write its next state from the lookup table into out, in one pass.
+
+    Returns the number of UNKNOWN (negative) entries that were hit
+    """
+    height, width = out.shape
+    unknown = 0
+    for i in prange(height):
+        for j in range(width):
+            code = 0
+            for dy in range(3):
+                for dx in range(3):
+                    code = code * NUM_STATES + padded[i + dy, j + dx]
+            state = lut[code]
+            out[i, j] = state
+            if state < 0:
+                unknown += 1
+    return unknown
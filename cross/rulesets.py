@@ -0,0 +1,317 @@
+"""
+This module holds the registry of rule sets.
+A rule set is declared as data and compiled once into a lookup table
+over neighborhood codes. The code of a cell packs its 3x3 neighborhood
+(ordered like get_neighberhood, padded with zeros at the edges) as a
+base NUM_STATES number, so a whole generation is a single table lookup.
+
+Rule sets can be declared as:
+- a Life-like "B3/S23" string: state 1 is alive, other states are dead
+- a pattern table: a list of (pattern, state) rows in the format of
+  CrossRules, the first matching row wins. A pattern holds 9 states,
+  None matches any state. Unmatched neighborhoods get the default state
+- a Rules subclass: its transition is evaluated once per neighborhood,
+  lazily, the first time the neighborhood shows up on a grid
+
+Compiled kernels are cached by a hash of the rule set.
+
+Whole grid steps can run on an optional Numba backend (rules_jit.py),
+enabled with the CROSSFINDER_JIT=1 environment variable or use_jit. It
+fuses the code computation and the lookup into one parallel loop. Without
+numba, or when disabled, the NumPy path is used and numba isn't imported.
+"""
+
+import hashlib
+import inspect
+import os
+import numpy as np
+from crossfinder_rules import Rules, CrossRules
+
+NUM_STATES = 4
+NUM_CODES = NUM_STATES ** 9
+# neighborhood order, clockwise from top left like get_neighberhood
+MOVES = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]
+# the lookup table value of neighborhoods that weren't evaluated yet
+UNKNOWN = -1
+JIT_ENV = "CROSSFINDER_JIT"
+# cells checked at once by check_states
+CHECK_CELLS = 1 << 22
+
+_digits = None
+# the rules_jit module, False when disabled or unavailable, None if unset
+_jit = None
+
+
+def use_jit(enabled=True):
+    """
+    Enable or disable the Numba backend.
+    Returns whether it is in use, False if numba isn't installed
+    """
+    global _jit
+    _jit = False
+    if enabled:
+        try:
+            import rules_jit
+            _jit = rules_jit
+        except ImportError:
+            pass
+    return _jit is not False
+
+
+def jit_backend():
+    """
+    Get the rules_jit module, or None when the JIT isn't in use.
+    The environment decides the first time
+    """
+    if _jit is None:
+        use_jit(os.environ.get(JIT_ENV, "0") == "1")
+    return _jit or None
+
+
+def code_digits():
+    """
+    Get the neighborhood of every code as a (NUM_CODES, 9) array
+    """
+    global _digits
+    if _digits is None:
+        _digits = np.array(
+            np.unravel_index(np.arange(NUM_CODES), (NUM_STATES,) * 9), dtype=np.int8
+        ).T
+    return _digits
+
+
+def check_states(grid):
+    """
+    Raise a ValueError when a cell of the grid isn't a state of the rules,
+    which would index the wrong neighborhood of the lookup tables.
+    Memory-mapped grids are read band by band
+    """
+    rows, cols = grid.shape
+    band = max(1, CHECK_CELLS // max(cols, 1))
+    for top in range(0, rows, band):
+        cells = np.asarray(grid[top:top + band])
+        if cells.size and (cells.min() < 0 or cells.max() >= NUM_STATES):
+            raise ValueError(
+                f"cell states must be in 0..{NUM_STATES - 1}, "
+                f"found {cells.min()}..{cells.max()} in rows {top}..{top + len(cells) - 1}")
+
+
+def pattern_code(pattern):
+    """
+    Get the code of a fully specified neighborhood
+    """
+    code = 0
+    for state in pattern:
+        code = code * NUM_STATES + int(state)
+    return code
+
+
+def padded_codes(padded, out):
+    """
+    Compute the codes of the interior cells of a grid padded with a ring
+    of zeros into out, an intp array of the interior shape. Nothing is
+    allocated, out is updated in place.
+    """
+    height, width = out.shape
+    np.copyto(out, padded[0:height, 0:width])
+    for dy, dx in MOVES[1:]:
+        np.multiply(out, NUM_STATES, out=out)
+        np.add(out, padded[1 + dy:1 + dy + height, 1 + dx:1 + dx + width], out=out)
+    return out
+
+
+def gather_codes(padded, rows, cols):
+    """
+    Get the codes of the given interior cells of a padded grid
+    """
+    codes = np.zeros(len(rows), dtype=np.intp)
+    for dy, dx in MOVES:
+        codes *= NUM_STATES
+        codes += padded[rows + 1 + dy, cols + 1 + dx]
+    return codes
+
+
+def neighborhood_codes(grid, rows=None, cols=None):
+    """
+    Get the neighborhood codes of the whole grid, or of the given cells
+    """
+    padded = np.pad(grid, 1)
+    if rows is None:
+        return padded_codes(padded, np.empty(grid.shape, dtype=np.intp))
+    return gather_codes(padded, rows, cols)
+
+
+class RuleKernel:
+    """
+    A class to represent a rule set compiled into a lookup table
+
+    Attributes
+    ----------
+    lut : np.ndarray
+        The next state of the center cell for every neighborhood code
+    rules : type
+        The Rules subclass that fills UNKNOWN entries, None if complete
+    """
+
+    def __init__(self, lut, rules=None):
+        self.lut = lut
+        self.rules = rules
+
+    def fill(self, codes):
+        """
+        Evaluate the Rules transition for the codes that are still UNKNOWN
+        """
+        missing = np.unique(codes[self.lut[codes] == UNKNOWN])
+        with self.rules(np.zeros((3, 3), dtype=np.int8)) as r:
+            for code in missing:
+                r.grid.flat[:] = code_digits()[code]
+                self.lut[code] = r.transition(1, 1)
+
+    def lookup(self, codes):
+        """
+        Get the next states for an array of codes
+        """
+        if self.rules is not None:
+            self.fill(codes)
+        return self.lut[codes]
+
+    def lookup_into(self, codes, out):
+        """
+        Write the next states for an array of codes into out, an int8
+        array of the same shape, without allocating
+        """
+        np.take(self.lut, codes, out=out, mode="clip")
+        if self.rules is not None and out.min() == UNKNOWN:
+            self.fill(codes)
+            np.take(self.lut, codes, out=out, mode="clip")
+        return out
+
+    def step_padded(self, padded, codes, out):
+        """
+        Write the next states of the interior of a padded grid into out.
+        codes is an intp scratch array of the interior shape, used by the
+        NumPy path and to fill UNKNOWN entries
+        """
+        jit = jit_backend()
+        if jit is None:
+            return self.lookup_into(padded_codes(padded, codes), out)
+        if jit.lut_step(padded, self.lut, out) and self.rules is not None:
+            self.fill(padded_codes(padded, codes))
+            jit.lut_step(padded, self.lut, out)
+        return out
+
+    def step(self, grid):
+        """
+        Get the next generation of the whole grid
+        """
+        return self.lookup(neighborhood_codes(grid)).astype(grid.dtype, copy=False)
+
+    def evaluate(self, grid, rows, cols):
+        """
+        Get the next states of the given cells only
+        """
+        return self.lookup(neighborhood_codes(grid, rows, cols)).astype(grid.dtype, copy=False)
+
+
+def compile_life_like(rule):
+    """
+    Compile a "B3/S23" rule string, state 1 is alive
+    """
+    born, survive = rule.upper().split("/")
+    born = [int(n) for n in born.lstrip("B")]
+    survive = [int(n) for n in survive.lstrip("S")]
+    digits = code_digits()
+    alive = digits == 1
+    count = alive.sum(axis=1) - alive[:, 4]
+    lut = np.where(
+        alive[:, 4], np.isin(count, survive), np.isin(count, born)
+    ).astype(np.int8)
+    return RuleKernel(lut)
+
+
+def compile_table(table, default=0):
+    """
+    Compile a pattern table, the first matching row wins
+    """
+    lut = np.full(NUM_CODES, default, dtype=np.int8)
+    digits = code_digits()
+    # later rows are written first so earlier rows overwrite them
+    for pattern, state in reversed(table):
+        if None not in pattern:
+            lut[pattern_code(pattern)] = state
+            continue
+        match = np.ones(NUM_CODES, dtype=bool)
+        for k, cell in enumerate(pattern):
+            if cell is not None:
+                match &= digits[:, k] == cell
+        lut[match] = state
+    return RuleKernel(lut)
+
+
+def compile_rules(rules):
+    """
+    Wrap a Rules subclass, neighborhoods are evaluated on first use
+    """
+    return RuleKernel(np.full(NUM_CODES, UNKNOWN, dtype=np.int8), rules)
+
+
+def rule_hash(spec):
+    """
+    Get the cache key of a rule set
+    """
+    if isinstance(spec, str):
+        source = "life:" + spec.upper()
+    elif isinstance(spec, type) and issubclass(spec, Rules):
+        try:
+            source = "rules:" + inspect.getsource(spec)
+        except (OSError, TypeError):
+            # no source file (REPL, exec, notebooks): key on the class itself,
+            # which RULE_SETS keeps alive
+            source = f"rules:{spec.__module__}.{spec.__qualname__}:{id(spec)}"
+    else:
+        table, default = spec
+        source = "table:" + repr([(list(p), s) for p, s in table]) + repr(default)
+    return hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+
+
+def compile_rule_set(spec):
+    """
+    Compile a rule set of any of the supported forms
+    """
+    if isinstance(spec, str):
+        return compile_life_like(spec)
+    if isinstance(spec, type) and issubclass(spec, Rules):
+        return compile_rules(spec)
+    table, default = spec
+    return compile_table(table, default)
+
+
+RULE_SETS = {}
+_keys = {}
+_kernels = {}
+
+
+def register(name, spec, default=0):
+    """
+    Register a rule set under a mode name.
+    spec is a "B/S" string, a Rules subclass or a pattern table
+    """
+    if not isinstance(spec, (str, type)):
+        spec = (spec, default)
+    RULE_SETS[name] = spec
+    _keys[name] = rule_hash(spec)
+
+
+def get_kernel(name):
+    """
+    Get the compiled kernel of a registered rule set
+    """
+    key = _keys[name]
+    kernel = _kernels.get(key)
+    if kernel is None:
+        kernel = _kernels[key] = compile_rule_set(RULE_SETS[name])
+    return kernel
+
+
+register("cross", CrossRules)
+register("conway", "B3/S23")
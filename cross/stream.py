@@ -0,0 +1,428 @@
+"""
+This module streams a running game to browser viewers.
+A single asyncio server (standard library only) steps the engine and
+pushes every generation to the viewers connected over WebSocket, as the
+change set of the step (see StepEngine.changes) rather than the grid:
+
+    GET /         the viewer page, viewer.html
+    GET /stream   the WebSocket of binary frames
+    GET /stats    the counters of the server and its viewers, as JSON
+
+A frame is a header (kind, generation, rows, cols, count, little endian)
+and a zlib body. A keyframe holds the whole grid, one byte per cell. A
+delta holds the changed cells in row-major order: the gaps between their
+flat indices as uint32 split into four byte planes, which compress well,
+then their new states. Frames are encoded once per generation and the
+same bytes go to every viewer.
+
+A viewer gets a keyframe when it connects, then deltas. Each viewer has a
+short queue of frames and the network writes wait on the socket, so a
+slow viewer fills its queue: the next frames are dropped for it, and once
+its queue drained it gets a keyframe of the current generation and
+follows the deltas again. Keyframes are also sent to all viewers every
+keyframe_interval generations, and instead of deltas larger than them.
+
+The engine only runs while someone watches. Steps and encoding run in a
+worker thread so the frames keep flowing meanwhile. Usage:
+
+    python stream.py --size 512 512 --fps 20
+    python stream.py glider_gun.rle --mode conway --port 8765
+    python stream.py big.npy --keyframes 0
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+import numpy as np
+from engine import StepEngine
+from board import random_grid
+from rulesets import RULE_SETS
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_FPS = 10
+# generations between keyframes to all viewers, 0 for keyframes on demand only
+KEYFRAME_INTERVAL = 300
+# frames waiting per viewer before frames are dropped for it
+QUEUE_FRAMES = 4
+# bytes buffered by a socket before its writes wait
+WRITE_BUFFER = 1 << 20
+# cells compressed at once in a keyframe
+BAND_CELLS = 1 << 20
+COMPRESSION_LEVEL = 1
+# largest message accepted from a viewer
+MAX_MESSAGE = 1 << 16
+VIEWER_PAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "viewer.html")
+
+KEYFRAME = 0
+DELTA = 1
+# kind, generation, rows, cols, number of changed cells
+HEADER = struct.Struct("<BIIII")
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+
+def encode_keyframe(generation, grid):
+    """
+    Encode a whole grid, compressed band by band so memory-mapped grids
+    are never read at once
+    """
+    rows, cols = grid.shape
+    compressor = zlib.compressobj(COMPRESSION_LEVEL)
+    parts = [HEADER.pack(KEYFRAME, generation, rows, cols, 0)]
+    band = max(1, BAND_CELLS // max(cols, 1))
+    for top in range(0, rows, band):
+        parts.append(compressor.compress(np.ascontiguousarray(grid[top:top + band]).tobytes()))
+    parts.append(compressor.flush())
+    return b"".join(parts)
+
+
+def encode_delta(generation, shape, changes):
+    """
+    Encode a change set (values, rows, cols) in row-major order
+    """
+    values, rows, cols = changes
+    flat = rows.astype(np.int64) * shape[1] + cols
+    gaps = np.diff(flat, prepend=0).astype("<u4")
+    planes = np.ascontiguousarray(gaps.view(np.uint8).reshape(-1, 4).T)
+    body = planes.tobytes() + values.astype(np.uint8).tobytes()
+    return (HEADER.pack(DELTA, generation, shape[0], shape[1], len(values))
+            + zlib.compress(body, COMPRESSION_LEVEL))
+
+
+def websocket_frame(payload, opcode=OPCODE_BINARY):
+    """
+    Build an unmasked WebSocket frame, as sent by servers
+    """
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+async def read_message(reader):
+    """
+    Read a WebSocket frame sent by a viewer, returns (opcode, payload)
+    """
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack("!H", await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack("!Q", await reader.readexactly(8))
+    if length > MAX_MESSAGE:
+        raise ConnectionError("message too large")
+    mask = await reader.readexactly(4) if second & 0x80 else b"\0\0\0\0"
+    payload = await reader.readexactly(length)
+    payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    return first & 0x0F, payload
+
+
+class Viewer:
+    """
+    A class to represent a viewer connected to the stream
+
+    Attributes
+    ----------
+    queue : asyncio.Queue
+        The frames waiting to be written, as (frame, is_keyframe)
+    resync : bool
+        Whether the viewer waits for a keyframe, when it connected or
+        missed frames
+    sent, dropped, keyframes : int
+        The frames written, dropped and the keyframes among the written
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.queue = asyncio.Queue(QUEUE_FRAMES)
+        self.resync = True
+        self.sent = 0
+        self.dropped = 0
+        self.keyframes = 0
+        self.bytes = 0
+
+    def offer(self, delta, keyframe):
+        """
+        Queue the frame of a generation: the delta, or the keyframe when the
+        viewer waits for one (None when there is no keyframe this time)
+        """
+        if self.resync:
+            if keyframe is None or not self.queue.empty():
+                self.dropped += 1
+                return
+            self.queue.put_nowait((keyframe, True))
+            self.resync = False
+        elif delta is not None:
+            if self.queue.full():
+                self.dropped += 1
+                self.resync = True
+                return
+            self.queue.put_nowait((delta, delta is keyframe))
+
+    async def write(self, writer):
+        """
+        Write the queued frames, each write waits for the socket buffer
+        """
+        while True:
+            frame, is_keyframe = await self.queue.get()
+            writer.write(frame)
+            await writer.drain()
+            self.sent += 1
+            self.bytes += len(frame)
+            self.keyframes += is_keyframe
+
+    def stats(self):
+        return {
+            "address": self.address,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "keyframes": self.keyframes,
+            "bytes": self.bytes,
+            "queued": self.queue.qsize(),
+        }
+
+
+class FrameServer:
+    """
+    A class to represent the stream of a game to its viewers
+
+    Attributes
+    ----------
+    engine : StepEngine
+        The engine of the game, only used by the worker thread
+    generation : int
+        The generation of the grid
+    viewers : set
+        The viewers connected
+    keyframe_interval : int
+        The generations between keyframes to all viewers, 0 for never
+    """
+
+    def __init__(self, engine, fps=DEFAULT_FPS, keyframe_interval=KEYFRAME_INTERVAL):
+        self.engine = engine
+        self.interval = 1 / fps
+        self.keyframe_interval = keyframe_interval
+        self.generation = 0
+        self.viewers = set()
+        self.watched = asyncio.Event()
+        self.counters = {"deltas": 0, "keyframes": 0, "delta_bytes": 0,
+                         "keyframe_bytes": 0, "step_seconds": 0.0}
+
+    def advance(self, keyframe_needed):
+        """
+        Step the engine and encode the frames of the new generation, run in
+        the worker thread. Returns the WebSocket frames (delta, keyframe),
+        None for the frames not needed
+        """
+        start = time.perf_counter()
+        count = self.engine.step()
+        self.generation += 1
+        changes = self.engine.changes()
+        grid = self.engine.grid
+        periodic = self.keyframe_interval and self.generation % self.keyframe_interval == 0
+        # a delta costs five bytes per cell, more than a keyframe when dense
+        if changes is None or periodic or 5 * len(changes[0]) >= grid.size:
+            keyframe = websocket_frame(encode_keyframe(self.generation, grid))
+            self.counters["keyframes"] += 1
+            self.counters["keyframe_bytes"] += len(keyframe)
+            delta = keyframe
+        else:
+            delta = None
+            if count:
+                delta = websocket_frame(encode_delta(self.generation, grid.shape, changes))
+                self.counters["deltas"] += 1
+                self.counters["delta_bytes"] += len(delta)
+            keyframe = None
+            if keyframe_needed:
+                keyframe = websocket_frame(encode_keyframe(self.generation, grid))
+                self.counters["keyframes"] += 1
+                self.counters["keyframe_bytes"] += len(keyframe)
+        self.counters["step_seconds"] += time.perf_counter() - start
+        return delta, keyframe
+
+    async def run(self):
+        """
+        Step the game at the frame rate while viewers are connected
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.viewers:
+                self.watched.clear()
+                await self.watched.wait()
+            start = loop.time()
+            keyframe_needed = any(
+                viewer.resync and viewer.queue.empty() for viewer in self.viewers)
+            delta, keyframe = await asyncio.to_thread(self.advance, keyframe_needed)
+            for viewer in list(self.viewers):
+                viewer.offer(delta, keyframe)
+            await asyncio.sleep(max(0.0, self.interval - (loop.time() - start)))
+
+    def stats(self):
+        return {
+            "generation": self.generation,
+            "shape": list(self.engine.grid.shape),
+            **self.counters,
+            "viewers": [viewer.stats() for viewer in self.viewers],
+        }
+
+    async def handle(self, reader, writer):
+        """
+        Serve an HTTP connection: the viewer page, the stats or the stream
+        """
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+        lines = request.decode("latin-1").split("\r\n")
+        method, path, _ = (lines[0].split(" ") + ["", ""])[:3]
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        path = path.split("?")[0]
+        try:
+            if method != "GET":
+                await respond(writer, 405, "text/plain", b"method not allowed")
+            elif path == "/stream" and headers.get("upgrade", "").lower() == "websocket":
+                await self.stream(reader, writer, headers)
+            elif path == "/stats":
+                body = json.dumps(self.stats()).encode()
+                await respond(writer, 200, "application/json", body)
+            elif path in ("/", "/index.html"):
+                with open(VIEWER_PAGE, "rb") as file:
+                    await respond(writer, 200, "text/html; charset=utf-8", file.read())
+            else:
+                await respond(writer, 404, "text/plain", b"not found")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def stream(self, reader, writer, headers):
+        """
+        Accept a WebSocket and stream the frames until the viewer leaves
+        """
+        key = headers.get("sec-websocket-key", "")
+        accept = base64.b64encode(
+            hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        await writer.drain()
+        writer.transport.set_write_buffer_limits(high=WRITE_BUFFER)
+        peer = writer.get_extra_info("peername")
+        viewer = Viewer(f"{peer[0]}:{peer[1]}" if peer else "?")
+        self.viewers.add(viewer)
+        self.watched.set()
+        tasks = {asyncio.create_task(viewer.write(writer)),
+                 asyncio.create_task(receive(reader, writer))}
+        try:
+            # the viewer left, or a write failed
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self.viewers.discard(viewer)
+            for task in tasks:
+                task.cancel()
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                if not isinstance(task.exception(), (ConnectionError, asyncio.IncompleteReadError)):
+                    raise task.exception()
+
+
+async def receive(reader, writer):
+    """
+    Read the messages of a viewer until it closes the WebSocket
+    """
+    while True:
+        opcode, payload = await read_message(reader)
+        if opcode == OPCODE_CLOSE:
+            # the frames queued are dropped, the close goes first
+            writer.write(websocket_frame(payload[:2], OPCODE_CLOSE))
+            return
+        if opcode == OPCODE_PING:
+            writer.write(websocket_frame(payload, OPCODE_PONG))
+
+
+async def respond(writer, status, content_type, body):
+    """
+    Write an HTTP response and close the connection
+    """
+    reasons = {200: "OK", 404: "Not Found", 405: "Method Not Allowed"}
+    writer.write((
+        f"HTTP/1.1 {status} {reasons[status]}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Cache-Control: no-store\r\n"
+        "Connection: close\r\n\r\n").encode() + body)
+    await writer.drain()
+
+
+def load_engine(path=None, size=(256, 256), seed=None, mode="cross"):
+    """
+    Build the engine of a grid file (see batch.load_grid, .npy files are
+    memory-mapped and stepped in bands), or of a random grid
+    """
+    if path is None:
+        return StepEngine(random_grid(size, seed), mode)
+    if path.endswith(".npy"):
+        from bands import BandedEngine
+        return BandedEngine(np.load(path, mmap_mode="r"), mode)
+    from batch import load_grid
+    return StepEngine(load_grid(path), mode)
+
+
+async def serve(engine, host=DEFAULT_HOST, port=DEFAULT_PORT, **kwargs):
+    """
+    Serve the stream of the engine until cancelled
+    """
+    frames = FrameServer(engine, **kwargs)
+    server = await asyncio.start_server(frames.handle, host, port)
+    print(f"streaming {engine.grid.shape[0]}x{engine.grid.shape[1]} "
+          f"on http://{host}:{port}/")
+    async with server:
+        await asyncio.gather(server.serve_forever(), frames.run())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream the game to browser viewers")
+    parser.add_argument("path", nargs="?", help="grid file, .npy, .rle, .cells or text")
+    parser.add_argument("--size", nargs=2, type=int, default=(256, 256),
+                        metavar=("ROWS", "COLS"), help="size of a random grid")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--mode", default="cross", choices=list(RULE_SETS))
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--fps", type=float, default=DEFAULT_FPS)
+    parser.add_argument("--keyframes", type=int, default=KEYFRAME_INTERVAL,
+                        help="generations between keyframes, 0 for on demand only")
+    args = parser.parse_args(argv)
+
+    engine = load_engine(args.path, tuple(args.size), args.seed, args.mode)
+    try:
+        asyncio.run(serve(engine, args.host, args.port, fps=args.fps,
+                          keyframe_interval=args.keyframes))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
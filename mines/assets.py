@@ -0,0 +1,67 @@
+"""
+This module loads the icons of the game, pre-scaled to the cell size.
+Rasterizing an SVG and rescaling it happens once per icon and cell size:
+the scaled surface is saved as a PNG in the asset cache and loaded from
+there by the next launches, which matters when every launch is a fresh
+process (browser, kiosk).
+
+Cached files are named after the icon, the size and a hash of the SVG, so
+an edited icon is rasterized again. The cache directory is
+MINESWEEPER_ASSET_CACHE, or minesweeper in the user cache directory, and
+an empty MINESWEEPER_ASSET_CACHE disables the cache. A cache that can't be
+written is skipped.
+"""
+
+import hashlib
+import os
+import pygame
+
+ASSET_CACHE_ENV = "MINESWEEPER_ASSET_CACHE"
+
+
+def cache_dir():
+    """
+    Get the asset cache directory, None when disabled
+    """
+    path = os.environ.get(ASSET_CACHE_ENV)
+    if path is None:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+            os.path.expanduser("~"), ".cache")
+        path = os.path.join(base, "minesweeper")
+    return path or None
+
+
+def cache_path(path, size, directory):
+    """
+    Get the cached PNG of an icon scaled to size
+    """
+    with open(path, "rb") as file:
+        digest = hashlib.blake2b(file.read(), digest_size=8).hexdigest()
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(directory, f"{name}-{size[0]}x{size[1]}-{digest}.png")
+
+
+def load_icon(path, size):
+    """
+    Load an icon scaled to size (width, height), from the asset cache when
+    it was rasterized before
+    """
+    directory = cache_dir()
+    cached = cache_path(path, size, directory) if directory else None
+    if cached and os.path.exists(cached):
+        try:
+            return pygame.image.load(cached)
+        except pygame.error:
+            pass  # a truncated file, rasterized again below
+    surface = pygame.transform.scale(pygame.image.load(path), size)
+    if cached:
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # written aside and renamed, so a concurrent launch never
+            # reads half a file
+            partial = f"{cached}.{os.getpid()}.png"
+            pygame.image.save(surface, partial)
+            os.replace(partial, cached)
+        except (OSError, pygame.error):
+            pass
+    return surface
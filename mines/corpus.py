@@ -0,0 +1,339 @@
+"""
+This module builds corpora of Minesweeper boards with their difficulty
+metrics, and an index to look boards up by size, density and difficulty.
+It doesn't import pygame.
+
+Every board is generated from its seed like MinesweeperEnv.new_boards
+(the mines are the n_mines smallest random keys), so the index stores
+seeds and metrics, not boards: board_mines gives the mines of a row back.
+The metrics of a board are:
+
+- openings: the connected areas of empty cells, one click each
+- islands: the connected areas of numbers that touch no empty cell
+- bbbv: the 3BV, the fewest clicks that clear the board, the openings
+  plus the numbers that touch no empty cell
+- start: the first click, a cell of the largest opening, -1 without one
+- solvable: whether the board is won from start without a guess
+
+A board is solved with the single cell rules on all the boards of a batch
+at once, in a MinesweeperEnv, and the boards they leave stuck go through
+the exact probabilities of probability.py: a cell that is a mine (or
+safe) in every placement that matches the board is flagged (or revealed).
+A board is not solvable when no cell is certain, or when its frontier is
+too wide to be counted. Boards without an opening start with a guess, so
+they are never solvable.
+
+The index is a directory with one .npy file per column of COLUMNS and
+meta.json, the columns are opened as memory maps, so a query scans them
+without loading the corpus. Usage:
+
+    python corpus.py build expert --preset expert --count 100000
+    python corpus.py query expert --preset expert --bbbv 150 170 --solvable
+"""
+
+import argparse
+import json
+import os
+import numpy as np
+from env import MinesweeperEnv, MINE
+from topology import get_topology
+
+PRESETS = {
+    "beginner": ((9, 9), 10),
+    "intermediate": ((16, 16), 40),
+    "expert": ((16, 30), 99),
+}
+COLUMNS = {
+    "seed": np.int64,
+    "rows": np.int16,
+    "cols": np.int16,
+    "mines": np.int32,
+    "bbbv": np.int32,
+    "openings": np.int32,
+    "islands": np.int32,
+    "start": np.int32,
+    "solvable": np.bool_,
+}
+# the boards generated and solved together
+DEFAULT_BATCH = 256
+INDEX_VERSION = 1
+
+
+def board_mines(shape, n_mines, seeds):
+    """
+    Get the mines of the boards of the given seeds, a (len(seeds), rows,
+    cols) boolean array
+    """
+    rows, cols = shape
+    keys = np.stack([np.random.default_rng(seed).random(rows * cols) for seed in seeds])
+    cells = np.argpartition(keys, n_mines - 1, axis=1)[:, :n_mines]
+    mines = np.zeros((len(seeds), rows * cols), dtype=bool)
+    np.put_along_axis(mines, cells, True, axis=1)
+    return mines.reshape(len(seeds), rows, cols)
+
+
+def label(mask, topology):
+    """
+    Label the connected areas of a batch of masks: every cell of an area
+    gets the flat index of the last cell of the area, -1 outside the mask.
+    The labels spread to the neighbors and jump along the labels until
+    nothing changes
+    """
+    ids = np.arange(mask.size).reshape(mask.shape)
+    labels = np.where(mask, ids, -1)
+    while True:
+        spread = np.where(mask, np.maximum(labels, topology.neighbor_max(labels, -1)), -1)
+        spread = np.where(mask, spread.reshape(-1)[spread], -1)
+        if np.array_equal(spread, labels):
+            return labels
+        labels = spread
+
+
+def count_areas(labels):
+    """
+    Count the areas of every board of a labelled batch
+    """
+    ids = np.arange(labels.size).reshape(labels.shape)
+    return (labels == ids).sum(axis=(1, 2))
+
+
+def board_metrics(values, topology):
+    """
+    Get the openings, islands, 3BV and start of a batch of boards, values
+    like MinesweeperEnv.values
+    """
+    safe = values != MINE
+    empty = values == 0
+    lonely = safe & ~empty & (topology.neighbor_sum(empty) == 0)
+    openings = label(empty, topology)
+    count = len(values)
+    # the start is the label of the largest opening
+    flat = openings.reshape(count, -1)
+    sizes = np.bincount(flat[flat >= 0], minlength=flat.size).reshape(count, -1)
+    start = np.where(sizes.max(axis=1) > 0, sizes.argmax(axis=1), -1)
+    n_openings = count_areas(openings)
+    return {
+        "openings": n_openings,
+        "islands": count_areas(label(lonely, topology)),
+        "bbbv": n_openings + lonely.sum(axis=(1, 2)),
+        "start": start,
+    }
+
+
+def certain_cells(env, index):
+    """
+    Get the hidden cells of a board that are safe and mines in every
+    placement that matches it, see probability.py. None when the frontier
+    is too wide to be counted
+    """
+    import probability
+
+    board = env.board[index]
+    try:
+        probabilities = probability.mine_probabilities(board, env.n_mines, layout=env.topology.layout)
+    except probability.FrontierTooWide:
+        return None
+    hidden = ~env.revealed[index] & ~env.flagged[index]
+    return hidden & (probabilities == 0), hidden & (probabilities == 1)
+
+
+def solve(values, start, topology, exact=True):
+    """
+    Play a batch of boards from their start cell with the rules only,
+    returns the boards that are won. exact uses the exact probabilities
+    when the single cell rules are stuck
+    """
+    count, rows, cols = values.shape
+    n_mines = int((values[0] == MINE).sum())
+    env = MinesweeperEnv(count, (rows, cols), n_mines, layout=topology.layout)
+    env.values[:] = values
+    safe_cells = rows * cols - n_mines
+    opened = np.zeros(values.shape, dtype=bool)
+    opened.reshape(count, -1)[np.flatnonzero(start >= 0), start[start >= 0]] = True
+    active = np.flatnonzero(start >= 0)
+    while len(active):
+        env.revealed[active] |= opened[active]
+        env.flood_fill(active, opened[active])
+        env.encode()
+        revealed = env.revealed[active]
+        flagged = env.flagged[active]
+        hidden = ~revealed & ~flagged
+        shown = env.values[active]
+        flags = topology.neighbor_sum(flagged)
+        # a number with as many flags as mines clears its other neighbors,
+        # one with as many hidden and flagged neighbors flags them
+        satisfied = revealed & (flags == shown)
+        saturated = revealed & (flags + topology.neighbor_sum(hidden) == shown)
+        reveal = hidden & (topology.neighbor_sum(satisfied) > 0)
+        flag = hidden & (topology.neighbor_sum(saturated) > 0)
+        left = n_mines - flagged.sum(axis=(1, 2))
+        reveal |= hidden & (left == 0)[:, None, None]
+        flag |= hidden & (hidden.sum(axis=(1, 2)) == left)[:, None, None]
+        stuck = ~(reveal | flag).any(axis=(1, 2))
+        won = revealed.sum(axis=(1, 2)) == safe_cells
+        if exact:
+            for k in np.flatnonzero(stuck & ~won):
+                cells = certain_cells(env, active[k])
+                if cells is not None:
+                    reveal[k], flag[k] = cells
+            stuck = ~(reveal | flag).any(axis=(1, 2))
+        env.flagged[active] |= flag
+        opened[:] = False
+        opened[active] = reveal
+        active = active[~stuck & ~won]
+    return env.revealed.sum(axis=(1, 2)) == safe_cells
+
+
+def build_corpus(path, specs, count, seed=0, batch=DEFAULT_BATCH, exact=True):
+    """
+    Generate count boards for every (shape, n_mines) of specs, the seeds
+    following seed, and write their index to the directory path
+    """
+    os.makedirs(path, exist_ok=True)
+    total = count * len(specs)
+    columns = {
+        name: np.lib.format.open_memmap(
+            os.path.join(path, f"{name}.npy"), mode="w+", dtype=dtype, shape=(total,))
+        for name, dtype in COLUMNS.items()
+    }
+    row = 0
+    for shape, n_mines in specs:
+        topology = get_topology(shape)
+        for offset in range(0, count, batch):
+            seeds = np.arange(seed + row, seed + row + min(batch, count - offset))
+            mines = board_mines(shape, n_mines, seeds)
+            values = np.where(mines, MINE, topology.neighbor_sum(mines))
+            metrics = board_metrics(values, topology)
+            metrics["solvable"] = solve(values, metrics["start"], topology, exact)
+            window = slice(row, row + len(seeds))
+            columns["seed"][window] = seeds
+            columns["rows"][window], columns["cols"][window] = shape
+            columns["mines"][window] = n_mines
+            for name, column in metrics.items():
+                columns[name][window] = column
+            row += len(seeds)
+    for column in columns.values():
+        column.flush()
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as file:
+        json.dump({"version": INDEX_VERSION, "count": total, "exact": exact}, file)
+    return BoardCorpus(path)
+
+
+class BoardCorpus:
+    """
+    A class to represent a board index on disk, see build_corpus
+
+    Attributes
+    ----------
+    path : str
+        The directory of the index
+    columns : dict
+        The memory mapped columns, see COLUMNS
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as file:
+            meta = json.load(file)
+        if meta["version"] != INDEX_VERSION:
+            raise ValueError(f"index version {meta['version']}, expected {INDEX_VERSION}")
+        self.columns = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in COLUMNS
+        }
+
+    def __len__(self):
+        return len(self.columns["seed"])
+
+    def query(self, size=None, density=None, solvable=None, **ranges):
+        """
+        Get the rows of the boards of a size (rows, cols), a density range
+        (mines per cell) and the metric ranges given by name, like
+        bbbv=(150, 170). Ranges are inclusive, None is unbounded
+        """
+        match = np.ones(len(self), dtype=bool)
+        if size is not None:
+            match &= (self.columns["rows"] == size[0]) & (self.columns["cols"] == size[1])
+        columns = dict(self.columns)
+        if density is not None:
+            cells = columns["rows"].astype(np.int64) * columns["cols"]
+            columns["density"] = columns["mines"] / cells
+            ranges["density"] = density
+        for name, (low, high) in ranges.items():
+            if name not in columns:
+                raise ValueError(f"unknown column {name!r}")
+            column = columns[name]
+            if low is not None:
+                match &= column >= low
+            if high is not None:
+                match &= column <= high
+        if solvable is not None:
+            match &= self.columns["solvable"] == solvable
+        return np.flatnonzero(match)
+
+    def record(self, row):
+        """
+        Get the columns of a row as a dict
+        """
+        return {name: column[row].item() for name, column in self.columns.items()}
+
+    def mines(self, row):
+        """
+        Get the mines of the board of a row
+        """
+        record = self.record(row)
+        shape = (record["rows"], record["cols"])
+        return board_mines(shape, record["mines"], [record["seed"]])[0]
+
+    def pick(self, rng=None, **query):
+        """
+        Get the record of a random board matching query, see query, None
+        when there is none
+        """
+        rows = self.query(**query)
+        if len(rows) == 0:
+            return None
+        rng = np.random.default_rng(rng)
+        return self.record(rows[rng.integers(len(rows))])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and query board corpora")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="generate boards and index them")
+    build.add_argument("path")
+    build.add_argument("--preset", choices=sorted(PRESETS), action="append",
+                       help="the board sizes, expert by default")
+    build.add_argument("--count", type=int, default=1000, help="boards per preset")
+    build.add_argument("--seed", type=int, default=0)
+    build.add_argument("--batch", type=int, default=DEFAULT_BATCH)
+    build.add_argument("--fast", action="store_true",
+                       help="only the single cell rules for solvability")
+    query = commands.add_parser("query", help="print random matching boards")
+    query.add_argument("path")
+    query.add_argument("--preset", choices=sorted(PRESETS))
+    query.add_argument("--density", type=float, nargs=2)
+    for name in ("bbbv", "openings", "islands"):
+        query.add_argument(f"--{name}", type=int, nargs=2, metavar=("LOW", "HIGH"))
+    query.add_argument("--solvable", action="store_true", default=None)
+    query.add_argument("--limit", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        specs = [PRESETS[name] for name in args.preset or ["expert"]]
+        corpus = build_corpus(args.path, specs, args.count, args.seed, args.batch, not args.fast)
+        print(f"{len(corpus)} boards, {corpus.columns['solvable'].mean():.1%} solvable")
+        return 0
+    corpus = BoardCorpus(args.path)
+    ranges = {name: getattr(args, name) for name in ("bbbv", "openings", "islands")
+              if getattr(args, name) is not None}
+    size = PRESETS[args.preset][0] if args.preset else None
+    rows = corpus.query(size, args.density, args.solvable, **ranges)
+    print(f"{len(rows)} matching boards")
+    for row in rows[:args.limit]:
+        print(corpus.record(row))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,199 @@
+"""
+This module implements a batched Minesweeper environment for training bots.
+It holds B boards at once as stacked (B, rows, cols) arrays, with the
+semantics of Cell: values (MINE or the number of adjacent mines), revealed
+cells and flagged cells. It doesn't import pygame.
+
+The API follows Gym vector environments: reset returns (observation, info)
+and step takes one action per board and returns (observation, reward,
+terminated, truncated, info). An action is a cell index, plus rows * cols
+to toggle the flag of the cell instead of revealing it, see action.
+
+Revealing an empty cell reveals its neighbors recursively like
+Minesweeper.reveal_cell, all the boards are flood filled together. The
+neighbors come from the topology of the layout, see topology.py. Boards
+that are won, lost or out of steps are replaced by new boards in the same
+step, their last observation is in info["final_observation"].
+
+The observation is the board encoded like kernels.py: revealed cells hold
+their value, hidden cells hold HIDDEN_CELL and flagged ones FLAGGED_CELL.
+It's a view of the environment state, overwritten in place by the next
+step, so it must be copied to be kept.
+"""
+
+import numpy as np
+from kernels import HIDDEN_CELL, FLAGGED_CELL
+from topology import DEFAULT_LAYOUT, get_topology
+
+# the value of a mine, as in main.py
+MINE = 10
+DEFAULT_GRID_SIZE = (16, 30)
+NUM_OF_MINES = 99
+
+REWARD_WIN = 1.0
+REWARD_LOSS = -1.0
+# revealing a revealed cell
+REWARD_NOOP = -0.01
+
+
+class MinesweeperEnv:
+    """
+    A class to represent a batch of Minesweeper boards
+
+    Attributes
+    ----------
+    values : np.ndarray
+        The value of every cell, MINE or the number of adjacent mines
+    revealed : np.ndarray
+        A boolean array of the revealed cells
+    flagged : np.ndarray
+        A boolean array of the flagged cells
+    board : np.ndarray
+        The observation, see the module docstring
+    steps : np.ndarray
+        The number of steps of every board since its reset
+    topology : Topology
+        The neighbors of the cells, see topology.py
+    """
+
+    def __init__(self, num_boards, grid_size=DEFAULT_GRID_SIZE,
+                 n_mines=NUM_OF_MINES, max_steps=None, seed=None,
+                 layout=DEFAULT_LAYOUT):
+        rows, cols = grid_size
+        if not 0 < n_mines < rows * cols:
+            raise ValueError("n_mines must leave at least one safe cell")
+        self.num_boards = num_boards
+        self.grid_size = grid_size
+        self.n_mines = n_mines
+        self.max_steps = max_steps
+        self.rng = np.random.default_rng(seed)
+        self.topology = get_topology(grid_size, layout)
+        shape = (num_boards, rows, cols)
+        self.values = np.zeros(shape, dtype=np.int8)
+        self.revealed = np.zeros(shape, dtype=bool)
+        self.flagged = np.zeros(shape, dtype=bool)
+        self.board = np.full(shape, HIDDEN_CELL, dtype=np.int8)
+        self.steps = np.zeros(num_boards, dtype=np.int64)
+        # flat views for the per board cell indexing of the actions
+        self._values = self.values.reshape(num_boards, -1)
+        self._revealed = self.revealed.reshape(num_boards, -1)
+        self._flagged = self.flagged.reshape(num_boards, -1)
+
+    @property
+    def num_actions(self):
+        return 2 * self.grid_size[0] * self.grid_size[1]
+
+    def action(self, i, j, flag=False):
+        """
+        Get the action that reveals (or flags) cell (i, j)
+        """
+        cell = i * self.grid_size[1] + j
+        return cell + self.grid_size[0] * self.grid_size[1] if flag else cell
+
+    def new_boards(self, index):
+        """
+        Generate new boards in place of the given boards
+        """
+        rows, cols = self.grid_size
+        # the n_mines smallest random keys of every board are its mines
+        keys = self.rng.random((len(index), rows * cols))
+        cells = np.argpartition(keys, self.n_mines - 1, axis=1)[:, :self.n_mines]
+        mines = np.zeros((len(index), rows * cols), dtype=bool)
+        np.put_along_axis(mines, cells, True, axis=1)
+        mines = mines.reshape(len(index), rows, cols)
+        self.values[index] = np.where(mines, MINE, self.topology.neighbor_sum(mines))
+        self.revealed[index] = False
+        self.flagged[index] = False
+        self.board[index] = HIDDEN_CELL
+        self.steps[index] = 0
+
+    def reset(self, seed=None):
+        """
+        Generate new boards for the whole batch
+        """
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        self.new_boards(np.arange(self.num_boards))
+        return self.board, {}
+
+    def flood_fill(self, index, opened):
+        """
+        Reveal the neighbors of the empty cells in opened recursively, on
+        the given boards. opened holds the cells revealed by the actions
+        """
+        values = self.values[index]
+        revealed = self.revealed[index]
+        frontier = opened & (values == 0)
+        safe = values != MINE
+        while True:
+            active = np.flatnonzero(frontier.any(axis=(1, 2)))
+            if len(active) == 0:
+                break
+            grow = self.topology.dilate(frontier[active]) & ~revealed[active] & safe[active]
+            revealed[active] |= grow
+            frontier[:] = False
+            frontier[active] = grow & (values[active] == 0)
+        self.revealed[index] = revealed
+
+    def step(self, actions):
+        """
+        Apply one action per board.
+        Returns the observation, the rewards, the terminated and truncated
+        masks and an info dict with the won and lost masks
+        """
+        actions = np.asarray(actions)
+        if actions.shape != (self.num_boards,):
+            raise ValueError(f"expected {self.num_boards} actions, got {actions.shape}")
+        cells_count = self.grid_size[0] * self.grid_size[1]
+        boards = np.arange(self.num_boards)
+        flag = actions >= cells_count
+        cells = actions % cells_count
+        self.steps += 1
+        rewards = np.zeros(self.num_boards)
+
+        # flag toggles, ignored on revealed cells
+        toggle = flag & ~self._revealed[boards, cells]
+        self._flagged[boards[toggle], cells[toggle]] ^= True
+
+        reveal = ~flag
+        noop = reveal & self._revealed[boards, cells]
+        rewards[noop] = REWARD_NOOP
+        reveal &= ~noop
+        lost = np.zeros(self.num_boards, dtype=bool)
+        lost[reveal] = self._values[boards[reveal], cells[reveal]] == MINE
+
+        before = self.revealed.sum(axis=(1, 2))
+        opened = np.zeros_like(self._revealed)
+        opened[boards[reveal], cells[reveal]] = True
+        self._revealed[opened] = True
+        index = np.flatnonzero(reveal & ~lost)
+        if len(index):
+            self.flood_fill(index, opened.reshape(self.revealed.shape)[index])
+        self.flagged &= ~self.revealed
+        safe_cells = cells_count - self.n_mines
+        rewards += (self.revealed.sum(axis=(1, 2)) - before) / safe_cells
+
+        won = ~lost & (self.revealed.sum(axis=(1, 2)) == safe_cells)
+        rewards[won] += REWARD_WIN
+        rewards[lost] = REWARD_LOSS
+        terminated = won | lost
+        truncated = np.zeros(self.num_boards, dtype=bool)
+        if self.max_steps is not None:
+            truncated = ~terminated & (self.steps >= self.max_steps)
+
+        self.encode()
+        info = {"won": won, "lost": lost}
+        done = np.flatnonzero(terminated | truncated)
+        if len(done):
+            info["final_observation"] = self.board[done].copy()
+            info["final_index"] = done
+            self.new_boards(done)
+        return self.board, rewards, terminated, truncated, info
+
+    def encode(self):
+        """
+        Update the observation in place
+        """
+        np.copyto(self.board, HIDDEN_CELL)
+        np.copyto(self.board, FLAGGED_CELL, where=self.flagged)
+        np.copyto(self.board, self.values, where=self.revealed)
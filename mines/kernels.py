@@ -0,0 +1,153 @@
+"""
+This module holds the array kernels of the Minesweeper rules.
+The board is an int8 array: revealed cells hold their value, hidden and
+flagged cells hold HIDDEN_CELL and FLAGGED_CELL. The next board marks the
+hidden cells to flag with FLAGGED_CELL and the ones to reveal with
+REVEAL_CELL, like MinesweeperRules.transition.
+
+The NumPy kernel is the default. A Numba kernel (kernels_jit.py) is used
+when MINESWEEPER_JIT=1 is set or after use_jit, numba isn't imported
+otherwise.
+"""
+
+import os
+import numpy as np
+
+HIDDEN_CELL = -1
+FLAGGED_CELL = -2
+REVEAL_CELL = -3
+JIT_ENV = "MINESWEEPER_JIT"
+
+# the kernels_jit module, False when disabled or unavailable, None if unset
+_jit = None
+
+
+def use_jit(enabled=True):
+    """
+    Enable or disable the Numba kernel.
+    Returns whether it is in use, False if numba isn't installed
+    """
+    global _jit
+    _jit = False
+    if enabled:
+        try:
+            import kernels_jit
+            _jit = kernels_jit
+        except ImportError:
+            pass
+    return _jit is not False
+
+
+def neighbor_count(mask):
+    """
+    Count the cells of the mask in the 3x3 neighborhood of every cell,
+    the cell itself included
+    """
+    rows, cols = mask.shape
+    padded = np.pad(mask, 1).astype(np.int8)
+    count = np.zeros(mask.shape, dtype=np.int8)
+    for dy in range(3):
+        for dx in range(3):
+            count += padded[dy:dy + rows, dx:dx + cols]
+    return count
+
+
+def shifted(mask, dy, dx):
+    """
+    Get the mask at (i + dy, j + dx) for every cell (i, j), False outside
+    the board. Offsets are at most 2
+    """
+    rows, cols = mask.shape
+    padded = np.pad(mask, 2)
+    return padded[2 + dy:2 + dy + rows, 2 + dx:2 + dx + cols]
+
+
+def transition_numpy(board, out):
+    """
+    The NumPy kernel, see transition.
+
+    A revealed cell c is saturated when its hidden and flagged neighbors
+    add up to its value, and satisfied when its flagged neighbors do.
+    The rules visit the revealed cells in row-major order, and c flags
+    the hidden cells around it if it's saturated, then reveals the hidden
+    cells around its satisfied neighbors, so each hidden cell keeps the
+    mark of the last c that wrote to it. The writers of a cell are within
+    2 rows and columns, so the offsets are visited in row-major order.
+    """
+    revealed = board >= 0
+    flags = neighbor_count(board == FLAGGED_CELL)
+    satisfied = revealed & (flags == board)
+    saturated = revealed & (flags + neighbor_count(board == HIDDEN_CELL) == board)
+    mark = np.zeros(board.shape, dtype=np.int8)
+    for dy in range(-2, 3):
+        for dx in range(-2, 3):
+            writer = shifted(revealed, dy, dx)
+            if abs(dy) <= 1 and abs(dx) <= 1:
+                mark[writer & shifted(saturated, dy, dx)] = FLAGGED_CELL
+            # satisfied neighbors shared by the writer and the cell
+            reveal = np.zeros(board.shape, dtype=bool)
+            for ey in range(max(-1, dy - 1), min(1, dy + 1) + 1):
+                for ex in range(max(-1, dx - 1), min(1, dx + 1) + 1):
+                    reveal |= shifted(satisfied, ey, ex)
+            mark[writer & reveal] = REVEAL_CELL
+    np.copyto(out, board)
+    hidden = (board == HIDDEN_CELL) & (mark != 0)
+    out[hidden] = mark[hidden]
+    return out
+
+
+def transition_topology(board, out, topology):
+    """
+    The kernel of any board layout, over the neighbor tables of a
+    topology (see topology.py), with the semantics of transition_numpy:
+    the writers are the revealed cells in row-major order, a writer flags
+    the neighbors of the cell if it's saturated then reveals the neighbors
+    of the satisfied cells of its neighborhood, the writer included. The
+    writes get the key 2 * writer (+ 1 for reveals) and each hidden cell
+    keeps the mark of its largest key
+    """
+    flat = board.reshape(-1)
+    revealed = flat >= 0
+    flags = topology.neighbor_sum(board == FLAGGED_CELL).reshape(-1)
+    hidden = topology.neighbor_sum(board == HIDDEN_CELL).reshape(-1)
+    satisfied = revealed & (flags == flat)
+    saturated = revealed & (flags + hidden == flat)
+    owners, indices = topology.owners, topology.indices
+    last = np.full(flat.shape, -1)
+    flagging = saturated[owners]
+    np.maximum.at(last, indices[flagging], 2 * owners[flagging])
+
+    # the (writer, satisfied cell) pairs, then the neighbors of the latter
+    cells = np.arange(len(flat))
+    writers = np.concatenate([owners, cells])
+    middles = np.concatenate([indices, cells])
+    keep = revealed[writers] & satisfied[middles]
+    writers, middles = writers[keep], middles[keep]
+    counts = topology.degree[middles]
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    targets = indices[np.repeat(topology.indptr[middles], counts) + within]
+    np.maximum.at(last, targets, 2 * np.repeat(writers, counts) + 1)
+
+    marks = np.where(last % 2 == 1, REVEAL_CELL, FLAGGED_CELL).astype(board.dtype)
+    np.copyto(out, board)
+    np.copyto(out, marks.reshape(board.shape),
+              where=((flat == HIDDEN_CELL) & (last >= 0)).reshape(board.shape))
+    return out
+
+
+def transition(board, out=None, topology=None):
+    """
+    Apply the Minesweeper rules to an encoded board. Boards of a layout
+    other than "rect" need their topology, see topology.py
+    """
+    global _jit
+    if out is None:
+        out = np.empty_like(board)
+    if topology is not None and topology.layout != "rect":
+        return transition_topology(board, out, topology)
+    if _jit is None:
+        use_jit(os.environ.get(JIT_ENV, "0") == "1")
+    if _jit:
+        _jit.transition(board, out)
+        return out
+    return transition_numpy(board, out)
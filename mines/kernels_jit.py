@@ -0,0 +1,59 @@
+"""
+This module holds the Numba version of the Minesweeper rules kernel.
+It requires numba and is only imported when the JIT is enabled, see
+use_jit in kernels.py.
+
+The kernel is compiled on first use and cached next to this file, and
+the rows are split between threads with prange.
+"""
+
+import numpy as np
+import numba
+from numba import prange
+from kernels import HIDDEN_CELL, FLAGGED_CELL, REVEAL_CELL
+
+
+@numba.njit(cache=True, parallel=True)
+def transition(board, out):
+    """
+    The Numba kernel, see transition_numpy in kernels.py
+    """
+    rows, cols = board.shape
+    satisfied = np.zeros((rows, cols), dtype=np.bool_)
+    saturated = np.zeros((rows, cols), dtype=np.bool_)
+    for i in prange(rows):
+        for j in range(cols):
+            value = board[i, j]
+            if value < 0:
+                continue
+            flags = 0
+            hidden = 0
+            for y in range(max(i - 1, 0), min(i + 2, rows)):
+                for x in range(max(j - 1, 0), min(j + 2, cols)):
+                    if board[y, x] == FLAGGED_CELL:
+                        flags += 1
+                    elif board[y, x] == HIDDEN_CELL:
+                        hidden += 1
+            satisfied[i, j] = flags == value
+            saturated[i, j] = flags + hidden == value
+
+    for i in prange(rows):
+        for j in range(cols):
+            out[i, j] = board[i, j]
+            if board[i, j] != HIDDEN_CELL:
+                continue
+            # the last writer in row-major order decides the mark
+            for y in range(max(i - 2, 0), min(i + 3, rows)):
+                for x in range(max(j - 2, 0), min(j + 3, cols)):
+                    if board[y, x] < 0:
+                        continue
+                    mark = 0
+                    if abs(y - i) <= 1 and abs(x - j) <= 1 and saturated[y, x]:
+                        mark = FLAGGED_CELL
+                    for ny in range(max(max(y, i) - 1, 0), min(min(y, i) + 2, rows)):
+                        for nx in range(max(max(x, j) - 1, 0), min(min(x, j) + 2, cols)):
+                            if satisfied[ny, nx]:
+                                mark = REVEAL_CELL
+                    if mark != 0:
+                        out[i, j] = mark
+    return out
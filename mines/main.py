@@ -17,6 +17,9 @@ import copy
 import asyncio
 import numpy as np
 import pygame
+import assets
+import kernels
+import topology
 
 colors = {
     1: "blue",
@@ -24,7 +27,7 @@ colors = {
     3: "darkgoldenrod",
     4: "darkorange",
     5: "darkred",
-    6: "darkpurple",
+    6: "purple4",
     7: "brown",
     8: "black",
     10: "black",
@@ -36,6 +39,8 @@ colors = {
 # Game settings
 DEFAULT_GRID_SIZE = (16, 30)
 NUM_OF_MINES = 99
+# seconds the hint may spend sampling a board too wide to be counted
+HINT_TIME_BUDGET = 0.5
 FLAG_MINE = "F"
 MAYBE_MINE = "M"
 HIDDEN = "H"
@@ -180,23 +185,46 @@ class MinesweeperRules:
         A list of lists representing the visible grid
     grid_size : tuple
         A tuple representing the size of the grid
+    topology : topology.Topology
+        The neighbors of every cell, see topology.py
     """
 
-    def __init__(self, visible_grid):
-        self.grid_size = (len(visible_grid), len(visible_grid[0]))
+    def __init__(self, visible_grid, layout=topology.DEFAULT_LAYOUT):
+        self.grid_size = (sum(1 for row in visible_grid if row), len(visible_grid[0]))
         self.visible_grid = visible_grid
+        self.topology = topology.get_topology(self.grid_size, layout)
 
     def transition(self):
-        next_grid = copy.deepcopy(self.visible_grid)
-        for i in range(len(self.visible_grid)):
-            for j in range(len(self.visible_grid[i])):
-                if (
-                    self.visible_grid[i][j] != FLAG_MINE
-                    and self.visible_grid[i][j] != "_"
-                ):
-                    self.apply_rules(i, j, next_grid)
+        """
+        Apply the rules to the whole grid at once with an array kernel
+        (see kernels.py), apply_rules is the cell by cell version
+        """
+        board = self.encode()
+        marks = kernels.transition(board, topology=self.topology)
+        next_grid = [list(row) for row in self.visible_grid]
+        for i, j in zip(*np.nonzero(marks != board)):
+            next_grid[i][j] = (
+                FLAG_MINE if marks[i, j] == kernels.FLAGGED_CELL else TO_BE_REVEALED
+            )
         return next_grid
 
+    def encode(self):
+        """
+        Encode the visible grid as an int8 array, see kernels.py.
+        Empty rows at the end of the grid are ignored
+        """
+        rows = [row for row in self.visible_grid if row]
+        board = np.empty((len(rows), len(rows[0])), dtype=np.int8)
+        for i, row in enumerate(rows):
+            for j, cell in enumerate(row):
+                if cell == FLAG_MINE:
+                    board[i, j] = kernels.FLAGGED_CELL
+                elif cell == "_":
+                    board[i, j] = kernels.HIDDEN_CELL
+                else:
+                    board[i, j] = int(cell)
+        return board
+
     def apply_rules(self, i, j, next_grid):
         neighborhood = self.get_neighborhood(i, j)
         mines_on_neighbors = sum(
@@ -225,26 +253,10 @@ class MinesweeperRules:
                             next_grid[nni][nnj] = TO_BE_REVEALED
 
     def get_neighborhood(self, i, j):
-        neighborhood = []
-        for x in range(-1, 2):
-            for y in range(-1, 2):
-                ni, nj = i + x, j + y
-                if 0 <= ni < len(self.visible_grid) and 0 <= nj < len(
-                    self.visible_grid[ni]
-                ):
-                    neighborhood.append(self.visible_grid[ni][nj])
-        return neighborhood
+        return [self.visible_grid[ni][nj] for ni, nj in self.get_neighborhood_indices(i, j)]
 
     def get_neighborhood_indices(self, i, j):
-        indices = []
-        for x in range(-1, 2):
-            for y in range(-1, 2):
-                ni, nj = i + x, j + y
-                if 0 <= ni < len(self.visible_grid) and 0 <= nj < len(
-                    self.visible_grid[ni]
-                ):
-                    indices.append((ni, nj))
-        return indices
+        return sorted([(i, j)] + self.topology.neighbors(i, j))
 
 
 class Minesweeper:
@@ -261,6 +273,10 @@ class Minesweeper:
         A list of lists representing the last visible grid
     grid_size : tuple
         A tuple representing the size of the grid
+    layout : str
+        The neighbors of the cells, one of topology.LAYOUTS
+    n_mines : int
+        The number of mines on the grid
     skull_image : pygame.Surface
         A pygame surface representing the skull image
     flag_image : pygame.Surface
@@ -279,19 +295,16 @@ class Minesweeper:
         A boolean indicating if the game has ended
     """
 
-    def __init__(self, grid_size=DEFAULT_GRID_SIZE, n_mines=NUM_OF_MINES):
+    def __init__(self, grid_size=DEFAULT_GRID_SIZE, n_mines=NUM_OF_MINES,
+                 layout=topology.DEFAULT_LAYOUT):
+        self.n_mines = n_mines
+        self.layout = layout
         self.grid = self.init_grid(grid_size, n_mines)
         self.visible_grid = copy.deepcopy(self.grid)
         self.last_visible_grid = None
         self.grid_size = grid_size
-        self.skull_image = pygame.image.load("skull.svg")
-        self.skull_image = pygame.transform.scale(
-            self.skull_image, (CELL_SIZE, CELL_SIZE)
-        )
-        self.flag_image = pygame.image.load("flag.svg")
-        self.flag_image = pygame.transform.scale(
-            self.flag_image, (CELL_SIZE, CELL_SIZE)
-        )
+        self.skull_image = assets.load_icon("skull.svg", (CELL_SIZE, CELL_SIZE))
+        self.flag_image = assets.load_icon("flag.svg", (CELL_SIZE, CELL_SIZE))
 
         self.screen = pygame.display.set_mode(
             (grid_size[1] * CELL_SIZE, grid_size[0] * CELL_SIZE + 50)
@@ -408,18 +421,15 @@ class Minesweeper:
             A list of lists representing the grid
         """
 
+        counts = topology.get_topology(mines.shape, self.layout).neighbor_sum(
+            mines.astype(bool))
         for i, row in enumerate(grid):
             for j, cell in enumerate(row):
-                if mines[i][j]:
-                    cell.value = MINE
-                    self.increment_surrounding_cells(i, j, grid)
+                cell.value = MINE if mines[i][j] else int(counts[i, j])
 
-    def increment_surrounding_cells(self, i, j, grid):
-        for x in range(-1, 2):
-            for y in range(-1, 2):
-                if 0 <= i + x < len(grid) and 0 <= j + y < len(grid[0]):
-                    if grid[i + x][j + y].value != MINE:
-                        grid[i + x][j + y].value += 1
+    @property
+    def topology(self):
+        return topology.get_topology((len(self.grid), len(self.grid[0])), self.layout)
 
     async def draw_buttons(self):
         """
@@ -621,11 +631,9 @@ class Minesweeper:
         self.last_visible_grid = copy.deepcopy(self.grid)
 
     def reveal_surrounding_cells(self, i, j):
-        for x in range(-1, 2):
-            for y in range(-1, 2):
-                ni, nj = i + x, j + y
-                if self.is_valid_cell(ni, nj) and self.grid[ni][nj].hidden:
-                    self.reveal_cell(ni, nj)
+        for ni, nj in self.topology.neighbors(i, j):
+            if self.grid[ni][nj].hidden:
+                self.reveal_cell(ni, nj)
 
     def is_valid_cell(self, i, j):
         return 0 <= i < len(self.grid) and 0 <= j < len(self.grid[0])
@@ -650,7 +658,7 @@ class Minesweeper:
             self.end = False
 
     def apply_rules(self, board):
-        rules = MinesweeperRules(board)
+        rules = MinesweeperRules(board, self.layout)
         next_visible_grid = rules.transition()
         for i, row in enumerate(self.grid):
             for j, cell in enumerate(row):
@@ -659,8 +667,11 @@ class Minesweeper:
                 elif next_visible_grid[i][j] == FLAG_MINE:
                     cell.flagged = True
 
-    def next_day(self):
-        self.last_visible_grid = copy.deepcopy(self.grid)
+    def visible_board(self):
+        """
+        Get the board as the player sees it: FLAG_MINE for flagged cells,
+        "_" for hidden cells and the value of revealed cells as a string
+        """
         board = [["_" for _ in range(len(self.grid[0]))]
                  for _ in range(len(self.grid))]
         for i, row in enumerate(self.grid):
@@ -669,10 +680,33 @@ class Minesweeper:
                     board[i][j] = FLAG_MINE
                 elif not cell.hidden:
                     board[i][j] = str(cell.value)
-            board.append([])
-        self.apply_rules(board)
+        return board
+
+    def next_day(self):
+        self.last_visible_grid = copy.deepcopy(self.grid)
+        self.apply_rules(self.visible_board())
         self.grid_dirty = True
 
+    def mine_probabilities(self):
+        """
+        Get the mine probability of every cell from the visible board only,
+        see probability.py. Rect boards too wide to be counted are sampled
+        for HINT_TIME_BUDGET seconds instead, see sampler.py. Both are
+        imported by the first hint, not at startup
+        """
+        import probability
+        import sampler
+
+        board = MinesweeperRules(self.visible_board(), self.layout).encode()
+        try:
+            return probability.mine_probabilities(
+                board, self.n_mines, layout=self.layout)
+        except probability.FrontierTooWide:
+            if self.layout != topology.DEFAULT_LAYOUT:
+                raise
+            return sampler.estimate_probabilities(
+                board, self.n_mines, HINT_TIME_BUDGET).probabilities
+
     def reset_game(self):
         self.grid = self.init_grid()
         self.visible_grid = copy.deepcopy(self.grid)
@@ -682,11 +716,23 @@ class Minesweeper:
         self.end = False
 
     def give_hint(self):
-        for i in range(len(self.grid)):
-            for j in range(len(self.grid[0])):
-                if not self.grid[i][j].is_mine() and self.grid[i][j].hidden:
-                    self.reveal_cell(i, j)
-                    break
+        """
+        Reveal the hidden cell that is the least likely to be a mine
+        """
+        try:
+            probabilities = self.mine_probabilities()
+        except ValueError:
+            # a mine is shown, the game is over
+            return
+        candidates = [
+            (probabilities[i, j], i, j)
+            for i, row in enumerate(self.grid)
+            for j, cell in enumerate(row)
+            if cell.hidden and not cell.flagged
+        ]
+        if candidates:
+            _, i, j = min(candidates)
+            self.reveal_cell(i, j)
         self.grid_dirty = True
 
     async def run(self):
@@ -0,0 +1,368 @@
+"""
+This module computes the exact mine probability of every hidden cell.
+The board is encoded like kernels.py. Flags are not trusted: flagged cells
+are unknown cells like the hidden ones.
+
+The hidden cells next to a revealed number form the frontier, the other
+hidden cells are unconstrained. The frontier is split into components
+that share no number, and each component is swept cell by cell with a
+dynamic program over the boundary state: the number of mines still needed
+by every number that has cells on both sides of the sweep. The table maps
+each state to the count of assignments per number of mines, so the cost
+is polynomial in the frontier length for a bounded number of open numbers
+(the width), whatever its total size. The sweep order is the narrowest of
+a few candidates, and a sweep gives up with FrontierTooWide when a step
+has more than max_states states.
+
+The components are then combined with binomial counts for the
+unconstrained cells, C(free cells, mines left), and a weighted backward
+sweep gives the exact probability of every frontier cell. Counts are
+Python integers, so nothing overflows on large boards.
+"""
+
+import numpy as np
+from kernels import HIDDEN_CELL, FLAGGED_CELL
+from topology import DEFAULT_LAYOUT, get_topology
+
+# the most boundary states of a sweep step, see FrontierTooWide
+DEFAULT_MAX_STATES = 2048
+
+
+class FrontierTooWide(ValueError):
+    """
+    Raised when a component has too many boundary states to be counted
+    """
+
+
+def frontier_constraints(board, layout=DEFAULT_LAYOUT):
+    """
+    Get the numbers next to unknown cells as (mines needed, unknown cells),
+    with the neighbors of the layout, see topology.py
+    """
+    unknown = (board == HIDDEN_CELL) | (board == FLAGGED_CELL)
+    topology = get_topology(board.shape, layout)
+    keep = (board.reshape(-1) >= 0)[topology.owners] & unknown.reshape(-1)[topology.indices]
+    owners, cells = topology.owners[keep], topology.indices[keep]
+    if len(owners) == 0:
+        return []
+    cols = board.shape[1]
+    starts = np.flatnonzero(np.diff(owners, prepend=-1))
+    return [
+        (int(board.flat[owners[start]]), [divmod(cell, cols) for cell in group.tolist()])
+        for start, group in zip(starts, np.split(cells, starts[1:]))
+    ]
+
+
+def components(constraints):
+    """
+    Split the constraints into groups that share no cell
+    """
+    # union-find over the constraints, through the first one of every cell
+    parent = list(range(len(constraints)))
+
+    def root(index):
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    owner = {}
+    for index, (_, cells) in enumerate(constraints):
+        for cell in cells:
+            other = owner.setdefault(cell, index)
+            parent[root(other)] = root(index)
+    groups = {}
+    for index in range(len(constraints)):
+        groups.setdefault(root(index), []).append(constraints[index])
+    return list(groups.values())
+
+
+def sweep_width(order, constraints):
+    """
+    Get the largest number of open constraints while sweeping the cells
+    in order
+    """
+    position = {cell: t for t, cell in enumerate(order)}
+    events = [0] * (len(order) + 1)
+    for _, cells in constraints:
+        spots = [position[cell] for cell in cells]
+        events[min(spots)] += 1
+        events[max(spots)] -= 1
+    width = open_count = 0
+    for t in range(len(order)):
+        open_count += events[t]
+        width = max(width, open_count)
+    return width
+
+
+def greedy_order(cells, constraints, touching):
+    """
+    Sweep the cells of the open constraints first, picking the cell that
+    closes the most constraints and opens the fewest
+    """
+    left = [len(members) for _, members in constraints]
+    opened = set()
+    candidates = set()
+    todo = set(cells)
+    order = []
+    while todo:
+        if not candidates:
+            candidates = {min(todo, key=lambda cell: (len(touching[cell]), cell))}
+
+        def score(cell):
+            closes = sum(1 for c in touching[cell] if left[c] == 1)
+            opens = sum(1 for c in touching[cell] if c not in opened)
+            return (closes - opens, -opens, cell)
+
+        cell = max(candidates, key=score)
+        candidates.discard(cell)
+        todo.discard(cell)
+        order.append(cell)
+        for c in touching[cell]:
+            left[c] -= 1
+            if c not in opened:
+                opened.add(c)
+                candidates.update(other for other in constraints[c][1] if other in todo)
+    return order
+
+
+def sweep_orders(constraints):
+    """
+    Get a few sweep orders, narrowest first, as (width, order) pairs: row
+    by row, column by column, and greedily along the open constraints.
+    The width is only a guide, the number of states also depends on how
+    the constraints overlap
+    """
+    cells = sorted({cell for _, cells in constraints for cell in cells})
+    touching = {cell: [] for cell in cells}
+    for index, (_, members) in enumerate(constraints):
+        for cell in members:
+            touching[cell].append(index)
+    orders = [
+        cells,
+        sorted(cells, key=lambda cell: (cell[1], cell[0])),
+        greedy_order(cells, constraints, touching),
+    ]
+    return sorted(
+        ((sweep_width(order, constraints), order) for order in orders),
+        key=lambda pair: pair[0],
+    )
+
+
+def shift(poly):
+    """
+    Multiply a count polynomial by x, one more mine
+    """
+    return np.concatenate(([0], poly[:-1]))
+
+
+class ComponentSweep:
+    """
+    A class to represent the dynamic program over one frontier component
+
+    Attributes
+    ----------
+    order : list
+        The cells of the component in sweep order
+    width : int
+        The largest number of open constraints along the order
+    forward : list
+        For each step, a dict of boundary state to the count of
+        assignments of the previous cells per number of mines
+    transitions : list
+        For each step, a dict of state to its (mine, next state) moves
+    total : np.ndarray
+        The count of valid assignments per number of mines
+    """
+
+    def __init__(self, constraints, max_states=DEFAULT_MAX_STATES):
+        error = None
+        for self.width, self.order in sweep_orders(constraints):
+            try:
+                self.sweep(constraints, max_states)
+                return
+            except FrontierTooWide as exc:
+                error = exc
+        raise error
+
+    def sweep(self, constraints, max_states):
+        """
+        Run the forward pass along self.order
+        """
+        n = len(self.order)
+        position = {cell: t for t, cell in enumerate(self.order)}
+        needs = [need for need, _ in constraints]
+        first, last = [], []
+        members = [[] for _ in range(n)]
+        for index, (_, cells) in enumerate(constraints):
+            spots = [position[cell] for cell in cells]
+            first.append(min(spots))
+            last.append(max(spots))
+            for spot in spots:
+                members[spot].append(index)
+        # the constraints open before each step, in a fixed order
+        open_before = [
+            [c for c in range(len(constraints)) if first[c] < t <= last[c]]
+            for t in range(n + 1)
+        ]
+
+        zero = np.zeros(n + 1, dtype=object)
+        start = zero.copy()
+        start[0] = 1
+        self.forward = [{(): start}]
+        self.transitions = []
+        for t in range(n):
+            layer, moves = {}, {}
+            for state, poly in self.forward[t].items():
+                need = dict(zip(open_before[t], state))
+                moves[state] = []
+                for mine in (0, 1):
+                    left = dict(need)
+                    valid = True
+                    for c in members[t]:
+                        left[c] = left.get(c, needs[c]) - mine
+                        if left[c] < 0 or (last[c] == t and left[c] != 0):
+                            valid = False
+                            break
+                    if not valid:
+                        continue
+                    next_state = tuple(left[c] for c in open_before[t + 1])
+                    moves[state].append((mine, next_state))
+                    counts = shift(poly) if mine else poly
+                    layer[next_state] = layer.get(next_state, zero) + counts
+            if len(layer) > max_states:
+                raise FrontierTooWide(
+                    f"{len(layer)} states after {t + 1} of {n} cells, width {self.width}")
+            self.forward.append(layer)
+            self.transitions.append(moves)
+        self.total = self.forward[n].get((), zero)
+
+    def probabilities(self, weight):
+        """
+        Get the mine probability numerators of the cells, weight[k] being
+        the weight of the assignments of the component with k mines
+        """
+        n = len(self.order)
+        # backward[state][k]: weight of the completions after k mines
+        backward = {(): np.asarray(weight, dtype=object)}
+        marginals = [0] * n
+        for t in range(n - 1, -1, -1):
+            layer = {}
+            for state, moves in self.transitions[t].items():
+                poly = np.zeros(n + 1, dtype=object)
+                for mine, next_state in moves:
+                    after = backward.get(next_state)
+                    if after is None:
+                        continue
+                    if mine:
+                        poly[:-1] += after[1:]
+                        marginals[t] += np.dot(self.forward[t][state][:-1], after[1:])
+                    else:
+                        poly += after
+                layer[state] = poly
+            backward = layer
+        return dict(zip(self.order, marginals))
+
+
+def trim(poly):
+    """
+    Drop the zero counts at both ends of a count polynomial, returns the
+    lowest number of mines and the counts from there
+    """
+    nonzero = np.flatnonzero(poly != 0)
+    if len(nonzero) == 0:
+        return 0, np.zeros(0, dtype=object)
+    return int(nonzero[0]), poly[nonzero[0]:nonzero[-1] + 1]
+
+
+def convolve(a, b):
+    """
+    Multiply two trimmed count polynomials
+    """
+    (low_a, a), (low_b, b) = a, b
+    out = np.zeros(len(a) + len(b) - 1, dtype=object)
+    for k, count in enumerate(a):
+        out[k:k + len(b)] += count * b
+    return low_a + low_b, out
+
+
+def binomials(cells, most):
+    """
+    Get C(cells, m) for m = 0..most as an object array of exact integers
+    """
+    ways = np.zeros(most + 1, dtype=object)
+    ways[0] = 1
+    for m in range(min(cells, most)):
+        ways[m + 1] = ways[m] * (cells - m) // (m + 1)
+    return ways
+
+
+def mine_probabilities(board, n_mines, max_states=DEFAULT_MAX_STATES, layout=DEFAULT_LAYOUT):
+    """
+    Get the exact mine probability of every cell of an encoded board,
+    revealed cells are 0. n_mines is the number of mines of the board,
+    layout the neighbors of its cells, see topology.py.
+    Raises FrontierTooWide when a component has too many states, and
+    ValueError when no mine placement matches the board
+    """
+    if (board > 8).any():
+        raise ValueError("the board shows a mine, the game is over")
+    unknown = (board == HIDDEN_CELL) | (board == FLAGGED_CELL)
+    sweeps = [ComponentSweep(group, max_states)
+              for group in components(frontier_constraints(board, layout))]
+    frontier = {cell for sweep in sweeps for cell in sweep.order}
+    free = int(unknown.sum()) - len(frontier)
+
+    ways = binomials(free, n_mines)
+
+    def placements(poly, mines):
+        """
+        Count the placements of mines mines in the components of a trimmed
+        polynomial and the unconstrained cells
+        """
+        low, counts = poly
+        mines -= low
+        if mines < 0:
+            return 0
+        size = min(len(counts), mines + 1)
+        return np.dot(counts[:size], ways[mines::-1][:size])
+
+    # the products of the components before and after each one
+    totals = [trim(sweep.total) for sweep in sweeps]
+    before = [(0, np.ones(1, dtype=object))]
+    for poly in totals:
+        before.append(convolve(before[-1], poly))
+    after = [(0, np.ones(1, dtype=object))]
+    for poly in reversed(totals):
+        after.append(convolve(poly, after[-1]))
+    after.reverse()
+
+    everything = before[-1]
+    total = placements(everything, n_mines) if len(everything[1]) else 0
+    if total == 0:
+        raise ValueError("no mine placement matches the board")
+
+    probabilities = np.zeros(board.shape)
+    for index, sweep in enumerate(sweeps):
+        others = convolve(before[index], after[index + 1])
+        # weight[k]: placements of the rest of the board given k mines here,
+        # only needed where the component has assignments
+        low, counts = totals[index]
+        weight = np.zeros(len(sweep.order) + 1, dtype=object)
+        for k in range(low, low + len(counts)):
+            weight[k] = placements(others, n_mines - k)
+        for cell, count in sweep.probabilities(weight).items():
+            probabilities[cell] = count / total
+    if free:
+        # C(free - 1, m - 1) = C(free, m) * m / free
+        scaled = ways * np.arange(n_mines + 1)
+        low, counts = everything
+        inside = sum(
+            count * scaled[n_mines - k]
+            for k, count in enumerate(counts, low) if k <= n_mines
+        ) // free
+        rest = unknown.copy()
+        for cell in frontier:
+            rest[cell] = False
+        probabilities[rest] = inside / total
+    return probabilities
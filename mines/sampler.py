@@ -0,0 +1,516 @@
+"""
+This module estimates the mine probabilities of boards too wide for the
+exact count of probability.py, within a time budget.
+The board is encoded like kernels.py, flags are not trusted.
+
+Many chains run at once as a (frontier cells, chains) int8 array. Only the
+frontier is sampled: given k mines on the frontier, the mines left are
+spread uniformly over the unconstrained cells, so a frontier placement
+weighs C(free cells, mines left) and the unconstrained cells get the mine
+probability (mines left) / (free cells) in expectation.
+
+The chains sample weight * exp(-beta * violations), where violations is how
+far the numbers are from being satisfied, with three moves checked with
+the neighbor sums of the numbers they touch:
+
+- heat bath flips: a cell only shares numbers with cells less than 3 rows
+  and 3 columns away, so the cells with the same (row % 3, col % 3) are
+  drawn together
+- mine shifts: the cells with the same (row % 4, col % 4) swap their
+  content with a neighbor in a random direction, a Metropolis move that
+  keeps the mine count
+- rejection: new placements of the small components are drawn
+  independently at the density of the free cells, and the ones that
+  satisfy the numbers of their component are accepted with the
+  Metropolis-Hastings rule
+
+The mine count weight of a move is taken at the count before it, a small
+error next to the free cells.
+
+Restricted to the placements of a component that satisfy its numbers this
+is the posterior of the component, so a frontier cell is recorded in the
+chains where its component is consistent. Large components are rarely
+consistent as a whole, already on expert boards with a few dozen cells
+revealed: their cells are then recorded in the chains where the numbers
+next to them are satisfied (the NEARBY tier), and the free cells in the
+chains with a valid mine count. These estimates are biased, often far
+off, so their tier marks them approximate and their interval is the whole
+[0, 1] range. The chains are cooled from BETA_START to BETA during the
+burn in.
+
+The other estimates come with the half width of a 95% confidence
+interval from the spread of the chains, which holds when the chains
+mixed. check_coverage compares the intervals to the exact probabilities
+of probability.py on random boards it can count:
+
+    python sampler.py --boards 20 --revealed 80 --time-budget 0.5
+"""
+
+import argparse
+import math
+import time
+from collections import namedtuple
+import numpy as np
+from corpus import board_mines
+from kernels import HIDDEN_CELL, FLAGGED_CELL
+from probability import frontier_constraints, components, mine_probabilities, FrontierTooWide
+from topology import get_topology
+
+DEFAULT_CHAINS = 256
+DEFAULT_TIME_BUDGET = 1.0
+# the inverse temperature of the violations, cooled from BETA_START
+# during the burn in
+BETA_START = 0.5
+BETA = 3.0
+# the share of the budget spent before recording
+BURN_IN = 0.25
+# the components up to this many cells are redrawn by rejection
+REJECTION_CELLS = 16
+# the lowest density of a rejection proposal
+RARE = 1e-3
+# the log weight lost per mine out of the range of the mine count
+OUT_OF_RANGE = 4.0
+# the records a tier needs to be used, see combine
+MIN_RECORDS = 64
+# 95% confidence
+Z_SCORE = 1.96
+# the need of the sink number, out of reach of the int8 sums
+SINK_NEED = 100
+# the tiers of the estimates, from the most exact: the chains where every
+# number is satisfied, where the numbers of the component of the cell are,
+# where the numbers next to the cell are (or only the mine count for the
+# free cells), and none, the mine density
+WHOLE, COMPONENT, NEARBY, PRIOR = range(4)
+FRONTIER_TIERS = np.array([WHOLE, COMPONENT, NEARBY, PRIOR])
+FREE_TIERS = np.array([WHOLE, NEARBY, PRIOR])
+TIER_NAMES = ("whole", "component", "nearby", "prior")
+DIRECTIONS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+Estimate = namedtuple("Estimate", ["probabilities", "half_width", "samples", "tier"])
+
+
+def log_weights(n_mines, free, most):
+    """
+    Get log C(free, n_mines - k) for k = 0..most frontier mines, counts
+    out of range lose OUT_OF_RANGE per mine from the nearest valid count
+    """
+    counts = np.arange(most + 1)
+    left = np.clip(n_mines - counts, 0, free)
+    weights = np.array([
+        math.lgamma(free + 1) - math.lgamma(m + 1) - math.lgamma(free - m + 1)
+        for m in left
+    ])
+    return weights - OUT_OF_RANGE * np.abs(n_mines - counts - left)
+
+
+def split(labels):
+    """
+    Group the indices of an array by their label
+    """
+    return [np.flatnonzero(labels == label) for label in np.unique(labels)]
+
+
+def starts_of(labels):
+    """
+    Get the first index of every run of a sorted label array
+    """
+    return np.flatnonzero(np.diff(labels, prepend=-1))
+
+
+def shift_moves(cells, incident, classes):
+    """
+    Get the mine shifts of every class in every direction, as
+    (columns, partners, numbers, deltas): the cells with a partner in the
+    frontier, their partners, the numbers next to either and the change of
+    these numbers when a mine moves from the cell to its partner. The
+    numbers are padded with the sink and a delta of 0
+    """
+    sink = incident.max()
+    rows, cols = np.array(cells).T
+    # the frontier cell at every position, -1 elsewhere and on the border
+    grid = np.full((rows.max() + 3, cols.max() + 3), -1)
+    grid[rows + 1, cols + 1] = np.arange(len(cells))
+    moves = [[] for _ in classes]
+    for dy, dx in DIRECTIONS:
+        partners = grid[rows + 1 + dy, cols + 1 + dx]
+        before = incident
+        after = incident[partners]
+        # a number next to only one of the cells changes, the sink never
+        shared = (before[:, :, None] == after[:, None, :])
+        numbers = np.concatenate([before, after], axis=1)
+        deltas = np.concatenate([
+            -(~shared.any(axis=2)).astype(np.int8),
+            (~shared.any(axis=1)).astype(np.int8),
+        ], axis=1)
+        deltas[numbers == sink] = 0
+        numbers = np.where(deltas != 0, numbers, sink)
+        for moves_of, members in zip(moves, classes):
+            members = members[partners[members] >= 0]
+            if len(members):
+                moves_of.append((members, partners[members], numbers[members], deltas[members]))
+    return [directions for directions in moves if directions]
+
+
+class FrontierChains:
+    """
+    A class to represent a batch of Markov chains over the frontier
+
+    Attributes
+    ----------
+    cells : list
+        The frontier cells, the rows of mines
+    mines : np.ndarray
+        The (cells, chains) int8 placements
+    count : np.ndarray
+        The mines on the frontier of every chain
+    sums : np.ndarray
+        The (numbers + 1, chains) mines next to every number, the numbers
+        are sorted by component and the last row is a sink for the padding
+        of incident, kept at 0
+    incident : np.ndarray
+        The (cells, 8) numbers next to every cell, padded with the sink
+    component : np.ndarray
+        The component of every cell
+    classes : list
+        The rows of the cells flipped together
+    shifts : list
+        The (columns, partners, numbers, deltas) of the mine shifts of
+        every class and direction, see shift_moves
+    """
+
+    def __init__(self, constraints, n_mines, free, chains, rng):
+        self.rng = rng
+        self.n_mines = n_mines
+        self.free = free
+        groups = components(constraints)
+        constraints = [constraint for group in groups for constraint in group]
+        number_component = np.repeat(np.arange(len(groups)), [len(group) for group in groups])
+        self.starts = starts_of(number_component)
+
+        self.cells = sorted({cell for _, cells in constraints for cell in cells})
+        column = {cell: j for j, cell in enumerate(self.cells)}
+        sink = len(constraints)
+        # the sink never counts as satisfied, see update
+        self.needs = np.array([need for need, _ in constraints] + [SINK_NEED], dtype=np.int8)
+        # the cells of every number, padded with len(cells)
+        pad = len(self.cells)
+        members = np.array([
+            [column[cell] for cell in cells] + [pad] * (8 - len(cells))
+            for _, cells in constraints
+        ])
+        # the numbers of every cell, in the order of the numbers
+        numbers, slots = np.nonzero(members < pad)
+        owners = members[numbers, slots]
+        order = np.argsort(owners, kind="stable")
+        self.degree = np.bincount(owners, minlength=pad).astype(np.int8)
+        first = np.cumsum(self.degree, dtype=np.int64) - self.degree
+        self.incident = np.full((pad, 8), sink)
+        self.incident[owners[order], np.arange(len(order)) - first[owners[order]]] = numbers[order]
+        self.component = number_component[self.incident[:, 0]]
+        rows, cols = np.array(self.cells).T
+        self.classes = split(rows % 3 * 3 + cols % 3)
+        self.shifts = shift_moves(self.cells, self.incident, split(rows % 4 * 4 + cols % 4))
+        self.weights = log_weights(n_mines, free, len(self.cells))
+        self.density = n_mines / max(len(self.cells) + free, 1)
+
+        # the small components, their cells sorted by component and their
+        # numbers as rows of these cells, padded with len(small_cells)
+        small = np.bincount(self.component) <= REJECTION_CELLS
+        self.small_cells = np.flatnonzero(small[self.component])
+        self.small_cells = self.small_cells[np.argsort(self.component[self.small_cells], kind="stable")]
+        self.small_numbers = np.flatnonzero(small[number_component])
+        position = np.full(len(self.cells) + 1, len(self.small_cells))
+        position[self.small_cells] = np.arange(len(self.small_cells))
+        self.small_members = position[members[self.small_numbers]]
+        small_components = number_component[self.small_numbers]
+        self.small_starts = starts_of(small_components)
+        # the rank of the component of every small number and cell
+        labels = np.unique(small_components)
+        self.number_rank = np.searchsorted(labels, small_components)
+        self.cell_rank = np.searchsorted(labels, self.component[self.small_cells])
+        self.cell_starts = starts_of(self.cell_rank)
+
+        self.mines = (rng.random((len(self.cells), chains)) < self.density).astype(np.int8)
+        self.count = self.mines.sum(axis=0, dtype=np.int64)
+        self.sums = np.zeros((sink + 1, chains), dtype=np.int8)
+        padded = np.concatenate([self.mines, np.zeros((1, chains), dtype=np.int8)])
+        self.sums[:-1] = padded[members].sum(axis=1)
+
+    def add(self, numbers, change):
+        """
+        Add change (cells, slots, chains) to the sums of numbers
+        (cells, slots), no two cells may share a number
+        """
+        change = np.broadcast_to(change, numbers.shape + change.shape[2:])
+        for slot in range(numbers.shape[1]):
+            self.sums[numbers[:, slot]] += change[:, slot]
+        self.sums[-1] = 0
+
+    def update(self, columns, beta):
+        """
+        Draw the cells of one class from their conditional distribution
+        """
+        numbers = self.incident[columns]
+        mines = self.mines[columns]
+        # a mine adds a violation to the numbers already satisfied without
+        # it, and removes one from the others
+        satisfied = (self.sums[numbers] >= self.needs[numbers][:, :, None] + mines[:, None]).sum(axis=1)
+        violations = 2 * satisfied - self.degree[columns, None]
+        without = self.count - mines
+        log_odds = self.weights[without + 1] - self.weights[without] - beta * violations
+        with np.errstate(over="ignore"):
+            new = (self.rng.random(mines.shape) * (1 + np.exp(-log_odds)) < 1).astype(np.int8)
+        change = new - mines
+        self.mines[columns] = new
+        self.count += change.sum(axis=0)
+        self.add(numbers, change[:, None])
+
+    def shift(self, move, beta):
+        """
+        Swap the cells of a class with their partners in one direction,
+        moving mines by one cell, with the Metropolis rule
+        """
+        columns, partners, numbers, deltas = move
+        moved = self.mines[columns] - self.mines[partners]
+        sums = self.sums[numbers]
+        needs = self.needs[numbers][:, :, None]
+        after = sums + moved[:, None] * deltas[:, :, None]
+        change = (np.abs(after - needs) - np.abs(sums - needs)).sum(axis=1)
+        accept = (moved != 0) & (self.rng.random(moved.shape) < np.exp(-beta * change))
+        moved *= accept
+        self.mines[columns] -= moved
+        self.mines[partners] += moved
+        self.add(numbers, moved[:, None] * deltas[:, :, None])
+
+    def reject(self, beta):
+        """
+        Propose new placements of the small components drawn independently
+        at the density of the free cells, and keep the ones that satisfy
+        the numbers of their component with the Metropolis-Hastings rule
+        """
+        if len(self.small_cells) == 0:
+            return
+        chains = len(self.count)
+        if self.free:
+            density = np.clip(self.n_mines - self.count, 0, self.free) / self.free
+        else:
+            density = np.full(chains, self.density)
+        density = np.clip(density, RARE, 1 - RARE)
+        draws = self.rng.random((len(self.small_cells) + 1, chains)) < density
+        draws = draws.astype(np.int8)
+        draws[-1] = 0
+        sums = draws[self.small_members].sum(axis=1, dtype=np.int8)
+        needs = self.needs[self.small_numbers, None]
+        consistent = np.logical_and.reduceat(sums == needs, self.small_starts, axis=0)
+        # the violations the proposal removes, and the change of the count
+        violations = np.add.reduceat(
+            np.abs(self.sums[self.small_numbers] - needs), self.small_starts, axis=0)
+        mines = self.mines[self.small_cells]
+        change = np.add.reduceat(draws[:-1] - mines, self.cell_starts, axis=0)
+        after = np.clip(self.count + change, 0, len(self.weights) - 1)
+        log_ratio = (self.weights[after] - self.weights[self.count] + beta * violations
+                     - change * np.log(density / (1 - density)))
+        with np.errstate(over="ignore"):
+            accept = consistent & (self.rng.random(consistent.shape) < np.exp(log_ratio))
+        new = np.where(accept[self.cell_rank], draws[:-1], mines)
+        self.count += (new - mines).sum(axis=0)
+        self.mines[self.small_cells] = new
+        self.sums[self.small_numbers] = np.where(
+            accept[self.number_rank], sums, self.sums[self.small_numbers])
+
+    def sweep(self, beta):
+        self.reject(beta)
+        for columns in self.classes:
+            self.update(columns, beta)
+        for moves in self.shifts:
+            self.shift(moves[self.rng.integers(len(moves))], beta)
+
+    def consistent(self):
+        """
+        Get the masks of the records, from the most exact: the chains whose
+        whole frontier satisfies its numbers, the (cells, chains) cells
+        whose component does and the cells whose own numbers do, and the
+        chains with a valid mine count, which all the others have
+        """
+        satisfied = self.sums == self.needs[:, None]
+        satisfied[-1] = True
+        left = self.n_mines - self.count
+        counted = (left >= 0) & (left <= self.free)
+        whole = np.logical_and.reduceat(satisfied[:-1], self.starts, axis=0)
+        local = satisfied[self.incident].all(axis=1)
+        everywhere = whole.all(axis=0) & counted
+        return everywhere, whole[self.component] & counted, local & counted, counted
+
+
+def summarize(totals, recorded):
+    """
+    Pool the chains of the last axis. The estimate is a ratio of the
+    totals to the records of independent chains, its variance comes from
+    the spread of the chain totals around it. Returns the estimates, their
+    half widths and the number of records behind them
+    """
+    samples = recorded.sum(axis=-1)
+    estimate = totals.sum(axis=-1) / np.maximum(samples, 1)
+    chains = (recorded > 0).sum(axis=-1)
+    residuals = totals - recorded * estimate[..., None]
+    variance = ((residuals ** 2).sum(axis=-1) * chains / np.maximum(chains - 1, 1)
+                / np.maximum(samples, 1) ** 2)
+    half_width = np.where(chains >= 2, Z_SCORE * np.sqrt(variance), 0.5)
+    return estimate, half_width, samples
+
+
+def combine(tiers, density):
+    """
+    Summarize tiers of (totals, recorded) from the most exact, every
+    estimate comes from the most exact tier with MIN_RECORDS records.
+    Returns the estimates, their half widths, their records and the index
+    of their tier, len(tiers) for the estimates without records, which
+    are density with half width 0.5
+    """
+    estimate, width, samples = summarize(*tiers[-1])
+    tier = np.where(samples > 0, len(tiers) - 1, len(tiers))
+    estimate = np.where(samples > 0, estimate, density)
+    width = np.where(samples > 0, width, 0.5)
+    for index in reversed(range(len(tiers) - 1)):
+        better, better_width, better_samples = summarize(*tiers[index])
+        use = better_samples >= MIN_RECORDS
+        estimate = np.where(use, better, estimate)
+        width = np.where(use, better_width, width)
+        samples = np.where(use, better_samples, samples)
+        tier = np.where(use, index, tier)
+    return estimate, width, samples, tier
+
+
+def estimate_probabilities(board, n_mines, time_budget=DEFAULT_TIME_BUDGET,
+                           chains=DEFAULT_CHAINS, seed=None):
+    """
+    Estimate the mine probability of every cell of an encoded board,
+    revealed cells are 0.
+    Returns an Estimate with the probabilities, the half width of their
+    95% confidence interval, the fewest records behind a frontier cell and
+    the tier of every cell. The cells of the approximate tiers, NEARBY and
+    PRIOR (no records, the mine density), get an interval covering [0, 1].
+    Raises ValueError when the board shows a mine
+    """
+    if (board > 8).any():
+        raise ValueError("the board shows a mine, the game is over")
+    start = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    unknown = (board == HIDDEN_CELL) | (board == FLAGGED_CELL)
+    constraints = frontier_constraints(board)
+    frontier_size = len({cell for _, cells in constraints for cell in cells})
+    free = int(unknown.sum()) - frontier_size
+    probabilities = np.zeros(board.shape)
+    half_width = np.zeros(board.shape)
+    tier = np.full(board.shape, WHOLE, dtype=np.int8)
+    if not unknown.any():
+        return Estimate(probabilities, half_width, 0, tier)
+    if not constraints:
+        probabilities[unknown] = n_mines / free
+        return Estimate(probabilities, half_width, 0, tier)
+
+    walk = FrontierChains(constraints, n_mines, free, chains, rng)
+    frontier_tiers = [
+        (np.zeros(walk.mines.shape), np.zeros(walk.mines.shape, dtype=np.int64))
+        for _ in range(3)
+    ]
+    free_tiers = [(np.zeros(chains), np.zeros(chains, dtype=np.int64)) for _ in range(2)]
+    burn_in = BURN_IN * time_budget
+    duration = 0.0
+    while True:
+        elapsed = time.perf_counter() - start
+        # stop before a sweep that would overrun the budget
+        if elapsed + duration > time_budget:
+            break
+        cooled = min(1.0, elapsed / burn_in)
+        walk.sweep(BETA_START + (BETA - BETA_START) * cooled)
+        duration = time.perf_counter() - start - elapsed
+        if cooled < 1.0:
+            continue
+        everywhere, component, local, counted = walk.consistent()
+        for (totals, recorded), mask in zip(frontier_tiers, (everywhere, component, local)):
+            totals += walk.mines * mask
+            recorded += mask
+        # the free cells only depend on the mine count
+        if free:
+            share = (n_mines - walk.count) / free
+            for (totals, recorded), mask in zip(free_tiers, (everywhere, counted)):
+                totals += share * mask
+                recorded += mask
+
+    rows, cols = np.array(walk.cells).T
+    estimate, width, samples, used = combine(frontier_tiers, walk.density)
+    probabilities[rows, cols] = estimate
+    half_width[rows, cols] = width
+    tier[rows, cols] = FRONTIER_TIERS[used]
+    if free:
+        rest = unknown.copy()
+        rest[rows, cols] = False
+        probabilities[rest], half_width[rest], _, used = combine(free_tiers, walk.density)
+        tier[rest] = FREE_TIERS[used]
+    approximate = tier >= NEARBY
+    half_width[approximate] = np.maximum(probabilities, 1 - probabilities)[approximate]
+    return Estimate(probabilities, half_width, int(samples.min()), tier)
+
+
+def random_board(shape, n_mines, revealed, seed):
+    """
+    Get the encoded board of a seed with revealed random safe cells, and
+    its mines
+    """
+    mines = board_mines(shape, n_mines, [seed])[0]
+    counts = get_topology(shape).neighbor_sum(mines)
+    safe = np.flatnonzero(~mines)
+    shown = np.random.default_rng(seed).permutation(safe)[:revealed]
+    board = np.full(mines.size, HIDDEN_CELL, dtype=np.int8)
+    board[shown] = counts.ravel()[shown]
+    return board.reshape(shape)
+
+
+def check_coverage(shape, n_mines, revealed, boards, time_budget=DEFAULT_TIME_BUDGET, seed=0):
+    """
+    Estimate random boards and compare the intervals to the exact
+    probabilities, boards too wide to be counted are skipped.
+    Returns the hidden cells and the ones inside their interval per tier,
+    and the boards checked
+    """
+    cells = np.zeros(len(FRONTIER_TIERS), dtype=np.int64)
+    covered = np.zeros(len(FRONTIER_TIERS), dtype=np.int64)
+    checked = 0
+    for board_seed in range(seed, seed + boards):
+        board = random_board(shape, n_mines, revealed, board_seed)
+        try:
+            exact = mine_probabilities(board, n_mines)
+        except FrontierTooWide:
+            continue
+        estimate = estimate_probabilities(board, n_mines, time_budget, seed=board_seed)
+        hidden = board == HIDDEN_CELL
+        inside = np.abs(estimate.probabilities - exact) <= estimate.half_width + 1e-9
+        cells += np.bincount(estimate.tier[hidden], minlength=len(cells))
+        covered += np.bincount(estimate.tier[hidden & inside], minlength=len(cells))
+        checked += 1
+    return cells, covered, checked
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check the intervals of the sampler against the exact probabilities")
+    parser.add_argument("--size", nargs=2, type=int, default=(16, 30), metavar=("ROWS", "COLS"))
+    parser.add_argument("--mines", type=int, default=99)
+    parser.add_argument("--revealed", type=int, default=80, help="safe cells revealed per board")
+    parser.add_argument("--boards", type=int, default=20)
+    parser.add_argument("--time-budget", type=float, default=DEFAULT_TIME_BUDGET)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    cells, covered, checked = check_coverage(tuple(args.size), args.mines, args.revealed,
+                                             args.boards, args.time_budget, args.seed)
+    print(f"{checked} of {args.boards} boards counted exactly")
+    for name, count, inside in zip(TIER_NAMES, cells, covered):
+        if count:
+            print(f"  {name:9} {count:6d} cells  {inside / count:.1%} inside their interval")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,543 @@
+"""
+This module hosts many Minesweeper games behind a local asyncio server.
+It doesn't import pygame: a session holds its board as the encoded arrays
+of kernels.py instead of Cell objects, so thousands of games fit in a few
+megabytes. Every board is generated from its seed like corpus.py, so the
+seeds of a corpus can be replayed here.
+
+The protocol is one JSON object per line, answered by one JSON object per
+line carrying the same "id":
+
+    {"op": "new", "seed": 7, "rows": 16, "cols": 30, "mines": 99}
+    {"op": "reveal", "session": 3, "row": 4, "col": 12}
+    {"op": "flag", "session": 3, "row": 0, "col": 1}
+    {"op": "undo", "session": 3}
+    {"op": "state", "session": 3}
+    {"op": "close", "session": 3}
+    {"op": "stats"}
+
+reveal, flag and undo answer with the state diff of the move: the flat
+indices of the cells that changed and their new codes (HIDDEN_CELL,
+FLAGGED_CELL, the number of adjacent mines or MINE), and the status of
+the game, "playing", "won" or "lost". The moves follow Minesweeper:
+revealing an empty cell opens its neighbors recursively, revealing a mine
+shows all the mines, and undo restores the board before the last move.
+
+Sessions idle for idle_seconds, or the oldest beyond max_live, are
+evicted to a file of the session directory by a worker thread, and
+loaded back by their next request. The latency of every request and the
+throughput are kept for the stats op and the periodic report. Usage:
+
+    python server.py --port 8766 --idle-seconds 60 --report 10
+    python ../benchmarks/loadgen.py --spawn --connections 32 --sessions 2000
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+from collections import deque
+import numpy as np
+from corpus import board_mines
+from env import MINE
+from kernels import HIDDEN_CELL, FLAGGED_CELL
+from topology import DEFAULT_LAYOUT, LAYOUTS, get_topology
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8766
+DEFAULT_GRID_SIZE = (16, 30)
+NUM_OF_MINES = 99
+IDLE_SECONDS = 60.0
+MAX_LIVE = 100_000
+# seconds between two eviction sweeps
+SWEEP_INTERVAL = 1.0
+# latencies kept per op for the percentiles
+LATENCY_WINDOW = 10_000
+# seconds of history of the throughput
+RATE_WINDOW = 10.0
+MAX_LINE = 1 << 16
+STATUSES = ("playing", "won", "lost")
+# the saved sessions: seed, rows, cols, mines, moves, layout, status and
+# undo status (NO_UNDO without undo), then the board and the undo board
+SESSION_HEADER = struct.Struct("<qIIIIBBB")
+NO_UNDO = 255
+SESSION_EXTENSION = ".session"
+
+
+@functools.lru_cache(maxsize=32)
+def neighbor_lists(shape, layout=DEFAULT_LAYOUT):
+    """
+    Get the neighbors of every cell as lists, for the flood fill of a
+    single board
+    """
+    topology = get_topology(shape, layout)
+    indices = topology.indices.tolist()
+    bounds = topology.indptr.tolist()
+    return [indices[start:stop] for start, stop in zip(bounds, bounds[1:])]
+
+
+def board_values(seed, shape, n_mines, layout=DEFAULT_LAYOUT):
+    """
+    Get the flat values of the board of a seed, MINE or the number of
+    adjacent mines
+    """
+    mines = board_mines(shape, n_mines, [seed])[0]
+    counts = get_topology(shape, layout).neighbor_sum(mines)
+    return np.where(mines, MINE, counts).astype(np.int8).ravel()
+
+
+class Session:
+    """
+    A class to represent a game hosted by the server
+
+    Attributes
+    ----------
+    seed : int
+        The seed of the board
+    values : np.ndarray
+        The flat values of the cells, regenerated from the seed on load
+    board : np.ndarray
+        The flat board as the player sees it, encoded like kernels.py
+    undo : tuple
+        The (board, status) before the last move, None when there is none
+    status : str
+        One of STATUSES
+    """
+
+    __slots__ = ("seed", "shape", "n_mines", "layout", "values", "board",
+                 "undo", "status", "moves", "last_active")
+
+    def __init__(self, seed, shape, n_mines, layout=DEFAULT_LAYOUT):
+        rows, cols = shape
+        if not 0 < n_mines < rows * cols:
+            raise ValueError("mines must leave at least one safe cell")
+        self.seed = seed
+        self.shape = shape
+        self.n_mines = n_mines
+        self.layout = layout
+        self.values = board_values(seed, shape, n_mines, layout)
+        self.board = np.full(rows * cols, HIDDEN_CELL, dtype=np.int8)
+        self.undo = None
+        self.status = "playing"
+        self.moves = 0
+        self.last_active = time.monotonic()
+
+    def cell(self, row, col):
+        rows, cols = self.shape
+        if not (isinstance(row, int) and isinstance(col, int)
+                and 0 <= row < rows and 0 <= col < cols):
+            raise ValueError(f"no cell ({row}, {col}) on a {rows}x{cols} board")
+        return row * cols + col
+
+    def remember(self):
+        self.undo = (self.board.copy(), self.status)
+        self.moves += 1
+
+    def reveal(self, row, col):
+        """
+        Reveal a cell, returns the cells that changed
+        """
+        cell = self.cell(row, col)
+        if self.status != "playing" or self.board[cell] >= 0:
+            return []
+        self.remember()
+        if self.values[cell] == MINE:
+            mines = np.flatnonzero(self.values == MINE)
+            self.board[mines] = MINE
+            self.status = "lost"
+            return mines.tolist()
+        opened = [cell]
+        if self.values[cell] == 0:
+            # open the empty area and its border, breadth first
+            neighbors = neighbor_lists(self.shape, self.layout)
+            values = self.values
+            seen = {cell}
+            for current in opened:
+                if values[current] != 0:
+                    continue
+                for neighbor in neighbors[current]:
+                    if neighbor not in seen and self.board[neighbor] < 0:
+                        seen.add(neighbor)
+                        opened.append(neighbor)
+        self.board[opened] = self.values[opened]
+        if np.count_nonzero(self.board >= 0) == self.board.size - self.n_mines:
+            self.status = "won"
+        return opened
+
+    def flag(self, row, col):
+        """
+        Toggle the flag of a hidden cell, returns the cells that changed
+        """
+        cell = self.cell(row, col)
+        if self.status != "playing" or self.board[cell] >= 0:
+            return []
+        self.remember()
+        self.board[cell] = HIDDEN_CELL if self.board[cell] == FLAGGED_CELL else FLAGGED_CELL
+        return [cell]
+
+    def undo_last_move(self):
+        """
+        Restore the board before the last move, returns the cells that changed
+        """
+        if self.undo is None:
+            return []
+        board, self.status = self.undo
+        changed = np.flatnonzero(board != self.board).tolist()
+        self.board = board
+        self.undo = None
+        return changed
+
+    def diff(self, cells):
+        return {"cells": cells, "values": self.board[cells].tolist(), "status": self.status}
+
+    def state(self):
+        return {"rows": self.shape[0], "cols": self.shape[1], "mines": self.n_mines,
+                "seed": self.seed, "status": self.status, "moves": self.moves,
+                "board": self.board.tolist()}
+
+    def save(self, path):
+        """
+        Save the session without its values, which come back from the seed
+        """
+        undo_status = STATUSES.index(self.undo[1]) if self.undo else NO_UNDO
+        header = SESSION_HEADER.pack(
+            self.seed, *self.shape, self.n_mines, self.moves, LAYOUTS.index(self.layout),
+            STATUSES.index(self.status), undo_status)
+        with open(path, "wb") as file:
+            file.write(header + self.board.tobytes()
+                       + (self.undo[0].tobytes() if self.undo else b""))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            data = file.read()
+        seed, rows, cols, n_mines, moves, layout, status, undo_status = \
+            SESSION_HEADER.unpack_from(data)
+        session = cls(seed, (rows, cols), n_mines, LAYOUTS[layout])
+        boards = np.frombuffer(data, dtype=np.int8, offset=SESSION_HEADER.size)
+        session.board = boards[:rows * cols].copy()
+        if undo_status != NO_UNDO:
+            session.undo = (boards[rows * cols:].copy(), STATUSES[undo_status])
+        session.status = STATUSES[status]
+        session.moves = moves
+        return session
+
+
+class Metrics:
+    """
+    A class to represent the counters of the server
+
+    Attributes
+    ----------
+    counts : dict
+        The number of requests of every op
+    latencies : dict
+        The last LATENCY_WINDOW latencies of every op, in seconds
+    rates : deque
+        (time, requests) samples of the last RATE_WINDOW seconds
+    """
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.counts = {}
+        self.errors = 0
+        self.latencies = {}
+        self.rates = deque([(self.start, 0)])
+        self.requests = 0
+
+    def record(self, op, seconds):
+        self.requests += 1
+        self.counts[op] = self.counts.get(op, 0) + 1
+        if op not in self.latencies:
+            self.latencies[op] = deque(maxlen=LATENCY_WINDOW)
+        self.latencies[op].append(seconds)
+
+    def sample(self):
+        now = time.monotonic()
+        self.rates.append((now, self.requests))
+        while len(self.rates) > 2 and now - self.rates[1][0] >= RATE_WINDOW:
+            self.rates.popleft()
+
+    def throughput(self):
+        (first, before), (last, after) = self.rates[0], self.rates[-1]
+        return (after - before) / (last - first) if last > first else 0.0
+
+    def summary(self):
+        latency = {}
+        for op, values in self.latencies.items():
+            p50, p90, p99 = np.percentile(np.fromiter(values, float), [50, 90, 99]) * 1000
+            latency[op] = {"p50_ms": p50, "p90_ms": p90, "p99_ms": p99}
+        return {
+            "uptime": time.monotonic() - self.start,
+            "requests": self.requests,
+            "errors": self.errors,
+            "throughput": self.throughput(),
+            "counts": self.counts,
+            "latency": latency,
+        }
+
+
+class GameServer:
+    """
+    A class to represent the server of the games
+
+    Attributes
+    ----------
+    sessions : dict
+        The live sessions by id
+    evicting : dict
+        The sessions being written to the session directory
+    closing : set
+        The ids of the sessions closed while being written, whose files
+        are removed once written
+    directory : str
+        The directory of the evicted sessions
+    metrics : Metrics
+        The counters of the requests
+    """
+
+    def __init__(self, directory, idle_seconds=IDLE_SECONDS, max_live=MAX_LIVE, seed=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.idle_seconds = idle_seconds
+        self.max_live = max_live
+        self.rng = np.random.default_rng(seed)
+        self.sessions = {}
+        self.evicting = {}
+        self.closing = set()
+        self.metrics = Metrics()
+        self.counters = {"created": 0, "evicted": 0, "loaded": 0, "closed": 0}
+        # ids continue after the sessions saved by a previous run
+        saved = [os.path.splitext(name) for name in os.listdir(directory)]
+        saved = [int(stem) for stem, extension in saved
+                 if extension == SESSION_EXTENSION and stem.isdigit()]
+        self.next_id = max(saved, default=0) + 1
+
+    def path(self, session_id):
+        return os.path.join(self.directory, f"{session_id}{SESSION_EXTENSION}")
+
+    def session(self, session_id):
+        """
+        Get a session, loaded back when it was evicted
+        """
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.evicting.get(session_id)
+            if session is None:
+                if (not isinstance(session_id, int) or session_id in self.closing
+                        or not os.path.exists(self.path(session_id))):
+                    raise KeyError(f"no session {session_id}")
+                session = Session.load(self.path(session_id))
+                self.counters["loaded"] += 1
+            self.sessions[session_id] = session
+        session.last_active = time.monotonic()
+        return session
+
+    def new(self, seed=None, rows=DEFAULT_GRID_SIZE[0], cols=DEFAULT_GRID_SIZE[1],
+            mines=NUM_OF_MINES, layout=DEFAULT_LAYOUT):
+        if layout not in LAYOUTS:
+            raise ValueError(f"unknown layout {layout!r}, expected one of {LAYOUTS}")
+        seed = int(self.rng.integers(2 ** 63)) if seed is None else int(seed)
+        # saved as a signed 64 bit integer, see SESSION_HEADER
+        if not 0 <= seed < 2 ** 63:
+            raise ValueError(f"seed {seed} out of range, expected 0 <= seed < 2**63")
+        session = Session(seed, (int(rows), int(cols)), int(mines), layout)
+        session_id = self.next_id
+        self.next_id += 1
+        self.sessions[session_id] = session
+        self.counters["created"] += 1
+        return {"session": session_id, **session.state()}
+
+    def close(self, session_id):
+        self.session(session_id)
+        del self.sessions[session_id]
+        if self.evicting.pop(session_id, None) is not None:
+            # the worker thread may still write its file, removed by evict
+            self.closing.add(session_id)
+        if os.path.exists(self.path(session_id)):
+            os.remove(self.path(session_id))
+        self.counters["closed"] += 1
+        return {}
+
+    def handle_request(self, request):
+        """
+        Answer a request, see the module docstring
+        """
+        op = request.get("op")
+        if op == "new":
+            return self.new(**{key: request[key] for key in
+                               ("seed", "rows", "cols", "mines", "layout") if key in request})
+        if op == "stats":
+            return self.stats()
+        if op not in ("reveal", "flag", "undo", "state", "close"):
+            raise ValueError(f"unknown op {op!r}")
+        session_id = request.get("session")
+        if op == "close":
+            return self.close(session_id)
+        session = self.session(session_id)
+        if op == "state":
+            return session.state()
+        if op == "undo":
+            return session.diff(session.undo_last_move())
+        move = session.reveal if op == "reveal" else session.flag
+        return session.diff(move(request.get("row"), request.get("col")))
+
+    async def handle(self, reader, writer):
+        """
+        Answer the requests of a connection in order
+        """
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    break  # a line longer than MAX_LINE
+                if not line:
+                    break
+                start = time.perf_counter()
+                op = "invalid"
+                request = {}
+                try:
+                    request = json.loads(line)
+                    op = str(request.get("op"))
+                    response = self.handle_request(request)
+                except (ValueError, KeyError, TypeError, AttributeError) as error:
+                    self.metrics.errors += 1
+                    response = {"error": str(error.args[0] if error.args else error)}
+                    if not isinstance(request, dict):
+                        request = {}
+                if "id" in request:
+                    response["id"] = request["id"]
+                writer.write(json.dumps(response, separators=(",", ":")).encode() + b"\n")
+                self.metrics.record(op, time.perf_counter() - start)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def idle_sessions(self):
+        """
+        Get the ids of the sessions to evict: the idle ones, and the least
+        recently used ones beyond max_live
+        """
+        now = time.monotonic()
+        idle = [session_id for session_id, session in self.sessions.items()
+                if now - session.last_active >= self.idle_seconds]
+        extra = len(self.sessions) - len(idle) - self.max_live
+        if extra > 0:
+            idle = set(idle)
+            oldest = sorted((session.last_active, session_id)
+                            for session_id, session in self.sessions.items()
+                            if session_id not in idle)
+            idle.update(session_id for _, session_id in oldest[:extra])
+        return list(idle)
+
+    def write_sessions(self, sessions):
+        """
+        Save the sessions, returns the ids of the sessions that couldn't
+        be saved with their error
+        """
+        failed = {}
+        for session_id, session in sessions.items():
+            try:
+                session.save(self.path(session_id))
+            except (OSError, ValueError, struct.error) as error:
+                failed[session_id] = error
+        return failed
+
+    async def evict(self):
+        """
+        Write the idle sessions to the session directory in a worker
+        thread. A session requested meanwhile is simply live again, and
+        saved again by its next eviction. The sessions that couldn't be
+        written stay live, the sessions closed meanwhile lose their file
+        """
+        batch = {session_id: self.sessions.pop(session_id)
+                 for session_id in self.idle_sessions()}
+        if not batch:
+            return
+        self.evicting.update(batch)
+        try:
+            failed = await asyncio.to_thread(self.write_sessions, batch)
+        finally:
+            for session_id in batch:
+                self.evicting.pop(session_id, None)
+        for session_id in self.closing & batch.keys():
+            if os.path.exists(self.path(session_id)):
+                os.remove(self.path(session_id))
+        for session_id, error in failed.items():
+            print(f"session {session_id} not evicted: {error}", file=sys.stderr, flush=True)
+            if session_id not in self.closing and session_id not in self.sessions:
+                self.sessions[session_id] = batch[session_id]
+        self.closing -= batch.keys()
+        self.counters["evicted"] += len(batch) - len(failed)
+
+    def stats(self):
+        return {
+            **self.metrics.summary(),
+            "live": len(self.sessions),
+            "live_bytes": sum(3 * session.board.nbytes for session in self.sessions.values()),
+            **self.counters,
+        }
+
+    async def maintain(self, report=None):
+        """
+        Evict the idle sessions and sample the throughput every
+        SWEEP_INTERVAL, and print the stats every report seconds
+        """
+        reported = time.monotonic()
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            self.metrics.sample()
+            await self.evict()
+            if report and time.monotonic() - reported >= report:
+                reported = time.monotonic()
+                stats = self.stats()
+                latency = stats["latency"].get("reveal", {})
+                print(f"{stats['throughput']:8.0f} req/s  live {stats['live']:6d}  "
+                      f"evicted {stats['evicted']:6d}  loaded {stats['loaded']:6d}  "
+                      f"reveal p50 {latency.get('p50_ms', 0):.2f} ms "
+                      f"p99 {latency.get('p99_ms', 0):.2f} ms", flush=True)
+
+
+async def serve(server, host=DEFAULT_HOST, port=DEFAULT_PORT, report=None):
+    """
+    Serve the games until cancelled
+    """
+    listener = await asyncio.start_server(server.handle, host, port, limit=MAX_LINE)
+    print(f"serving on {host}:{listener.sockets[0].getsockname()[1]}, "
+          f"sessions in {server.directory}", flush=True)
+    async with listener:
+        await asyncio.gather(listener.serve_forever(), server.maintain(report))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Host many Minesweeper games")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--sessions-dir",
+                        help="directory of the evicted sessions, a temporary one by default")
+    parser.add_argument("--idle-seconds", type=float, default=IDLE_SECONDS)
+    parser.add_argument("--max-live", type=int, default=MAX_LIVE)
+    parser.add_argument("--seed", type=int, help="seed of the seeds of new sessions")
+    parser.add_argument("--report", type=float, help="print the stats every REPORT seconds")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as temporary:
+        server = GameServer(args.sessions_dir or temporary, args.idle_seconds,
+                            args.max_live, args.seed)
+        try:
+            asyncio.run(serve(server, args.host, args.port, args.report))
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
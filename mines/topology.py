@@ -0,0 +1,160 @@
+"""
+This module precomputes the neighbors of every cell of a board shape.
+The neighbors are stored CSR style over the row-major cell indices: the
+neighbors of cell k are indices[indptr[k]:indptr[k + 1]], so engines look
+them up instead of redoing the bounds checks for every cell.
+
+Three layouts are supported:
+
+- "rect": the 8 surrounding cells, clipped at the edges
+- "torus": the 8 surrounding cells, wrapping around the edges
+- "hex": the 6 cells around a hexagon, the odd rows being shifted right
+  by half a cell ("odd-r" offset coordinates), clipped at the edges
+
+A cell is never its own neighbor and has each neighbor once, which only
+matters on tori thinner than 3 cells. Topologies are cached per shape and
+layout by get_topology, so every engine shares the same tables.
+"""
+
+import functools
+import numpy as np
+
+DEFAULT_LAYOUT = "rect"
+SQUARE_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+# the offsets of the even and odd rows of a hex board
+HEX_OFFSETS = (
+    [(-1, -1), (-1, 0), (0, -1), (0, 1), (1, -1), (1, 0)],
+    [(-1, 0), (-1, 1), (0, -1), (0, 1), (1, 0), (1, 1)],
+)
+LAYOUTS = ("rect", "torus", "hex")
+
+
+class Topology:
+    """
+    A class to represent the neighbors of every cell of a board
+
+    Attributes
+    ----------
+    shape : tuple
+        The (rows, cols) of the board
+    layout : str
+        One of LAYOUTS
+    indptr : np.ndarray
+        The start of the neighbors of every cell in indices, plus the end
+    indices : np.ndarray
+        The row-major indices of the neighbors, cell after cell
+    owners : np.ndarray
+        The cell of every entry of indices
+    degree : np.ndarray
+        The number of neighbors of every cell
+    """
+
+    def __init__(self, shape, layout=DEFAULT_LAYOUT):
+        if layout not in LAYOUTS:
+            raise ValueError(f"unknown layout {layout!r}, expected one of {LAYOUTS}")
+        self.shape = tuple(shape)
+        self.layout = layout
+        rows, cols = self.shape
+        i, j = np.divmod(np.arange(rows * cols), cols)
+        table = np.stack([
+            self.offset_cells(i, j, column) for column in range(len(self.offsets(0)))
+        ], axis=1)
+        if layout == "torus" and min(rows, cols) < 3:
+            # wrapped offsets repeat cells on thin tori
+            cell = np.arange(rows * cols)[:, None]
+            table = np.where(table == cell, -1, table)
+            table = np.sort(table, axis=1)
+            table[:, 1:][table[:, 1:] == table[:, :-1]] = -1
+        valid = table >= 0
+        self.degree = valid.sum(axis=1)
+        self.indptr = np.concatenate([[0], np.cumsum(self.degree)])
+        self.indices = table[valid]
+        self.owners = np.repeat(np.arange(rows * cols), self.degree)
+
+    def offsets(self, row):
+        if self.layout == "hex":
+            return HEX_OFFSETS[row % 2]
+        return SQUARE_OFFSETS
+
+    def offset_cells(self, i, j, column):
+        """
+        Get the index of the column-th neighbor of the cells (i, j), -1
+        outside the board
+        """
+        rows, cols = self.shape
+        dy, dx = np.array([self.offsets(row)[column] for row in (0, 1)])[i % 2].T
+        ni, nj = i + dy, j + dx
+        if self.layout == "torus":
+            return ni % rows * cols + nj % cols
+        inside = (ni >= 0) & (ni < rows) & (nj >= 0) & (nj < cols)
+        return np.where(inside, ni * cols + nj, -1)
+
+    @property
+    def size(self):
+        return self.shape[0] * self.shape[1]
+
+    def neighbors(self, i, j):
+        """
+        Get the (row, col) of the neighbors of cell (i, j)
+        """
+        cols = self.shape[1]
+        cell = i * cols + j
+        return [divmod(int(k), cols) for k in self.indices[self.indptr[cell]:self.indptr[cell + 1]]]
+
+    def neighbor_sum(self, values):
+        """
+        Sum values over the neighbors of every cell, values has the board
+        shape in its last two axes. Square layouts are summed with shifted
+        views of a padded copy, faster than the table
+        """
+        if values.dtype == bool:
+            values = values.astype(np.int8)
+        return self.reduce(values, np.add, 0)
+
+    def neighbor_max(self, values, fill):
+        """
+        Get the largest value over the neighbors of every cell, like
+        neighbor_sum, fill for the cells without neighbors
+        """
+        return self.reduce(values, np.maximum, fill)
+
+    def reduce(self, values, ufunc, fill):
+        if self.layout == "rect" or (self.layout == "torus" and min(self.shape) >= 3):
+            return self.stencil_reduce(values, ufunc, fill)
+        return self.table_reduce(values, ufunc, fill)
+
+    def stencil_reduce(self, values, ufunc, fill):
+        rows, cols = self.shape
+        pad = [(0, 0)] * (values.ndim - 2) + [(1, 1), (1, 1)]
+        if self.layout == "torus":
+            padded = np.pad(values, pad, mode="wrap")
+        else:
+            padded = np.pad(values, pad, mode="constant", constant_values=fill)
+        total = np.full(values.shape, fill, dtype=values.dtype)
+        for dy, dx in SQUARE_OFFSETS:
+            ufunc(total, padded[..., 1 + dy:1 + dy + rows, 1 + dx:1 + dx + cols], out=total)
+        return total
+
+    def table_reduce(self, values, ufunc, fill):
+        flat = values.reshape(values.shape[:-2] + (self.size,))
+        if len(self.indices) == 0:
+            return np.full(values.shape, fill, dtype=values.dtype)
+        # reduceat reads one value for empty segments, overwritten below
+        starts = np.minimum(self.indptr[:-1], len(self.indices) - 1)
+        reduced = ufunc.reduceat(flat[..., self.indices], starts, axis=-1)
+        reduced[..., self.degree == 0] = fill
+        return reduced.reshape(values.shape)
+
+    def dilate(self, mask):
+        """
+        Expand a boolean mask to the neighbors of its cells
+        """
+        return mask | (self.neighbor_sum(mask) > 0)
+
+
+@functools.lru_cache(maxsize=32)
+def get_topology(shape, layout=DEFAULT_LAYOUT):
+    """
+    Get the shared topology of a board shape
+    """
+    return Topology(tuple(shape), layout)